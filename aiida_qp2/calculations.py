@@ -7,6 +7,7 @@ Register calculations via the "aiida.calculations" entry point in setup.json.
 
 # needed in _unpack function
 from collections.abc import Sequence
+import shlex
 
 from aiida.common import CalcInfo, CodeInfo
 from aiida.engine import CalcJob
@@ -14,6 +15,8 @@ from aiida.orm import Dict, Float, Code, Str, StructureData, SinglefileData
 from aiida.plugins import DataFactory
 from pymatgen.core.periodic_table import Element
 
+from aiida_qp2.utils.timings import TIMINGS_FILE, step_function
+
 
 class QP2Calculation(CalcJob):
     """ AiiDA calculation plugin wrapping the Quantum Package code.
@@ -84,6 +87,9 @@ class QP2Calculation(CalcJob):
                     help='The wave function file (EZFIO or TREXIO)')
         spec.output_node = 'output_wavefunction'
 
+        spec.output('output_job_timings', valid_type=Dict, required=False,
+                    help='Wall/CPU time and peak memory of each step of the job script')
+
         spec.exit_code(100, 'ERROR_NO_RETRIEVED_FOLDER', message='The retrieved folder data node could not be accessed.')
         spec.exit_code(300, 'ERROR_MISSING_OUTPUT_FILES', message='Calculation did not produce all expected output files.')
         spec.exit_code(400, 'ERROR_MISSING_ENERGY', message='Energy value is not present in the output file.')
@@ -170,7 +176,9 @@ class QP2Calculation(CalcJob):
 
         # retrieve_list will copy the files from the remote machine to the local one (where AiiDA runs)
         calcinfo.retrieve_list = [self.metadata.options.output_filename]
-        calcinfo.retrieve_list.append(f'{output_wf_basename}.tar.gz')
+        calcinfo.retrieve_list.append(TIMINGS_FILE)
+        # the output wavefunction is created from the file itself by the parser, it is not kept in `retrieved`
+        calcinfo.retrieve_temporary_list = [f'{output_wf_basename}.tar.gz']
 
         # Create the XYZ file for QP_INIT
         if 'structure' in self.inputs:
@@ -214,8 +222,8 @@ class QP2Calculation(CalcJob):
         # Extract the list of commands to be executed after the Quantum Package
         append_commands = parameters['qp_append'] if 'qp_append' in parameters.keys() else []
 
-        # Prepend `qp` to the commands from the `parameters['qp_commands']` list
-        qp_commands = [f'qp {command}' for command in todo_commands]
+        # Prepend `qp` to the commands from the `parameters['qp_commands']` list, each command being a timed step
+        qp_commands = [f'_aiida_step {shlex.quote(command)} qp {command}' for command in todo_commands]
 
         # OPTIONAL build str with command line options for `qp create_ezfio` (in case StructureData is provided)
         if QP_INIT:
@@ -232,16 +240,18 @@ class QP2Calculation(CalcJob):
         input_list = [
             '#!/bin/bash',
             'set -e',
+            'AIIDA_WORKDIR=$(pwd)',
+            step_function().rstrip(),
             '\n'.join(prepend_commands)
             ]
 
         # preprocess the wavefunction file
         if QP_INIT:
             # create the wavefunction file
-            input_list.append(create_ezfio_command)
+            input_list.append(f'_aiida_step create_ezfio {create_ezfio_command}')
         else:
             # extract the provided wavefunction file
-            input_list.append(f'tar -zxf {input_wf_basename}.tar.gz')
+            input_list.append(f'_aiida_step unpack tar -zxf {input_wf_basename}.tar.gz')
             input_list.append(f'rm -- {input_wf_basename}.tar.gz')
 
 
@@ -253,7 +263,7 @@ class QP2Calculation(CalcJob):
         input_list.append('\n'.join(append_commands))
 
         # ALWAYS tar the final wavefunction file to be stored in the data provenance
-        input_list.append(f'tar -zcf {output_wf_basename}.tar.gz {output_wf_basename}')
+        input_list.append(f'_aiida_step pack tar -zcf {output_wf_basename}.tar.gz {output_wf_basename}')
         input_list.append(f'rm -rf -- {output_wf_basename}/')
         # 2 directories can be produced when exporting to TREXIO, so clean both
         if (not input_wf_basename is None) and (not output_wf_basename in input_wf_basename):
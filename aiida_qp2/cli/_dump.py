@@ -2,17 +2,14 @@
 import click
 
 from aiida import cmdline
-from aiida.cmdline.commands.cmd_data import verdi_data
 from aiida.cmdline.groups import VerdiCommandGroup
 from aiida.cmdline.params import options, types
 from aiida.cmdline.utils import decorators, echo
 
 from .cli_helpers import wf_option, code_option
 
-from . import cli_root
 
-
-@cli_root.group('dump')
+@click.group('dump', cls=VerdiCommandGroup)
 def dump():
     """
     Dump the data to the file system
@@ -55,12 +52,23 @@ def dump_wavefunction(wavefunction, extract):
 
 @dump.command('output')
 @wf_option
+@click.option('--head', type=click.INT, default=None, help='Only show the first N lines')
+@click.option('--tail', type=click.INT, default=None, help='Only show the last N lines')
+@click.option('--grep', 'pattern', type=click.STRING, default=None, help='Only show the lines matching this regular expression')
+@click.option('--section',
+              type=click.STRING,
+              default=None,
+              help='Start at the last section: `summary` (final summary of the run) or a regular expression')
 @decorators.with_dbenv()
-def dump_output(wavefunction):
+def dump_output(wavefunction, head, tail, pattern, section):
     """Show calculation output"""
 
+    import collections
+    import itertools
+    import re
     from aiida.orm import QueryBuilder, CalcJobNode, FolderData, SinglefileData as Wavefunction
-    from aiida.plugins import CalculationFactory
+    from aiida_qp2.utils import output_stream
+    from aiida_qp2.utils.output_parser import iter_lines
 
     if wavefunction is None:
         echo.echo_critical('Please specify a wavefunction')
@@ -70,12 +78,16 @@ def dump_output(wavefunction):
         echo.echo_critical('Invalid wavefunction')
         return
 
+    if head is not None and tail is not None:
+        echo.echo_critical('--head and --tail are exclusive')
+        return
+
     qb = QueryBuilder()
     qb.append(Wavefunction, filters={'id': wavefunction.pk}, tag='wf')
     qb.append(CalcJobNode,
               with_outgoing='wf',
               tag='calc',
-              project=['attributes.output_filename'])
+              project=['attributes.output_filename', '*'])
     qb.append(FolderData,
               with_incoming='calc',
               edge_filters={'label': 'retrieved'},
@@ -86,10 +98,48 @@ def dump_output(wavefunction):
         echo.echo_error('No output found')
         return
 
-    filename, rf = qb.first()
-
-    with rf.open(filename, mode='r') as handle:
-        echo.echo(handle.read())
+    filename, calc, rf = qb.first()
+
+    if section is not None:
+        parameters = calc.inputs.parameters if 'parameters' in calc.inputs else None
+        run_type = parameters.get('run_type') if hasattr(parameters, 'get') else None
+        try:
+            section = output_stream.get_section_pattern(section, run_type)
+        except ValueError as exception:
+            echo.echo_critical(str(exception))
+            return
+
+    for option in (pattern, section):
+        if option is not None:
+            try:
+                re.compile(option)
+            except re.error as exception:
+                echo.echo_critical(f'Invalid regular expression {option}: {exception}')
+                return
+
+    with rf.open(filename, mode='rb') as handle:
+        if section is not None:
+            lines = output_stream.read_section(handle, section)
+        elif tail is not None and pattern is None:
+            # Read from the end of the object
+            lines = output_stream.tail(handle, tail)
+        else:
+            lines = iter_lines(handle, output_stream.BLOCK_SIZE)
+
+        if pattern is not None:
+            lines = output_stream.grep(lines, pattern)
+        if tail is not None:
+            lines = collections.deque(lines, maxlen=tail)
+        if head is not None:
+            lines = itertools.islice(lines, head)
+
+        empty = True
+        for line in lines:
+            empty = False
+            echo.echo(line)
+
+    if empty and section is not None:
+        echo.echo_error('Section not found')
 
 
 @dump.command('input')
@@ -133,4 +183,63 @@ def dump_input(wavefunction):
     echo.echo(buffer.read())
 
 
-cli_root.add_command(dump)
+@dump.command('project')
+@click.option('--project',
+              '-p',
+              'project_pk',
+              type=click.INT,
+              default=None,
+              help='Project to export (default: the active project)')
+@click.option('--filters',
+              '-f',
+              type=click.STRING,
+              default=None,
+              help='QueryBuilder filters (JSON) selecting the wavefunctions to export, instead of a project')
+@click.option('--output',
+              '-o',
+              type=click.Path(file_okay=False),
+              default=None,
+              help='Export directory (default: the name of the project)')
+@click.option('--jobs',
+              '-j',
+              type=click.INT,
+              default=4,
+              show_default=True,
+              help='Number of parallel copies')
+@decorators.with_dbenv()
+def dump_project(project_pk, filters, output, jobs):
+    """
+    Export the wavefunctions of a project with their inputs and outputs
+
+    The files already exported (same SHA-256) are skipped: running the
+    command again updates the export, or resumes an interrupted one.
+    """
+    import json
+    from aiida.orm import load_node
+    from .cli_helpers import get_active_project
+    from .export import Exporter, plan_export, project_wavefunctions
+
+    if filters is not None:
+        try:
+            filters = json.loads(filters)
+        except ValueError as exception:
+            echo.echo_critical(f'Invalid filters: {exception}')
+            return
+        filters = {'and': [filters, {'attributes.wavefunction': True}]}
+        output = output or 'qp2_export'
+    else:
+        project = load_node(project_pk) if project_pk is not None else get_active_project()
+        if project is None:
+            echo.echo_critical('Please specify a project or activate one')
+            return
+        filters = {'id': {'in': project_wavefunctions(project.pk)}}
+        output = output or project.base.extras.get('name', str(project.pk))
+
+    files = plan_export(filters)
+    echo.echo(f'Exporting {len(files)} files to {output} ...')
+
+    exporter = Exporter(output, jobs=jobs)
+    size = exporter.export(files)
+
+    echo.echo_success(f'Copied {len(exporter.copied)} files ({size / 1024**2:.1f} MB), '
+                      f'{len(exporter.skipped)} already up to date')
@@ -3,17 +3,14 @@
 import click
 
 from aiida import cmdline
-from aiida.cmdline.commands.cmd_data import verdi_data
 from aiida.cmdline.groups import VerdiCommandGroup
 from aiida.cmdline.params import options, types
 from aiida.cmdline.utils import decorators, echo
 
 from .cli_helpers import wf_option, code_option
 
-from . import cli_root
 
-
-@cli_root.group('edit')
+@click.group('edit', cls=VerdiCommandGroup)
 def edit():
     """
     Edit a Wavefunction
@@ -73,8 +70,11 @@ def edit_operation(wavefunction, get, set):
 
 @edit.command('interactive')
 @wf_option
+@click.option('--reset',
+              is_flag=True,
+              help='Extract the wavefunction again, dropping the changes not saved')
 @decorators.with_dbenv()
-def edit_interactive(wavefunction):
+def edit_interactive(wavefunction, reset):
     """
     Edit the wavefunction interactively
     """
@@ -83,57 +83,61 @@ def edit_interactive(wavefunction):
         echo.echo_critical('No wavefunction specified')
         return
 
-    _WF_NAME = 'wavefunction.wf.tar.gz'
-    from aiida_qp2.utils.ezfio import ezfio
-    import tempfile
     import tarfile
-    import os
+    from aiida_qp2.utils.ezfio import ezfio
+    from aiida_qp2.utils.ezfio_workspace import Workspace, attribute_name
     from IPython import start_ipython
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        wf_path = os.path.join(temp_dir, _WF_NAME)
-        with open(wf_path, 'wb') as handle, \
-             wavefunction.open(mode='rb') as wavefunction_handle:
-            handle.write(wavefunction_handle.read())
-        # untar the wavefunction
-        with tarfile.open(wf_path, 'r:gz') as tar:
-            tar.extractall(temp_dir)
-        ezfio_path = os.path.join(temp_dir, 'aiida.ezfio')
-        ezfio.set_file(ezfio_path)
-        echo.echo('')
-        echo.echo('#' * 80)
-        echo.echo('')
-        echo.echo(
-            'You can now edit the wavefunction (wf) using the ezfio object')
-        echo.echo('')
-        echo.echo("Example: wf.set_jastrow_j2e_type('Mu')")
-        echo.echo("         wf.set_jastrow_j1e_type('None')")
-        echo.echo("         wf.get_jastrow_j2e_type('Mu')")
-        echo.echo("         [Out]: 'Mu'")
-        echo.echo('')
-        echo.echo_warning(
-            'This is not (yet) a calcjob! The changes are not logged, and the provenance is not tracked'
-        )
-        echo.echo('')
-        echo.echo('#' * 80)
-        echo.echo('')
-
-        start_ipython(argv=[], user_ns={'wf': ezfio})
-
-        click.confirm('Do you want to save the changes?',
-                      default=True,
-                      abort=True)
-        from aiida.orm import SinglefileData
-
-        with tarfile.open(wf_path, 'w:gz') as tar:
-            tar.add(ezfio_path, arcname='aiida.ezfio')
-        with open(wf_path, 'rb') as handle:
-            wavefunction = SinglefileData(file=handle)
-            wavefunction.base.attributes.all['wavefunction'] = True
-            wavefunction.store()
+    def describe(changed, deleted):
+        names = {attribute_name(name) for name in changed + deleted} - {None}
+        return ', '.join(sorted(names)) or f'{len(changed) + len(deleted)} file(s)'
 
-        echo.echo_success(
-            f'Wavefunction edited and stored (pk={wavefunction.pk})')
+    try:
+        workspace = Workspace.open(wavefunction, reset=reset)
+    except tarfile.TarError as exception:
+        echo.echo_critical(f'Cannot extract the wavefunction {wavefunction.pk}: {exception}')
+        return
+    changed, deleted = workspace.dirty()
+    if changed or deleted:
+        echo.echo_warning(f'Changes of a previous session were not saved: {describe(changed, deleted)}')
+        if not click.confirm('Do you want to keep them?', default=True):
+            with wavefunction.open(mode='rb') as handle:
+                workspace.restore(changed + deleted, handle)
+
+    ezfio.set_file(workspace.ezfio_path)
+    echo.echo('')
+    echo.echo('#' * 80)
+    echo.echo('')
+    echo.echo('You can now edit the wavefunction (wf) using the ezfio object')
+    echo.echo('')
+    echo.echo("Example: wf.set_jastrow_j2e_type('Mu')")
+    echo.echo("         wf.set_jastrow_j1e_type('None')")
+    echo.echo("         wf.get_jastrow_j2e_type('Mu')")
+    echo.echo("         [Out]: 'Mu'")
+    echo.echo('')
+    echo.echo(f'Workspace: {workspace.ezfio_path}')
+    echo.echo('')
+    echo.echo('#' * 80)
+    echo.echo('')
+
+    start_ipython(argv=[], user_ns={'wf': ezfio})
+
+    changed, deleted = workspace.dirty()
+    if not changed and not deleted:
+        echo.echo('No changes')
+        return
+
+    echo.echo(f'Changed: {describe(changed, deleted)}')
+    if not click.confirm('Do you want to save the changes?', default=True):
+        echo.echo('The changes are kept in the workspace for the next session (--reset to drop them)')
+        return
+
+    from aiida_qp2.utils.wavefunction_handler import wavefunction_editor
+
+    ret = wavefunction_editor(wavefunction, workspace.changes_folder(changed, deleted))
+    # The workspace holds the content of the new wavefunction: no extraction at the next session
+    workspace.adopt(ret['wavefunction'])
+    echo.echo_success(f'Wavefunction edited and stored (pk={ret["wavefunction"].pk})')
 
 
 @edit.command('from_file')
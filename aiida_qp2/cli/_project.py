@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""Commands managing the qp2 projects"""
+
+import click
+
+from aiida import cmdline
+from aiida.cmdline.utils import decorators, echo
+
+from . import _QP_GROUP
+
+
+@click.command('create')
+@click.argument('name', type=click.STRING)
+@click.option('--structure',
+              '-s',
+              type=click.STRING,
+              required=True,
+              help='Structure to use')
+@click.option('--basis_set',
+              '-b',
+              type=click.STRING,
+              required=False,
+              help='Basis set to use')
+@cmdline.params.options.CODE()
+@decorators.with_dbenv()
+def create(name, structure, basis_set, code):
+    """Create a qp2 project"""
+
+    if code is None:
+        echo.echo_critical('Please specify a code')
+        return
+
+    if not structure:
+        echo.echo_critical('Please specify a structure')
+        return
+
+    # Check if structure is not a path
+    import pathlib
+    from ase.io import read
+
+    if pathlib.Path(structure).exists():
+        from aiida.orm import StructureData
+        structure = StructureData(ase=read(structure))
+    else:
+        from aiida.orm import load_node
+        try:
+            structure = load_node(structure)
+        except Exception as e:
+            echo.echo_critical(f'Error loading structure: {structure}')
+            return
+
+        if not isinstance(structure, StructureData):
+            echo.echo_critical(f'Invalid structure: {structure}')
+            return
+
+    echo.echo(f'Creating project {name} ...')
+
+    # Find the group
+    from aiida.orm import QueryBuilder, Group, Dict
+
+    qb = QueryBuilder()
+    qb.append(Group, filters={'label': _QP_GROUP})
+    group = qb.first()
+    if group is None:
+        echo.echo_success('Group qp2 does not exist, creating it')
+        group = Group(label=_QP_GROUP)
+        group.store()
+        group.base.extras.set('active_project', None)
+    else:
+        group = group[0]
+
+    inputs = {
+        'code': code,
+        'structure': structure,
+        'parameters': Dict(dict={})
+    }
+
+    if basis_set:
+        from aiida.orm import Str
+        inputs['basis_set'] = Str(basis_set)
+
+    from aiida.plugins import CalculationFactory
+    from aiida_qp2.utils.project import HEAD_EXTRA
+    Create = CalculationFactory('qp2.create')
+    calc = Create(inputs=inputs)
+
+    from aiida.engine import run
+    ret = run(calc)
+
+    ret['wavefunction'].base.extras.set('name', name)
+    ret['wavefunction'].base.extras.set('default_code', code.pk)
+    ret['wavefunction'].base.extras.set(HEAD_EXTRA, ret['wavefunction'].uuid)
+
+    group.add_nodes(ret['wavefunction'])
+
+    echo.echo_success(
+        f"Project {name} created with pk={ret['wavefunction'].pk}")
+
+    click.confirm('Do you want to activate this project?', abort=True)
+    group.base.extras.set('active_project', ret['wavefunction'].pk)
+
+    echo.echo_success(f'Activated {name}')
+
+
+@click.command('list')
+@decorators.with_dbenv()
+def list_projects():
+    """List qp2 projects"""
+
+    from aiida.orm import load_group
+    from .cli_helpers import iter_projects
+
+    try:
+        active_project = load_group(_QP_GROUP).base.extras.get('active_project', None)
+    except Exception as e:
+        echo.echo_critical('Group qp2 does not exist')
+        return
+
+    echo.echo('List of qp2 projects:')
+    echo.echo('')
+
+    # Printed as the rows arrive, hence the fixed column widths
+    columns = [(' ', 1), ('Name', 20), ('ID', 8), ('Time', 19), ('User', 24),
+               ('Formula', 10), ('Def. code', 20), ('# wfs', 5)]
+    row_format = '  '.join(f'{{:<{width}}}' for _, width in columns)
+
+    echo.echo(row_format.format(*[header for header, _ in columns]).rstrip())
+    echo.echo(row_format.format(*['-' * width for _, width in columns]))
+
+    n = -1
+    for n, project in enumerate(iter_projects()):
+        line = row_format.format('*' if project['pk'] == active_project else '',
+                                 project['name'], project['pk'],
+                                 project['ctime'].strftime('%Y-%m-%d %H:%M:%S'),
+                                 project['user'], project['formula'],
+                                 project['code'] or '', project['num_wf']).rstrip()
+        echo.echo(line if n % 2 == 0 else f'\033[1m{line}\033[0m')
+
+    echo.echo('')
+    echo.echo(f'{n + 1} project(s)')
+
+
+@click.command('activate')
+@click.argument('pk', type=click.INT)
+@decorators.with_dbenv()
+def activate(pk):
+    """Activate a qp2 project"""
+
+    from aiida.orm import QueryBuilder, Group, SinglefileData as Wavefunction, load_group
+
+    try:
+        group = load_group(_QP_GROUP)
+    except Exception as e:
+        echo.echo_critical('Group qp2 does not exist')
+        return
+
+    qb = QueryBuilder()
+    qb.append(Group, filters={'label': _QP_GROUP}, tag='group')
+    qb.append(Wavefunction,
+              filters={'id': pk},
+              with_group='group',
+              tag='wavefunction')
+
+    if qb.count() == 1:
+        echo.echo_success(f"Activated {qb.first()[0].base.extras.all['name']}")
+        group.base.extras.set('active_project', pk)
+    else:
+        echo.echo_error(f'Project with pk={pk} not found')
+
+
+@click.command('deactivate')
+@decorators.with_dbenv()
+def deactivate():
+    """Deactivate a qp2 project"""
+
+    from aiida.orm import QueryBuilder, Group, SinglefileData as Wavefunction, load_group
+
+    try:
+        group = load_group(_QP_GROUP)
+    except Exception as e:
+        echo.echo_critical('Group qp2 does not exist')
+        return
+
+    group.base.extras.set('active_project', None)
+    echo.echo_success('Deactivated project')
+
+
+@click.command('set_default_code')
+@click.argument('code', type=click.STRING)
+@decorators.with_dbenv()
+def set_default_code(code):
+    """Set default code for active qp2 project"""
+
+    from aiida.orm import QueryBuilder, Group, SinglefileData as Wavefunction, load_code, load_group
+
+    try:
+        code = load_code(code)
+    except:
+        echo.echo_error(f'Code {code} not found')
+        return
+
+    try:
+        group = load_group(_QP_GROUP)
+    except Exception as e:
+        echo.echo_critical('Group qp2 does not exist')
+        return
+
+    qb = QueryBuilder()
+    qb.append(Group, filters={'label': _QP_GROUP}, tag='group')
+    qb.append(Wavefunction,
+              filters={'id': group.base.extras.all['active_project']},
+              with_group='group',
+              tag='wavefunction')
+
+    if qb.count() == 1:
+        wavefunction, = qb.first()
+        echo.echo(
+            f"Setting default code for {wavefunction.base.extras.all['name']} to {code}"
+        )
+        wavefunction.base.extras.set('default_code', code.pk)
+    else:
+        echo.echo_error(f'No active project')
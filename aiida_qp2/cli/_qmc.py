@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import click
+from aiida.cmdline.groups import VerdiCommandGroup
+from aiida.cmdline.utils import decorators, echo
+
+from .cli_helpers import wf_option
+
+
+@click.group('qmc', cls=VerdiCommandGroup)
+def qmc():
+    """QMC=Chem analysis commands"""
+    pass
+
+
+def _get_blocks(node):
+    """Return the QMC=Chem blocks of a calculation, of its output wavefunction or the blocks themselves"""
+    from aiida.orm import ArrayData, CalcJobNode
+
+    if isinstance(node, ArrayData):
+        return node
+    if not isinstance(node, CalcJobNode):
+        node = node.creator
+    if node is None or 'output_blocks' not in node.outputs:
+        return None
+    return node.outputs.output_blocks
+
+
+def _format(value, spec='.8f'):
+    """Format a result of the analysis, `-` if it could not be computed"""
+    return '-' if value is None else format(value, spec)
+
+
+@qmc.command('stats')
+@click.argument('nodes', nargs=-1, type=click.STRING)
+@wf_option
+@click.option('--property',
+              '-p',
+              'name',
+              type=click.STRING,
+              default='E_loc',
+              show_default=True,
+              help='Property to analyse')
+@click.option('--target-error',
+              type=click.FLOAT,
+              default=None,
+              help='Estimate the number of blocks needed to reach this error')
+@click.option('--store',
+              is_flag=True,
+              help='Run the analysis as a calcfunction and store its results')
+@decorators.with_dbenv()
+def stats(nodes, wavefunction, name, target_error, store):
+    """
+    Reblocking analysis of QMC=Chem blocks
+
+    NODES are QMC=Chem calculations, their output wavefunctions or their
+    `output_blocks` (default: the current wavefunction). Several runs are
+    combined with an inverse-variance weighted mean.
+    """
+    from aiida.orm import load_node, Str
+    from aiida_qp2.utils.statistics import analyse_blocks, blocks_for_error, qmc_statistics
+
+    nodes = [load_node(node) for node in nodes] or [wavefunction]
+    if nodes == [None]:
+        echo.echo_critical('Please specify a wavefunction')
+
+    blocks = {}
+    for node in nodes:
+        array = _get_blocks(node)
+        if array is None:
+            echo.echo_critical(f'No QMC=Chem blocks found for node {node.pk}')
+        blocks[f'run_{array.pk}'] = array
+
+    try:
+        if store:
+            results = qmc_statistics(Str(name), **blocks)
+            echo.echo_success(f'Results stored in Dict<{results.pk}>')
+            results = results.get_dict()
+        else:
+            results = analyse_blocks(blocks, name)
+    except ValueError as exc:
+        echo.echo_critical(str(exc))
+
+    for label, run in results.get('runs', {next(iter(blocks)): results}).items():
+        echo.echo(f"{label}: {_format(run['mean'])} +/- {_format(run['error'])} ({run['n_blocks']} blocks, "
+                  f"naive error {_format(run['naive_error'])}, tau {_format(run['autocorrelation_time'], '.2f')})")
+        if not run['converged']:
+            echo.echo_warning('Too few blocks, the reblocking has not converged')
+        if target_error is not None and run['error'] is not None:
+            echo.echo(f'  {blocks_for_error(run, target_error)} blocks needed for +/- {target_error}')
+
+    if 'runs' in results:
+        echo.echo(f"{name}: {_format(results['mean'])} +/- {_format(results['error'])}")
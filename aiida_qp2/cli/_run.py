@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""Running the qp2 operations"""
+
+import click
+
+from aiida.cmdline.utils import decorators, echo
+
+from .cli_helpers import wf_option, code_option
+
+
+def _parse_sweeps(sweeps):
+    """
+    Expand the `--sweep KEY=v1,v2,...` options into a list of `(label, prepends)`.
+
+    `KEY` is a `qp set` section and keyword separated by a dot (e.g.
+    `determinants.n_det_max`), several sweeps are combined.
+    """
+    import itertools
+
+    axes = []
+    for sweep in sweeps:
+        key, sep, values = sweep.partition('=')
+        if not sep or '.' not in key or not values:
+            raise click.BadParameter(f'expected SECTION.KEYWORD=v1,v2,... not {sweep}', param_hint='--sweep')
+        section, keyword = key.split('.', 1)
+        axes.append([(f'{key}={value}', f'{section} {keyword} {value}') for value in values.split(',')])
+
+    return [(' '.join(label for label, _ in point), [prepend for _, prepend in point])
+            for point in itertools.product(*axes)]
+
+
+def _echo_results(outputs):
+    """Echo the energy of a finished run (`outputs` is a dict or the outputs of a node)"""
+    if 'output_wavefunction' in outputs and \
+       outputs['output_wavefunction'].base.attributes.get('checkpoint', False):
+        echo.echo_warning(
+            'The run was interrupted, continue it with `aqp run --restart`')
+
+    if 'output_energy' in outputs:
+        energy_msg = f"Energy: {outputs['output_energy'].value}"
+        if 'output_energy_error' in outputs:
+            energy_msg += f" +/- {outputs['output_energy_error'].value}"
+        if 'output_number_of_blocks' in outputs:
+            energy_msg += f" (blocks: {outputs['output_number_of_blocks'].value})"
+        echo.echo(f'{energy_msg}')
+        return True
+    return False
+
+
+def _wait(nodes, interval):
+    """Follow the submitted calculations until they terminate (one query per poll)"""
+    import time
+    from aiida.orm import QueryBuilder, CalcJobNode
+
+    states = {}
+    running = {node.pk for node in nodes}
+    while running:
+        qb = QueryBuilder()
+        qb.append(CalcJobNode,
+                  filters={'id': {'in': sorted(running)}},
+                  project=['id', 'attributes.process_state', 'attributes.scheduler_state', 'attributes.exit_status'])
+        for pk, process_state, scheduler_state, exit_status in qb.all():
+            state = (process_state, scheduler_state, exit_status)
+            if state != states.get(pk):
+                states[pk] = state
+                status = scheduler_state or process_state
+                if process_state in ('finished', 'excepted', 'killed'):
+                    status = f'{process_state} [{exit_status}]'
+                    running.discard(pk)
+                echo.echo(f'{pk}: {status}')
+        if running:
+            time.sleep(interval)
+
+
+@click.command('run')
+@click.argument('operation', type=click.STRING)
+@code_option
+@wf_option
+@click.option('--dry-run', is_flag=True, help='Do not run the operation')
+@click.option('--prepend',
+              '-p',
+              type=click.STRING,
+              multiple=True,
+              help='Prepend to qp2 input')
+@click.option('--do-not-store-wf',
+              is_flag=True,
+              help='Do not store the wavefunction')
+@click.option('--trexio-bug-fix',
+              is_flag=True,
+              help='Fix bug where full path has to by specified in trexio_file'
+              )
+@click.option('--restart',
+              is_flag=True,
+              help='Continue from a checkpointed (partial) wavefunction')
+@click.option('--target-error',
+              type=click.FLOAT,
+              default=None,
+              help='Stop qmcchem once the error of E_loc is below this value')
+@click.option('--submit',
+              is_flag=True,
+              help='Submit to the daemon and return immediately')
+@click.option('--wait',
+              is_flag=True,
+              help='Submit to the daemon and follow the progress')
+@click.option('--sweep',
+              type=click.STRING,
+              multiple=True,
+              help='Submit a run per value: SECTION.KEYWORD=v1,v2,... (prepended as `qp set`)')
+@click.option('--interval',
+              type=click.INT,
+              default=10,
+              show_default=True,
+              help='Seconds between two polls with --wait')
+@click.argument('args', nargs=-1, type=click.UNPROCESSED)
+@decorators.with_dbenv()
+def run(operation, code, wavefunction, dry_run, prepend, do_not_store_wf,
+        trexio_bug_fix, restart, target_error, submit, wait, sweep, interval, args):
+    """Run a qp2 operation"""
+
+    echo.echo(f'Running operation {operation} ...')
+    echo.echo('')
+
+    if wavefunction is None:
+        echo.echo_critical(
+            'Please specify a wavefunction or activate a project')
+        return
+    else:
+        echo.echo(
+            f'Wavefunction: {wavefunction.pk} generated at {wavefunction.ctime}'
+        )
+
+    if code is None:
+        echo.echo_critical('Please specify a code')
+        return
+    else:
+        echo.echo(f'Code: {code.full_label}')
+
+    points = _parse_sweeps(sweep) if sweep else [(None, [])]
+    # The runs of a sweep run concurrently
+    submit = submit or wait or bool(sweep)
+
+    from aiida.plugins import CalculationFactory
+    from aiida.orm import Dict
+
+    Calc = CalculationFactory('qp2.run')
+
+    builders = []
+    for label, sweep_prepend in points:
+        builder = Calc.get_builder()
+        builder.wavefunction = wavefunction
+        builder.code = code
+        builder.parameters = Dict(
+            dict={
+                'run_type': operation,
+                'trexio_bug_fix': trexio_bug_fix,
+                'qp_prepend': [*prepend, *sweep_prepend],
+                'qp_append': ''.join(args),
+                'restart': restart
+            })
+
+        builder.metadata.options.store_wavefunction = not do_not_store_wf
+        if label is not None:
+            builder.metadata.label = label
+
+        if target_error is not None:
+            if operation != 'qmcchem':
+                echo.echo_critical('--target-error is only supported for qmcchem')
+                return
+            parameters = builder.parameters.get_dict()
+            parameters['qmcchem_target_error'] = target_error
+            builder.parameters = Dict(dict=parameters)
+            builder.monitors = {
+                'target_error':
+                Dict(dict={
+                    'entry_point': 'qp2.qmcchem_target_error',
+                    'minimum_poll_interval': 60
+                })
+            }
+        builders.append(builder)
+
+    if dry_run:
+        for label, _ in points:
+            if label is not None:
+                echo.echo(f'Sweep point: {label}')
+        echo.echo('Dry run, not running the operation')
+        return
+
+    if not submit:
+        from aiida.engine import run
+
+        ret = run(builders[0])
+        if _echo_results(ret):
+            echo.echo('')
+            echo.echo_success(f'Operation {operation} completed')
+        return
+
+    from aiida.engine import submit as submit_to_daemon
+    from aiida.engine.daemon.client import get_daemon_client
+
+    if not get_daemon_client().is_daemon_running:
+        echo.echo_critical('The daemon is not running, start it with `verdi daemon start`')
+        return
+
+    nodes = []
+    for (label, _), builder in zip(points, builders):
+        node = submit_to_daemon(builder)
+        nodes.append(node)
+        echo.echo(f'Submitted {node.pk}' + (f' ({label})' if label is not None else ''))
+
+    if not wait:
+        echo.echo('')
+        echo.echo('Follow them with `aqp show` or `verdi process list`')
+        return
+
+    _wait(nodes, interval)
+    echo.echo('')
+    failed = 0
+    for (label, _), node in zip(points, nodes):
+        name = f'{node.pk}' + (f' ({label})' if label is not None else '')
+        if not node.is_finished_ok:
+            failed += 1
+            echo.echo_error(f'{name}: {node.process_state.value} [{node.exit_status}], see `verdi process report {node.pk}`')
+            continue
+        echo.echo(name)
+        _echo_results(node.outputs)
+
+    if failed:
+        echo.echo_critical(f'{failed} of {len(nodes)} run(s) of {operation} failed')
+    echo.echo_success(f'Operation {operation} completed')
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Showing the history of the active project"""
+
+import click
+
+from aiida.cmdline.utils import decorators
+
+
+@click.command('show')
+@click.option('--style',
+              '-s',
+              type=click.Choice(['plain', 'tree', 'graph'],
+                                case_sensitive=False),
+              default='tree',
+              help='Style of the output')
+@click.option('--max-depth',
+              type=click.INT,
+              default=None,
+              help='Summarize the wavefunctions deeper in the tree')
+@click.option('--max-children',
+              type=click.INT,
+              default=None,
+              help='Summarize the children of a wavefunction beyond this number')
+@click.option('--collapse',
+              type=click.INT,
+              default=5,
+              show_default=True,
+              help='Collapse linear chains of at least this many wavefunctions (0: never)')
+@click.option('--energy-below',
+              type=click.FLOAT,
+              default=None,
+              help='Only show the wavefunctions with a lower energy (and their ancestors)')
+@click.option('--run-type',
+              type=click.STRING,
+              default=None,
+              help='Only show the wavefunctions computed by this run type (and their ancestors)')
+@click.option('--bars/--no-bars', default=True, help='Show the energy bars')
+@click.option('--pager/--no-pager', default=False, help='Page the output')
+@decorators.with_dbenv()
+def show(style, max_depth, max_children, collapse, energy_below, run_type, bars, pager):
+    """Show active qp2 project"""
+    from .show import show_all, TreeOptions
+    options = TreeOptions(max_depth=max_depth,
+                          max_children=max_children,
+                          min_chain=collapse,
+                          energy_below=energy_below,
+                          run_type=run_type,
+                          bar_width=40 if bars else 0)
+    show_all(style, options, pager)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Status of the calculations of the active project"""
+
+import click
+
+from aiida.cmdline.utils import decorators, echo
+
+
+@click.command('status')
+@click.option('--project',
+              'project_pk',
+              type=click.INT,
+              default=None,
+              help='Project (pk), instead of the active project')
+@click.option('--all',
+              'include_terminated',
+              is_flag=True,
+              help='Also show the calculations already terminated')
+@click.option('--watch', '-w', is_flag=True, help='Refresh until interrupted (Ctrl-C)')
+@click.option('--interval',
+              type=click.INT,
+              default=10,
+              show_default=True,
+              help='Seconds between two refreshes with --watch')
+@decorators.with_dbenv()
+def status(project_pk, include_terminated, watch, interval):
+    """Show the calculations of the active project"""
+    import time
+    from aiida.common import timezone
+    from .cli_helpers import get_active_project
+    from .status import StatusWatcher, render_status
+
+    if project_pk is None:
+        project = get_active_project()
+        if project is None:
+            echo.echo_critical('No active project')
+            return
+        project_pk = project.pk
+
+    watcher = StatusWatcher(project_pk, include_terminated)
+    try:
+        while True:
+            watcher.poll()
+            now = timezone.now()
+            lines = list(render_status(watcher.jobs.values(), now))
+            latest = watcher.latest
+            if latest is not None:
+                lines += ['', f'Latest energy: {latest.energy:.6f} ({latest.name}: {latest.pk})']
+            running = sum(not job.terminated for job in watcher.jobs.values())
+            lines += ['', f'{running} calculation(s) running']
+
+            if not watch:
+                echo.echo('\n'.join(lines))
+                return
+
+            click.clear()
+            echo.echo(f'Project {project_pk} at {now.astimezone():%H:%M:%S} (every {interval} s, Ctrl-C to stop)')
+            echo.echo('')
+            echo.echo('\n'.join(lines))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
@@ -1,14 +1,13 @@
 # -*- coding: utf-8 -*-
 
 import click
+from aiida.cmdline.groups import VerdiCommandGroup
 from aiida.cmdline.utils import decorators, echo
 
 from .cli_helpers import wf_option, code_option
 
-from . import cli_root
 
-
-@cli_root.group('workflow')
+@click.group('workflow', cls=VerdiCommandGroup)
 def workflow():
     """Workflow commands"""
     pass
@@ -9,6 +9,26 @@ from functools import wraps
 _QP_GROUP = 'qp2_project_group'
 
 
+def get_active_project():
+    """Return the active project, or None (without querying the graph)"""
+    from aiida.common.exceptions import NotExistent
+    from aiida.orm import load_group, load_node
+
+    try:
+        group = load_group(_QP_GROUP)
+    except NotExistent:
+        return None
+
+    active_project = group.base.extras.get('active_project', None)
+    if active_project is None:
+        return None
+
+    try:
+        return load_node(active_project)
+    except NotExistent:
+        return None
+
+
 def wf_option(func):
     """
     Decorator add click option `--pk` to the function
@@ -26,36 +46,10 @@ def wf_option(func):
             from aiida.orm import load_node
             kwargs['wavefunction'] = load_node(kwargs['wavefunction'])
         else:
-            from aiida.orm import (QueryBuilder, Group, load_group,
-                                   SinglefileData as Wavefunction)
-
-            try:
-                group = load_group(_QP_GROUP)
-            except:
-                kwargs['wavefunction'] = None
-                return func(*_args, **kwargs)
-
-            qb = QueryBuilder()
-            qb.append(Group, filters={'label': _QP_GROUP}, tag='group')
-            qb.append(Wavefunction,
-                      filters={'id': group.base.extras.all['active_project']},
-                      with_group='group',
-                      tag='wavefunction')
-            if qb.count() == 0:
-                kwargs['wavefunction'] = None
-                return func(*_args, **kwargs)
-
-            wavefunction, = qb.first()
-            qb = QueryBuilder()
-            qb.append(Wavefunction,
-                      filters={'id': wavefunction.pk},
-                      tag='mother')
-            qb.append(Wavefunction, with_ancestors='mother', tag='child')
-            qb.order_by({'child': {'ctime': 'desc'}})
-            if qb.count() > 0:
-                kwargs['wavefunction'] = qb.first()[0]
-            else:
-                kwargs['wavefunction'] = wavefunction
+            from aiida_qp2.utils.project import get_head
+
+            project = get_active_project()
+            kwargs['wavefunction'] = get_head(project) if project is not None else None
 
         return func(*_args, **kwargs)
 
@@ -75,32 +69,93 @@ def code_option(func):
                   help='Code to use')
     @wraps(func)
     def f(*_args, **kwargs):
+        from aiida.orm import load_node
+
         if kwargs['code'] is not None:
-            from aiida.orm import load_node
             kwargs['code'] = load_node(kwargs['code'])
         else:
-            from aiida.orm import (QueryBuilder, Code, Group, SinglefileData as
-                                   Wavefunction, load_group, load_node)
-
-            try:
-                group = load_group(_QP_GROUP)
-            except:
-                kwargs['code'] = None
-                return func(*_args, **kwargs)
-
-            qb = QueryBuilder()
-            qb.append(Group, filters={'label': _QP_GROUP}, tag='group')
-            qb.append(Wavefunction,
-                      filters={'id': group.base.extras.all['active_project']},
-                      with_group='group',
-                      tag='wavefunction')
-            if qb.count() == 0:
-                kwargs['code'] = None
-                return func(*_args, **kwargs)
-
-            kwargs['code'] = load_node(
-                qb.first()[0].base.extras.all['default_code'])
+            project = get_active_project()
+            default_code = project.base.extras.get('default_code', None) if project is not None else None
+            kwargs['code'] = load_node(default_code) if default_code is not None else None
 
         return func(*_args, **kwargs)
 
     return f
+
+
+def get_code_labels():
+    """Return the full label of every code, by pk (a single query)"""
+    from aiida.orm import QueryBuilder, AbstractCode, Computer
+
+    qb = QueryBuilder()
+    qb.append(AbstractCode, tag='code', project=['id', 'label'])
+    qb.append(Computer, with_node='code', project=['label'], outerjoin=True)
+    return {pk: f'{label}@{computer}' if computer else label for pk, label, computer in qb.iterall()}
+
+
+def count_wavefunctions(group_label=_QP_GROUP):
+    """
+    Return the number of wavefunctions of every project of the group, by pk.
+
+    The descendants of all the projects are found in a single query (the
+    distinct project and wavefunction pairs, counted in Python), the project
+    itself is included in the count.
+    """
+    from collections import Counter
+    from aiida.orm import QueryBuilder, Group, SinglefileData as Wavefunction
+
+    qb = QueryBuilder()
+    qb.append(Group, filters={'label': group_label}, tag='group')
+    qb.append(Wavefunction, with_group='group', filters={'extras': {'has_key': 'name'}}, tag='mother', project=['id'])
+    qb.append(Wavefunction,
+              with_ancestors='mother',
+              filters={'attributes.wavefunction': True},
+              tag='child',
+              project=['id'])
+    qb.distinct()
+
+    counts = Counter(mother for mother, _ in qb.iterall(batch_size=1000))
+    return {pk: count + 1 for pk, count in counts.items()}
+
+
+def iter_projects(group_label=_QP_GROUP, batch_size=100):
+    """
+    Yield one dictionary per project of the group, as the rows arrive.
+
+    The rows are projected by a single query (no node is loaded) and
+    completed with the code labels and the wavefunction counts, which take
+    one query each for all the projects.
+
+    :returns: generator of dictionaries with the `name`, `pk`, `ctime`,
+        `user`, `formula`, `code` (label, or None) and `num_wf` of the projects
+    """
+    from aiida.orm import QueryBuilder, Group, User, SinglefileData as Wavefunction
+
+    code_labels = get_code_labels()
+    num_wf = count_wavefunctions(group_label)
+
+    qb = QueryBuilder()
+    qb.append(Group, filters={'label': group_label}, tag='group')
+    qb.append(Wavefunction,
+              filters={
+                  'attributes.wavefunction': True,
+                  'extras': {
+                      'has_key': 'name'
+                  }
+              },
+              with_group='group',
+              tag='wavefunction',
+              project=['id', 'ctime', 'extras.name', 'extras.default_code', 'attributes.formula'])
+    qb.append(User, with_node='wavefunction', project=['email'])
+    qb.order_by({'wavefunction': {'id': 'asc'}})
+
+    for pk, ctime, name, code, formula, user in qb.iterall(batch_size=batch_size):
+        yield {
+            'name': name,
+            'pk': pk,
+            'ctime': ctime,
+            'user': user,
+            'formula': formula or '',
+            'code': code_labels.get(code),
+            'num_wf': num_wf.get(pk, 1),
+        }
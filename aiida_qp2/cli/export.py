@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Export of the wavefunctions of a project to a directory tree
+
+Every wavefunction gets a directory `<pk>_<run type>` (or `create`, `edit`)
+with the packed EZFIO file and, when it was computed by a calcjob, the job
+script, the output and the input parameters::
+
+    <directory>/
+        .aqp_manifest.json
+        38_create/aiida.wf.tar.gz
+        42_fci/aiida.wf.tar.gz
+        42_fci/aiida.inp
+        42_fci/aiida-qp2.out
+        42_fci/parameters.yaml
+
+The files to export are found with a few queries projecting the repository
+metadata of the nodes: the keys of the repository are the SHA-256 of the
+contents, so the files already present with the same hash are skipped
+without reading the repository. The manifest records the hash, size and
+mtime of the exported files: they are only hashed again if they changed,
+which makes an interrupted export cheap to resume.
+
+The copies are streamed by a thread pool. Only opening a repository object
+is serialized (the object store session is not thread safe), the reads,
+writes and hashing run in parallel.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+MANIFEST_FILE = '.aqp_manifest.json'
+_CHUNK_SIZE = 1024**2
+
+# Directory names of the wavefunctions not computed by a run
+_PROCESS_NAMES = {
+    'QP2CreateCalculation': 'create',
+    'wavefunction_handler': 'edit',
+    'wavefunction_editor': 'edit',
+}
+
+
+class ExportFile():
+    """
+    File to export
+
+    :param path: path relative to the export directory
+    :param key: key of the repository object, or None
+    :param content: bytes to write (for the files generated from the database)
+    """
+    def __init__(self, path, key=None, content=None):
+        self.path = path
+        self.key = key
+        self.content = content
+        self.sha256 = hashlib.sha256(content).hexdigest() if content is not None else None
+
+
+def get_object_key(repository_metadata, path):
+    """Return the key of the object `path` from the `repository_metadata` of a node, or None"""
+    entry = repository_metadata or {}
+    for part in path.split('/'):
+        entry = entry.get('o', {}).get(part)
+        if entry is None:
+            return None
+    return entry.get('k')
+
+
+def project_wavefunctions(project_pk):
+    """Return the pks of the project and of all the wavefunctions computed from it (one query)"""
+    from aiida.orm import QueryBuilder, SinglefileData as Wavefunction
+
+    qb = QueryBuilder()
+    qb.append(Wavefunction, filters={'id': project_pk}, tag='mother')
+    qb.append(Wavefunction, with_ancestors='mother', tag='child', project=['id'])
+    return [project_pk] + qb.all(flat=True)
+
+
+def plan_export(filters):
+    """
+    Return the `ExportFile` of the wavefunctions matching the QueryBuilder `filters`.
+
+    Four queries whatever the number of wavefunctions: the wavefunctions,
+    their creators (with the job scripts), the outputs and the parameters.
+    """
+    import yaml
+    from aiida.orm import QueryBuilder, CalcJobNode, CalculationNode, Dict, FolderData, SinglefileData as Wavefunction
+
+    qb = QueryBuilder()
+    qb.append(Wavefunction, filters=filters, project=['id', 'attributes.filename', 'repository_metadata'])
+    wavefunctions = qb.all()
+
+    qb = QueryBuilder()
+    qb.append(Wavefunction, filters=filters, tag='wf', project=['id'])
+    qb.append(CalculationNode,
+              with_outgoing='wf',
+              project=['attributes.process_label', 'repository_metadata', 'attributes.output_filename'])
+    calcs = {pk: rest for pk, *rest in qb.all()}
+
+    qb = QueryBuilder()
+    qb.append(Wavefunction, filters=filters, tag='wf', project=['id'])
+    qb.append(CalcJobNode, with_outgoing='wf', tag='calc')
+    qb.append(FolderData, with_incoming='calc', edge_filters={'label': 'retrieved'}, project=['repository_metadata'])
+    retrieved = dict(qb.all())
+
+    qb = QueryBuilder()
+    qb.append(Wavefunction, filters=filters, tag='wf', project=['id'])
+    qb.append(CalcJobNode, with_outgoing='wf', tag='calc')
+    qb.append(Dict, with_outgoing='calc', edge_filters={'label': 'parameters'}, project=['attributes'])
+    parameters = dict(qb.all())
+
+    files = []
+    for pk, filename, metadata in wavefunctions:
+        process_label, calc_metadata, output_filename = calcs.get(pk, (None, None, None))
+        name = parameters.get(pk, {}).get('run_type') or _PROCESS_NAMES.get(process_label, 'wavefunction')
+        folder = f'{pk}_{name}'
+        files.append(ExportFile(f'{folder}/{filename}', get_object_key(metadata, filename)))
+
+        key = get_object_key(calc_metadata, 'aiida.inp')
+        if key is not None:
+            files.append(ExportFile(f'{folder}/aiida.inp', key))
+        key = get_object_key(retrieved.get(pk), output_filename or '')
+        if key is not None:
+            files.append(ExportFile(f'{folder}/{output_filename}', key))
+        if pk in parameters:
+            files.append(ExportFile(f'{folder}/parameters.yaml', content=yaml.dump(parameters[pk]).encode()))
+
+    return files
+
+
+def _sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class Exporter():
+    """
+    Copy `ExportFile`s to a directory, skipping those already up to date
+
+    :param directory: the export directory
+    :param jobs: number of threads
+    """
+    def __init__(self, directory, jobs=4):
+        from aiida.manage import get_manager
+
+        self.directory = directory
+        self.jobs = jobs
+        self.repository = get_manager().get_profile_storage().get_repository()
+        self._lock = threading.Lock()
+        self.manifest = {}
+        self.copied = []
+        self.skipped = []
+
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as handle:
+                self.manifest = json.load(handle)
+
+    def _expected_hash(self, file):
+        if file.sha256 is None:
+            file.sha256 = file.key if self.repository.key_format == 'sha256' else \
+                self.repository.get_object_hash(file.key)
+        return file.sha256
+
+    def _is_up_to_date(self, file, path):
+        if not os.path.exists(path):
+            return False
+        entry = self.manifest.get(file.path)
+        if entry is not None and entry['sha256'] == file.sha256 and \
+           {'size': entry['size'], 'mtime_ns': entry['mtime_ns']} == _stat(path):
+            return True
+        return _sha256(path) == file.sha256
+
+    def _copy(self, file):
+        path = os.path.join(self.directory, file.path)
+        if self._is_up_to_date(file, path):
+            self.skipped.append(file)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written aside and renamed: an interrupted copy never looks complete
+            partial = path + '.part'
+            if file.content is not None:
+                with open(partial, 'wb') as handle:
+                    handle.write(file.content)
+            else:
+                stack = ExitStack()
+                with self._lock:
+                    source = stack.enter_context(self.repository.open(file.key))
+                try:
+                    with open(partial, 'wb') as handle:
+                        shutil.copyfileobj(source, handle, _CHUNK_SIZE)
+                finally:
+                    with self._lock:
+                        stack.close()
+            os.replace(partial, path)
+            self.copied.append(file)
+
+        with self._lock:
+            self.manifest[file.path] = {'sha256': file.sha256, **_stat(path)}
+
+    def export(self, files):
+        """Copy the files, return the number of bytes copied"""
+        files = [file for file in files if file.key is not None or file.content is not None]
+        for file in files:
+            self._expected_hash(file)
+
+        os.makedirs(self.directory, exist_ok=True)
+        executor = ThreadPoolExecutor(max_workers=self.jobs)
+        try:
+            # Consume the results to raise the errors of the workers
+            for _ in executor.map(self._copy, files):
+                pass
+        finally:
+            # On errors (or Ctrl-C) the pending copies are dropped, the done ones kept in the manifest
+            executor.shutdown(cancel_futures=True)
+            self.save_manifest()
+
+        return sum(os.path.getsize(os.path.join(self.directory, file.path)) for file in self.copied)
+
+    def save_manifest(self):
+        """Write the manifest of the export directory"""
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        with open(path + '.part', 'w') as handle:
+            json.dump(self.manifest, handle, indent=1, sort_keys=True)
+        os.replace(path + '.part', path)
@@ -1,31 +1,35 @@
 # -*- coding: utf-8 -*-
 from . import _QP_GROUP
 
+# Calcfunctions editing a wavefunction (shown as `edit`)
+EDIT_PROCESSES = ('wavefunction_handler', 'wavefunction_editor')
+
 
 class CalcHolder():
     """
     Helper class to hold information about a calculation
+
+    Only plain values (from the query of `get_history`): rendering does not
+    touch the database.
     """
-    def __init__(self, child, job, name, par):
+    def __init__(self, child, ctime, name, par, energy=None, tag=None):
         self.child = child
-        self.job = job
+        self.ctime = ctime
         self.name = name
         self.par = par
+        self.energy = energy
+        # Label of the calcjob, e.g. the point of an `aqp run --sweep`
+        self.tag = tag
         self.active = False
 
-    @property
-    def energy(self):
-        try:
-            return self.job.outputs['output_energy'].value
-        except:
-            return None
-
     @property
     def label(self):
         wf_pk = self.child
-        name = self.name
-        if name == 'wavefunction_handler':
+        name = self.name or '?'
+        if name in EDIT_PROCESSES:
             name = 'edit'
+        if self.tag:
+            name += f' [{self.tag}]'
         msg = f'{name}: {wf_pk}'
         if self.energy is not None:
             msg += f' | {self.energy:.6f}'
@@ -33,27 +37,83 @@ class CalcHolder():
             msg = '\033[1m' + msg + '\033[0m'
         return msg
 
-    @property
-    def ctime(self):
-        return self.job.ctime
-
     @property
     def graph_label(self):
         wf_pk = self.child
-        name = self.name
-        if name == 'wavefunction_handler':
+        name = self.name or '?'
+        if name in EDIT_PROCESSES:
             name = 'edit'
+        if self.tag:
+            name += f'\n{self.tag}'
         msg = f'{wf_pk}\n{name}'
         if self.energy is not None:
             msg += f'\n{self.energy:.6f}'
         return msg
 
 
-def show_all(style):
+def _history_query(project_pk):
+    """Query of the calculations creating the wavefunctions computed from the project"""
+    from aiida.orm import QueryBuilder, SinglefileData as Wavefunction, CalculationNode
+
+    qb = QueryBuilder()
+    qb.append(Wavefunction, filters={'id': project_pk}, tag='mother')
+    qb.append(Wavefunction, with_ancestors='mother', tag='child')
+    qb.append(CalculationNode, with_outgoing='child', tag='calc')
+    return qb
+
+
+def get_history(project_pk):
+    """
+    Return a `CalcHolder` for every wavefunction computed from the project.
+
+    Calcjobs and calcfunctions (edits) come from a single query. The
+    QueryBuilder cannot outer join through a link, but every calculation has
+    a wavefunction as input (the parent) and as output (the child): the Dict
+    inputs and Float outputs are joined along with them, and the run type
+    (`parameters`) and the energy (`output_energy`) are picked from the rows
+    by their link label.
+    """
+    from aiida.orm import Dict, Float, SinglefileData as Wavefunction
+
+    qb = _history_query(project_pk)
+    qb.add_projection('child', ['id'])
+    qb.add_projection('calc', ['id', 'ctime', 'label'])
+    qb.append((Wavefunction, Dict),
+              with_outgoing='calc',
+              tag='input',
+              edge_tag='input_link',
+              edge_project=['label'],
+              project=['id', 'node_type', 'attributes.run_type'])
+    qb.append((Wavefunction, Float),
+              with_incoming='calc',
+              tag='output',
+              edge_tag='output_link',
+              edge_project=['label'],
+              project=['attributes.value'])
+
+    calcs, parents, run_types, energies = {}, {}, {}, {}
+    for row in qb.iterdict():
+        calc = row['calc']['id']
+        calcs[row['child']['id']] = (calc, row['calc']['ctime'], row['calc']['label'])
+        if row['input']['node_type'] == Wavefunction.class_node_type:
+            parents[calc] = row['input']['id']
+        elif row['input_link']['label'] == 'parameters':
+            run_types[calc] = row['input']['attributes.run_type']
+        if row['output_link']['label'] == 'output_energy':
+            energies[calc] = row['output']['attributes.value']
+
+    return [
+        CalcHolder(child, ctime, run_types.get(calc, label), parents[calc], energies.get(calc),
+                   label if calc in run_types else None)
+        for child, (calc, ctime, label) in calcs.items() if calc in parents
+    ]
+
+
+def show_all(style, options=None, pager=False):
 
     import sys
     from aiida.orm import QueryBuilder, Group, SinglefileData as Wavefunction
-    from aiida.orm import CalcJobNode, Dict, load_group, CalcFunctionNode
+    from aiida.orm import load_group
     from aiida.cmdline.utils import decorators, echo
 
     try:
@@ -79,48 +139,13 @@ def show_all(style):
     else:
         echo.echo_error(f'No active project')
 
-    qb = QueryBuilder()
-    qb.append(Wavefunction,
-              filters={'id': group.base.extras.all['active_project']},
-              tag='mother')
-    qb.append(Wavefunction,
-              with_ancestors='mother',
-              tag='child',
-              project=['id'])
-    qb.append(CalcJobNode, with_outgoing='child', tag='calc', project=['*'])
-    qb.append(Dict,
-              with_outgoing='calc',
-              tag='dict',
-              project=['attributes.run_type'])
-    qb.append(Wavefunction, with_outgoing='calc', tag='par', project=['id'])
-
-    # Special case for calcfunctions
-    qbf = QueryBuilder()
-    qbf.append(Wavefunction,
-               filters={'id': group.base.extras.all['active_project']},
-               tag='mother')
-    qbf.append(Wavefunction,
-               with_ancestors='mother',
-               tag='child',
-               project=['id'])
-    qbf.append(CalcFunctionNode,
-               with_outgoing='child',
-               tag='calc',
-               project=['*', 'label'])
-    qbf.append(Wavefunction, with_outgoing='calc', tag='par', project=['id'])
-
-    echo.echo(f'Number of wavefunctions: {qb.count() + qbf.count()}')
-    echo.echo('')
+    nodes = get_history(group.base.extras.all['active_project'])
 
-    # get data
-    nodes = []
-    for child, job, a, par in qb.iterall():
-        nodes.append(CalcHolder(child, job, a, par))
-    for child, job, a, par in qbf.iterall():
-        nodes.append(CalcHolder(child, job, a, par))
+    echo.echo(f'Number of wavefunctions: {len(nodes)}')
+    echo.echo('')
 
     if len(nodes) > 0:
-        newest = sorted(nodes, key=lambda x: x.job.ctime)[-1]
+        newest = sorted(nodes, key=lambda x: x.ctime)[-1]
         newest.active = True
 
     if style == 'plain':
@@ -128,7 +153,7 @@ def show_all(style):
         return
 
     if style == 'tree':
-        show_tree(wavefunction, nodes)
+        show_tree(wavefunction, nodes, options, pager)
         return
 
     if style == 'graph':
@@ -139,116 +164,217 @@ def show_all(style):
 def show_plain(wavefunction, nodes):
     from aiida.cmdline.utils import echo
     echo.echo(f'Parent: {wavefunction.pk}')
-    for ch in sorted(nodes, key=lambda x: x.job.ctime):
+    for ch in sorted(nodes, key=lambda x: x.ctime):
         echo.echo(ch.label)
 
 
-def show_tree(wavefunction, nodes):
+class TreeOptions():
+    """
+    Options of the tree rendering
+
+    :param max_depth: deeper wavefunctions are summarized (None: no limit)
+    :param max_children: further children of a wavefunction are summarized (None: no limit)
+    :param min_chain: linear chains of at least this many wavefunctions are collapsed (0: never)
+    :param energy_below: only show the wavefunctions with a lower energy (and their ancestors)
+    :param run_type: only show the wavefunctions computed by this run type (and their ancestors)
+    :param bar_width: width of the energy bars (0: no bars)
+    """
+    def __init__(self, max_depth=None, max_children=None, min_chain=0, energy_below=None,
+                 run_type=None, bar_width=40):
+        self.max_depth = max_depth
+        self.max_children = max_children
+        self.min_chain = min_chain
+        self.energy_below = energy_below
+        self.run_type = run_type
+        self.bar_width = bar_width
+
+    def matches(self, node):
+        """Whether the node passes the filters"""
+        name = 'edit' if node.name in EDIT_PROCESSES else node.name
+        if self.run_type is not None and name != self.run_type:
+            return False
+        if self.energy_below is not None and (node.energy is None or node.energy >= self.energy_below):
+            return False
+        return True
+
+
+class Summary():
+    """Line standing for wavefunctions which are not shown"""
+    def __init__(self, nodes, what):
+        self.nodes = nodes
+        self.what = what
+        self.energy = None
+
+    @property
+    def label(self):
+        from collections import Counter
+        counts = Counter('edit' if x.name in EDIT_PROCESSES else x.name for x in self.nodes)
+        detail = ', '.join(f'{name} x{count}' for name, count in counts.most_common())
+        return f'... {self.what} ({detail})'
+
 
-    import sys
-    from aiida.cmdline.utils import echo
+def build_tree(root, nodes, options):
+    """
+    Return the children of each wavefunction and the number of nodes not connected to the root.
 
-    try:
-        from treelib import Tree
-    except ImportError:
-        echo.echo('Please install treelib to show the tree')
-        echo.echo('')
-        return
+    The children are sorted by ctime, the nodes which do not pass the
+    filters (nor have a descendant passing them) are dropped.
+    """
+    children = {}
+    seen = {root.child}
+    for node in sorted(nodes, key=lambda x: x.ctime):
+        if node.child not in seen:
+            seen.add(node.child)
+            children.setdefault(node.par, []).append(node)
+
+    # Post-order (iterative: the chains can be thousands of nodes deep)
+    order, stack = [], [root]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(children.get(node.child, []))
+    keep = set()
+    for node in reversed(order):
+        kids = [x for x in children.get(node.child, []) if x.child in keep]
+        children[node.child] = kids
+        if kids or node is root or options.matches(node):
+            keep.add(node.child)
+
+    return children, len(seen) - len(order)
+
+
+def _next_in_chain(node, children):
+    """The only child of `node` with children of its own (if the others are leaves), or its only child"""
+    kids = children.get(node.child, [])
+    inner = [x for x in kids if children.get(x.child)]
+    if len(inner) == 1:
+        return inner[0]
+    return kids[0] if len(kids) == 1 else None
+
+
+def _collapse(node, children, options):
+    """
+    Children to show under `node`.
 
-    tree = Tree()
-    tree.create_node(wavefunction.pk,
-                     wavefunction.pk,
-                     data=CalcHolder(wavefunction.pk, None, 'root', None))
+    A chain of wavefunctions each having a single child which goes on
+    (the other children being leaves, e.g. edits) is collapsed into a
+    summary line followed by its end.
+    """
+    others, tail = children.get(node.child, []), []
+
+    if options.min_chain:
+        chain, current = [], node
+        while (current := _next_in_chain(current, children)) is not None:
+            chain.append(current)
+        # The newest wavefunction is never hidden
+        middle = next((i for i, x in enumerate(chain[:-1])
+                       if x.active or any(y.active for y in children.get(x.child, []))), len(chain) - 1)
+        if middle >= options.min_chain:
+            hidden = []
+            for i, x in enumerate(chain[:middle]):
+                hidden.append(x)
+                hidden.extend(y for y in children.get(x.child, []) if y is not chain[i + 1])
+            others = [x for x in others if x is not chain[0]]
+            tail = [Summary(hidden, f'{len(hidden)} wavefunctions'), chain[middle]]
+
+    if options.max_children is not None and len(others) > options.max_children:
+        hidden = others[options.max_children:]
+        others = others[:options.max_children] + [Summary(hidden, f'{len(hidden)} more')]
+    return others + tail
+
+
+def _descendants(node, children):
+    descendants, stack = [], [node]
+    while stack:
+        kids = children.get(stack.pop().child, [])
+        descendants.extend(kids)
+        stack.extend(kids)
+    return descendants
+
+
+def iter_tree(root, children, options):
+    """Yield the `(prefix, node)` lines of the tree, depth first"""
+    yield '', root
+    stack = [(_collapse(root, children, options), 0, '', 1)]
+    while stack:
+        items, index, prefix, depth = stack.pop()
+        if index == len(items):
+            continue
+        stack.append((items, index + 1, prefix, depth))
+
+        item, last = items[index], index == len(items) - 1
+        yield prefix + ('\u2514\u2500\u2500 ' if last else '\u251c\u2500\u2500 '), item
+
+        if isinstance(item, Summary):
+            continue
+        child_prefix = prefix + ('    ' if last else '\u2502   ')
+        if options.max_depth is not None and depth >= options.max_depth:
+            hidden = _descendants(item, children)
+            if hidden:
+                yield child_prefix + '\u2514\u2500\u2500 ', Summary(hidden, f'{len(hidden)} descendants')
+            continue
+        stack.append((_collapse(item, children, options), 0, child_prefix, depth + 1))
+
+
+def _visible_length(text):
+    return len(text.replace('\033[1m', '').replace('\033[0m', ''))
+
+
+def energy_bars(energies, width):
+    """
+    Return the energy bars, in one vectorized pass.
 
-    for ch in sorted(nodes, key=lambda x: x.job.ctime):
-        try:
-            tree.create_node(ch.label, ch.child, parent=ch.par, data=ch)
-        except:
-            pass
+    The lowest energy gets the full width, the highest a single block.
+    """
+    import numpy as np
 
-    if tree.depth() > 20:
-        echo.echo_warning('Tree is very deep')
+    energies = np.array([np.nan if x is None else x for x in energies], dtype=float)
+    finite = np.isfinite(energies)
+    if width <= 0 or not finite.any():
+        return [''] * len(energies)
 
-    ptree = tree.show(stdout=False, data_property='label')
+    low, high = energies[finite].min(), energies[finite].max()
+    lengths = np.ones(len(energies), dtype=int)
+    if high > low:
+        lengths[finite] = 1 + np.rint((high - energies[finite]) / (high - low) * (width - 1)).astype(int)
+    lengths[~finite] = 0
+    return ['\u2587' * length for length in lengths]
 
-    # First fill white space in ptree
-    def _length(s):
-        s = s.replace('\033[1m', '')
-        s = s.replace('\033[0m', '')
-        return len(s)
 
-    longest_line = max(_length(x) for x in ptree.split('\n'))
+def render_tree(wavefunction, nodes, options):
+    """
+    Yield the lines of the tree (with a trailing newline, for `click.echo_via_pager`).
 
-    # Add white space to the end of each line
-    ptree = '\n'.join(x + ' ' * (longest_line - _length(x)) + '|'
-                      for x in ptree.split('\n'))
+    The lines are formatted lazily: only the layout and the bars are
+    computed beforehand.
+    """
+    root = CalcHolder(wavefunction.pk, None, 'root', None)
+    children, disconnected = build_tree(root, nodes, options)
 
-    dtree = tree.show(stdout=False,
-                      data_property='energy',
-                      line_type='ascii-ex')
-    dtree = dtree.replace('\u2502', '')
-    dtree = dtree.replace('\u251c\u2500\u2500 ', '')
-    dtree = dtree.replace('\u2514\u2500\u2500 ', '')
+    lines = list(iter_tree(root, children, options))
+    bars = energy_bars([item.energy for _, item in lines], options.bar_width)
+    width = min(max(_visible_length(prefix + item.label) for prefix, item in lines), 100)
 
-    dtree = dtree.split('\n')
-    dtree = [x.strip() for x in dtree]
+    for (prefix, item), bar in zip(lines, bars):
+        text = prefix + item.label
+        if bar:
+            text += ' ' * (width - _visible_length(text)) + f' | {bar}'
+        yield text + '\n'
 
-    # This is messy (and should be done in a better way)
-    try:
-        from termgraph.module import Data, BarChart, Args, Colors
-
-        data_without_none = [
-            float(x) for x in dtree if x.strip() not in ('None', '')
-        ]
-        if len(data_without_none) == 0:
-            raise NotImplementedError
-        max_data = max(data_without_none)
-        data = [
-            float(x) if x.strip() not in ('None', '') else max_data
-            for x in dtree
-        ]
-        labels = [
-            'GOOD' if x.strip() not in ('None', '') else 'BAAD' for x in dtree
-        ]
-        ldata = len(data)
-        data = [abs(x) for x in data]
-        data = [[x] for x in data]
-        data = Data(data, labels)
-
-        colors = [
-            Colors.Red if ii % 2 == 0 else Colors.Red for ii in range(ldata)
-        ]
-
-        chart = BarChart(data, Args(colors=colors))
-
-        from io import StringIO
-        capture_output = StringIO()
-        original_stdout = sys.stdout
-        try:
-            sys.stdout = capture_output
-            echo.echo(chart.draw())
-        finally:
-            sys.stdout = original_stdout
-
-        bg = capture_output.getvalue().strip()
-        stree = [' ' * (len(ptree.split('\n')[0]) - 1) + f'| ']
-
-        bg = bg.split('\n')
-        bg = [l.replace('GOOD:', '') if 'GOOD' in l else '' for l in bg]
-
-        for line, dline in zip(ptree.split('\n'), bg):
-            stree.append(line + ' ' + dline)
-
-        ptree = '\n'.join(stree)
+    if disconnected:
+        yield f'\n{disconnected} wavefunction(s) not connected to the project are not shown\n'
 
-    except ImportError:
-        echo.echo('Please install termgraph to show the plots')
-        echo.echo('')
 
-    except NotImplementedError:
-        pass
+def show_tree(wavefunction, nodes, options=None, pager=False):
 
-    echo.echo(ptree)
+    import click
+
+    lines = render_tree(wavefunction, nodes, options or TreeOptions())
+    if pager:
+        click.echo_via_pager(lines)
+    else:
+        for line in lines:
+            click.echo(line, nl=False)
 
 
 def show_graph(wavefunction, nodes):
@@ -279,7 +405,7 @@ def show_graph(wavefunction, nodes):
 
     G = nx.DiGraph()
 
-    for ch in sorted(nodes, key=lambda x: x.job.ctime):
+    for ch in sorted(nodes, key=lambda x: x.ctime):
         G.add_node(ch.graph_label)
         if ch.par is not None:
             G.add_edge(dict_of_nodes[ch.par].graph_label, ch.graph_label)
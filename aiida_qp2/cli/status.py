@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Status of the calculations of a project
+
+The calculations are found from their input wavefunction, tagged with the
+`project` extra (see :mod:`aiida_qp2.utils.project`): a join, without
+walking the provenance graph. The wavefunctions computed before the extra
+existed are tagged at the first poll (the graph is walked once per project,
+see :func:`aiida_qp2.utils.project.tag_project`). When watching, a poll only asks for the
+calculations modified since the previous one (`mtime` watermark), so its
+cost does not grow with the time spent watching or the size of the project.
+"""
+
+import datetime
+
+_ACTIVE_STATES = ['created', 'waiting', 'running']
+_TERMINATED_STATES = ['finished', 'excepted', 'killed']
+_PROJECTIONS = [
+    'id', 'ctime', 'mtime', 'attributes.process_state', 'attributes.scheduler_state', 'attributes.exit_status',
+    'label', 'attributes.last_job_info'
+]
+# Rows committed after a poll may carry an older mtime (and clocks drift)
+_OVERLAP = datetime.timedelta(seconds=5)
+
+
+def _format_duration(seconds):
+    if seconds is None:
+        return '-'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
+
+
+class JobStatus():
+    """
+    Helper class to hold the status of a calculation
+
+    Only plain values (from the queries of `StatusWatcher`).
+    """
+    def __init__(self, pk, ctime, mtime, process_state, scheduler_state, exit_status, label, job_info):
+        self.pk = pk
+        self.ctime = ctime
+        self.mtime = mtime
+        self.process_state = process_state
+        self.scheduler_state = scheduler_state
+        self.exit_status = exit_status
+        self.label = label
+        self.job_info = job_info
+        self.run_type = None
+        self.energy = None
+
+    @property
+    def terminated(self):
+        return self.process_state in _TERMINATED_STATES
+
+    @property
+    def state(self):
+        if self.process_state == 'finished':
+            return 'finished' if self.exit_status == 0 else f'failed [{self.exit_status}]'
+        if self.process_state in ('waiting', 'running') and self.scheduler_state:
+            return self.scheduler_state
+        return self.process_state or 'created'
+
+    @property
+    def name(self):
+        name = self.run_type or 'calcjob'
+        if self.label:
+            name += f' [{self.label}]'
+        return name
+
+    def times(self, now):
+        """Return the time spent in the queue and the elapsed time (seconds, or None)"""
+        submitted = dispatched = wallclock = None
+        if self.job_info:
+            from aiida.schedulers.datastructures import JobInfo
+
+            info = JobInfo.load_from_dict(self.job_info)
+            submitted = getattr(info, 'submission_time', None)
+            dispatched = getattr(info, 'dispatch_time', None)
+            wallclock = getattr(info, 'wallclock_time_seconds', None)
+
+        # The scheduler may give naive datetimes
+        if submitted is not None and submitted.tzinfo is None:
+            submitted = submitted.replace(tzinfo=now.tzinfo)
+        if dispatched is not None and dispatched.tzinfo is None:
+            dispatched = dispatched.replace(tzinfo=now.tzinfo)
+
+        end = self.mtime if self.terminated else now
+        start = submitted or self.ctime
+        if dispatched is not None:
+            queued = (dispatched - start).total_seconds()
+        elif self.scheduler_state == 'queued':
+            queued = (end - start).total_seconds()
+        else:
+            queued = None
+
+        if wallclock is not None:
+            elapsed = wallclock
+        elif dispatched is not None:
+            elapsed = (end - dispatched).total_seconds()
+        elif self.scheduler_state != 'queued':
+            elapsed = (end - self.ctime).total_seconds()
+        else:
+            elapsed = None
+        return queued, elapsed
+
+
+class StatusWatcher():
+    """
+    Incremental view of the calculations of a project
+
+    :param project_pk: pk of the project
+    :param include_terminated: also list the calculations terminated before the first poll
+    """
+    def __init__(self, project_pk, include_terminated=False):
+        self.project_pk = project_pk
+        self.include_terminated = include_terminated
+        self.jobs = {}
+        self.latest = None
+        self.watermark = None
+        self.queries = 0
+
+    def _query(self, filters):
+        from aiida.orm import QueryBuilder, CalcJobNode, SinglefileData as Wavefunction
+
+        qb = QueryBuilder()
+        qb.append(Wavefunction,
+                  filters={'or': [{'id': self.project_pk}, {'extras.project': self.project_pk}]},
+                  tag='wf')
+        qb.append(CalcJobNode, with_incoming='wf', filters=filters, tag='calc')
+        qb.distinct()
+        return qb
+
+    def poll(self):
+        """Update the jobs from the database, return the pks of the jobs changed"""
+        from aiida.common import timezone
+        from aiida.orm import Dict, Float, load_node
+        from aiida_qp2.utils.project import tag_project
+
+        start = timezone.now()
+        if self.watermark is None:
+            filters = {} if self.include_terminated else {'attributes.process_state': {'in': _ACTIVE_STATES}}
+        else:
+            filters = {'mtime': {'>': self.watermark - _OVERLAP}}
+
+        if self.watermark is None:
+            tag_project(load_node(self.project_pk))
+            self.latest = self._query_latest()
+
+        qb = self._query(filters)
+        qb.add_projection('calc', _PROJECTIONS)
+        self.queries += 1
+
+        changed = []
+        watermark = start if self.watermark is None else self.watermark
+        for row in qb.iterall():
+            pk, mtime = row[0], row[2]
+            watermark = max(watermark, mtime)
+            job = self.jobs.get(pk)
+            if job is not None and job.mtime == mtime:
+                continue
+            status = JobStatus(*row)
+            if job is not None:
+                status.run_type, status.energy = job.run_type, job.energy
+            self.jobs[pk] = status
+            changed.append(pk)
+        self.watermark = watermark
+
+        # Only for the new and the newly finished jobs
+        new = [pk for pk in changed if self.jobs[pk].run_type is None]
+        if new:
+            qb = self._query({'id': {'in': new}})
+            qb.add_projection('calc', ['id'])
+            qb.append(Dict, with_outgoing='calc', edge_filters={'label': 'parameters'},
+                      project=['attributes.run_type'])
+            self.queries += 1
+            for pk, run_type in qb.iterall():
+                self.jobs[pk].run_type = run_type
+
+        finished = [pk for pk in changed if self.jobs[pk].process_state == 'finished' and self.jobs[pk].energy is None]
+        if finished:
+            qb = self._query({'id': {'in': finished}})
+            qb.add_projection('calc', ['id'])
+            qb.append(Float, with_incoming='calc', edge_filters={'label': 'output_energy'},
+                      project=['attributes.value'])
+            self.queries += 1
+            for pk, energy in qb.iterall():
+                job = self.jobs[pk]
+                job.energy = energy
+                if self.latest is None or job.mtime > self.latest.mtime:
+                    self.latest = job
+
+        return changed
+
+    def _query_latest(self):
+        """Return the last calculation of the project with an energy, or None"""
+        from aiida.orm import Dict, Float
+
+        qb = self._query({'attributes.process_state': 'finished'})
+        qb.add_projection('calc', _PROJECTIONS)
+        qb.append(Dict, with_outgoing='calc', edge_filters={'label': 'parameters'},
+                  project=['attributes.run_type'])
+        qb.append(Float, with_incoming='calc', edge_filters={'label': 'output_energy'},
+                  project=['attributes.value'])
+        qb.order_by({'calc': {'mtime': 'desc'}})
+        qb.limit(1)
+        self.queries += 1
+
+        row = qb.first()
+        if row is None:
+            return None
+        job = JobStatus(*row[:-2])
+        job.run_type, job.energy = row[-2:]
+        return job
+
+
+def render_status(jobs, now):
+    """Yield the lines of the table of the jobs"""
+    columns = [('PK', 8), ('Run type', 40), ('State', 12), ('Queued', 9), ('Elapsed', 9), ('Energy', 16)]
+    row_format = '  '.join(f'{{:<{width}}}' for _, width in columns)
+
+    yield row_format.format(*[header for header, _ in columns]).rstrip()
+    yield row_format.format(*['-' * width for _, width in columns])
+    for job in sorted(jobs, key=lambda job: job.ctime):
+        queued, elapsed = job.times(now)
+        energy = f'{job.energy:.6f}' if job.energy is not None else ''
+        yield row_format.format(job.pk, job.name[:40], job.state, _format_duration(queued),
+                                _format_duration(elapsed), energy).rstrip()
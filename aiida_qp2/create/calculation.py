@@ -12,6 +12,8 @@ from aiida.engine import CalcJob
 from aiida.orm import Dict, Float, Code, Str, StructureData, SinglefileData
 from aiida.plugins import DataFactory
 
+from aiida_qp2.utils.timings import TIMINGS_FILE, step_function
+
 
 class QP2CreateCalculation(CalcJob):
     """ AiiDA calculation plugin for Quantum Package.
@@ -86,6 +88,16 @@ class QP2CreateCalculation(CalcJob):
                     required=True,
                     help='The result of the calculation')
 
+        spec.output('output_job_timings',
+                    valid_type=Dict,
+                    required=False,
+                    help='Wall/CPU time and peak memory of each step of the job script')
+
+        spec.output('output_parse_profile',
+                    valid_type=Dict,
+                    required=False,
+                    help='Time spent in each phase of the parser and its memory usage')
+
     def prepare_for_submission(self, folder):
         """
         Create input files.
@@ -100,8 +112,10 @@ class QP2CreateCalculation(CalcJob):
         # TODO: Check if basis set is valid
 
         with folder.open(self._INPUT_FILE, 'w') as handle:
-            handle.write(f'qp create_ezfio -b {basis_set} {self._INPUT_COORDS_FILE}\n')
-            handle.write(f'tar czf {self.metadata.options.output_wf_basename}.tar.gz *.ezfio\n')
+            handle.write('AIIDA_WORKDIR=$(pwd)\n')
+            handle.write(step_function())
+            handle.write(f'_aiida_step create_ezfio qp create_ezfio -b {basis_set} {self._INPUT_COORDS_FILE}\n')
+            handle.write(f'_aiida_step pack tar czf {self.metadata.options.output_wf_basename}.tar.gz *.ezfio\n')
 
         with folder.open(self._INPUT_COORDS_FILE, 'w') as handle:
             structure = self.inputs.structure.get_ase()
@@ -124,6 +138,8 @@ class QP2CreateCalculation(CalcJob):
         calcinfo.local_copy_list = []
         calcinfo.retrieve_list = [self._INPUT_COORDS_FILE,
                                   self.metadata.options.output_filename,
-                                  f'{self.metadata.options.output_wf_basename}.tar.gz']
+                                  TIMINGS_FILE]
+        # The parser creates the output wavefunction from the file itself, it is not kept in `retrieved`
+        calcinfo.retrieve_temporary_list = [f'{self.metadata.options.output_wf_basename}.tar.gz']
 
         return calcinfo
@@ -14,6 +14,10 @@ from aiida.orm import Float, SinglefileData
 
 from ase.io import read
 
+from aiida_qp2.utils.ezfio_archive import has_wavefunction, open_wavefunction
+from aiida_qp2.utils.profiling import profile_parse
+from aiida_qp2.utils.timings import attach_timings
+
 QP2Calculation = CalculationFactory('qp2.create')
 
 
@@ -34,6 +38,7 @@ class QP2CreateParser(Parser):
         if not issubclass(node.process_class, QP2Calculation):
             raise exceptions.ParsingError('Can only parse QP2Calculation')
 
+    @profile_parse
     def parse(self, **kwargs):  # pylint: disable=too-many-locals
         """
         Parse outputs, store results in database.
@@ -45,6 +50,7 @@ class QP2CreateParser(Parser):
         output_filename = self.node.get_option('output_filename')
         output_wf_filename = self.node.get_option(
             'output_wf_basename') + '.tar.gz'
+        retrieved_temporary_folder = kwargs.get('retrieved_temporary_folder')
 
         # Put wavefunction into the output nodes
         try:
@@ -52,19 +58,23 @@ class QP2CreateParser(Parser):
         except exceptions.NotExistent:
             return self.exit_codes.ERROR_NO_RETRIEVED_FOLDER
 
+        attach_timings(self)
+
         files_retrieved = self.retrieved.list_object_names()
         files_expected = [output_filename, output_wf_filename]
-        if not set(files_expected) <= set(files_retrieved):
+        if output_filename not in files_retrieved or not has_wavefunction(out_folder, output_wf_filename,
+                                                                          retrieved_temporary_folder):
             self.logger.error("Found files '{}', expected to find '{}'".format(
                 files_retrieved, files_expected))
             return self.exit_codes.ERROR_MISSING_OUTPUT_FILES
 
         # Store the wavefunction in the database
-        with out_folder.open(output_wf_filename, 'rb') as handle:
-            wf_file = SinglefileData(file=handle)
+        with self.profile.phase('wavefunction_store'), \
+             open_wavefunction(out_folder, output_wf_filename, retrieved_temporary_folder) as source:
+            wf_file = SinglefileData(file=source, filename=output_wf_filename)
 
         # Read the structure from the input file
-        with out_folder.open('aiida.xyz', 'r') as handle:
+        with self.profile.phase('structure_read'), out_folder.open('aiida.xyz', 'r') as handle:
             atoms = read(handle, format='xyz')
 
         # Set the wavefunction as an attribute of the output node
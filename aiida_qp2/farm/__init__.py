@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+aiida-qp2
+
+AiiDA plugin for the Quantum Package 2.0
+"""
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Calculation class for the Quantum Package code.
+
+CalcJob packing many small qp runs (creation of EZFIO files from
+structures and/or runs on existing wavefunctions) into a single
+scheduler job. The items are executed concurrently by a task farm
+limited by the allocated cores.
+
+"""
+
+from aiida.common import CalcInfo, CodeInfo
+from aiida.engine import CalcJob
+from aiida.engine.processes.calcjobs.calcjob import validate_calc_job
+from aiida.orm import Dict, Code, StructureData, SinglefileData
+
+
+def validate_inputs(inputs, ctx):
+    """Check that every item has exactly one wavefunction or structure"""
+
+    error = validate_calc_job(inputs, ctx)
+    if error:
+        return error
+
+    parameters = inputs.get('parameters', {})
+    wavefunctions = inputs.get('wavefunctions', {})
+    structures = inputs.get('structures', {})
+
+    if not parameters:
+        return 'at least one item has to be specified in `parameters`'
+
+    for label in set(wavefunctions) | set(structures):
+        if label not in parameters:
+            return f"item '{label}' has no parameters"
+
+    for label, params in parameters.items():
+        if (label in wavefunctions) == (label in structures):
+            return f"item '{label}' needs either a wavefunction or a structure"
+        if label in wavefunctions and 'run_type' not in params.get_dict():
+            return f"item '{label}' runs on a wavefunction but no run_type is given"
+
+    return None
+
+
+class QP2FarmCalculation(CalcJob):
+    """ AiiDA calculation plugin for Quantum Package.
+        Runs many small qp jobs inside one scheduler allocation.
+    """
+
+    # Defaults
+    _INPUT_FILE = 'aiida.inp'
+    _ITEM_INPUT_FILE = 'aiida.item.sh'
+    _INPUT_COORDS_FILE = 'aiida.xyz'
+    _EXIT_CODE_FILE = 'aiida.exit_code'
+    _ITEM_FOLDER = 'item_{}'
+
+    @classmethod
+    def define(cls, spec):
+        """ Define inputs and outputs of the calculation."""
+        # yapf: disable
+        super().define(spec)
+
+        spec.input_namespace('parameters',
+                             valid_type=Dict,
+                             dynamic=True,
+                             help='Parameters of each item (key is the item label). Supported: run_type, '
+                                  'qp_prepend, qp_append and, for structures, basis_set and pseudo_potential.')
+
+        spec.input_namespace('wavefunctions',
+                             valid_type=SinglefileData,
+                             dynamic=True,
+                             required=False,
+                             help='Wavefunction of the items running on an existing EZFIO file.')
+
+        spec.input_namespace('structures',
+                             valid_type=StructureData,
+                             dynamic=True,
+                             required=False,
+                             help='Structure of the items creating a new EZFIO file.')
+
+        spec.input('code',
+                   valid_type=Code,
+                   required=True,
+                   help='The `Code` to use for this job.')
+
+        spec.inputs.validator = validate_inputs
+
+        # Metadata
+        spec.input('metadata.options.output_wf_basename',
+                   valid_type=str,
+                   required=True,
+                   default='aiida.wf',
+                   help='Base name of the output wavefunction file (without .tar.gz or .h5).')
+
+        spec.input('metadata.options.output_filename',
+                   valid_type=str,
+                   default='aiida-qp2.out')
+
+        spec.input('metadata.options.store_wavefunction',
+                   valid_type=bool,
+                   default=True,
+                   help='If False, no output wavefunctions are created and the packed EZFIO files are kept in the '
+                        '`retrieved` folder instead.')
+
+        spec.input('metadata.options.threads_per_item',
+                   valid_type=int,
+                   default=1,
+                   help='Number of OpenMP threads of each item, the number of concurrent items is '
+                        'the number of allocated cores divided by this number.')
+
+        spec.input('metadata.options.withmpi',
+                   valid_type=bool,
+                   default=False)
+        spec.inputs['metadata']['options']['resources'].default = {
+            'num_machines': 1,
+            'num_mpiprocs_per_machine': 1,
+        }
+
+        # Parser
+        spec.inputs['metadata']['options']['parser_name'].default = 'qp2.farm'
+
+        # Output parameters
+        spec.output_namespace('items',
+                              dynamic=True,
+                              help='Outputs of each item (output_energy, output_wavefunction), key is the item label')
+
+        spec.exit_code(100, 'ERROR_NO_RETRIEVED_FOLDER', message='The retrieved folder data node could not be accessed.')
+        spec.exit_code(300, 'ERROR_MISSING_OUTPUT_FILES', message='Calculation did not produce all expected output files.')
+        spec.exit_code(420, 'ERROR_ITEMS_FAILED', message='Some of the items failed, see the log of the calculation.')
+
+    def prepare_for_submission(self, folder):
+        """
+        Create input files.
+
+        :param folder: an `aiida.common.folders.Folder`
+                       where the plugin should temporarily
+                       place all files needed by the calculation.
+        :return: `aiida.common.datastructures.CalcInfo` instance
+        """
+
+        options = self.metadata.options
+        output_wf_filename = f'{options.output_wf_basename}.tar.gz'
+
+        local_copy_list = []
+        retrieve_list = []
+        retrieve_temporary_list = []
+
+        for label in sorted(self.inputs.parameters):
+            item_folder = self._ITEM_FOLDER.format(label)
+            folder.get_subfolder(item_folder, create=True)
+
+            with folder.open(f'{item_folder}/{self._ITEM_INPUT_FILE}', 'w') as handle:
+                self._write_item_file(handle, label)
+
+            if label in self.inputs.get('wavefunctions', {}):
+                wavefunction = self.inputs.wavefunctions[label]
+                local_copy_list.append((wavefunction.uuid, wavefunction.filename, f'{item_folder}/aiida.wf.tar.gz'))
+            else:
+                with folder.open(f'{item_folder}/{self._INPUT_COORDS_FILE}', 'w') as handle:
+                    self.inputs.structures[label].get_ase().write(handle, format='xyz')
+                retrieve_list.append((f'{item_folder}/{self._INPUT_COORDS_FILE}', '.', 2))
+
+            # Keep the item folder in the retrieved files
+            for filename in (options.output_filename, self._EXIT_CODE_FILE):
+                retrieve_list.append((f'{item_folder}/{filename}', '.', 2))
+            if options.store_wavefunction:
+                retrieve_temporary_list.append((f'{item_folder}/{output_wf_filename}', '.', 2))
+            else:
+                retrieve_list.append((f'{item_folder}/{output_wf_filename}', '.', 2))
+
+        with folder.open(self._INPUT_FILE, 'w') as handle:
+            self._write_input_file(handle)
+
+        # Prepare a `CodeInfo` to be returned to the engine
+        codeinfo = CodeInfo()
+        codeinfo.code_uuid = self.inputs.code.uuid
+        codeinfo.stdin_name = self._INPUT_FILE
+        codeinfo.stdout_name = options.output_filename
+
+        # Prepare a `CalcInfo` to be returned to the engine
+        calcinfo = CalcInfo()
+        calcinfo.uuid = self.uuid
+        calcinfo.stdin_name = self._INPUT_FILE
+        calcinfo.stdout_name = options.output_filename
+        calcinfo.codes_info = [codeinfo]
+
+        calcinfo.local_copy_list = local_copy_list
+        calcinfo.retrieve_list = [options.output_filename] + retrieve_list
+        # The parser creates the output wavefunctions from the files themselves, they are not kept in `retrieved`
+        # (unless `store_wavefunction` is False)
+        calcinfo.retrieve_temporary_list = retrieve_temporary_list
+
+        return calcinfo
+
+    def _num_slots(self):
+        """Number of items running concurrently
+
+        The task farm runs on the first machine of the allocation.
+        """
+        resources = self.metadata.options.resources
+        cores = resources.get('num_mpiprocs_per_machine', 1) * resources.get('num_cores_per_mpiproc', 1)
+        return max(1, cores // self.metadata.options.threads_per_item)
+
+    def _write_input_file(self, handle):
+        """Write the task farm script to the handle"""
+        # yapf: disable
+
+        options = self.metadata.options
+        labels = ' '.join(sorted(self.inputs.parameters))
+
+        # Every item runs in a subshell so that the `qp` shell function and the
+        # environment of the code are inherited, `set_file` stays local to the item.
+        handle.write('#!/bin/bash\n')
+        handle.write('set -x\n')
+        handle.write(f'export OMP_NUM_THREADS={options.threads_per_item}\n')
+        handle.write(f'AIIDA_FARM_SLOTS={self._num_slots()}\n')
+        handle.write('_aiida_run_item() {\n')
+        handle.write(f'    cd {self._ITEM_FOLDER.format("$1")}\n')
+        handle.write(f'    ( source ./{self._ITEM_INPUT_FILE} ) > {options.output_filename} 2>&1\n')
+        handle.write(f'    echo $? > {self._EXIT_CODE_FILE}\n')
+        handle.write('}\n')
+        handle.write(f'for item in {labels}; do\n')
+        handle.write('    while [ $(jobs -rp | wc -l) -ge $AIIDA_FARM_SLOTS ]; do\n')
+        handle.write('        wait -n\n')
+        handle.write('    done\n')
+        handle.write('    _aiida_run_item $item &\n')
+        handle.write('done\n')
+        handle.write('wait\n')
+
+    def _write_item_file(self, handle, label):
+        """Write the script of a single item to the handle"""
+        # yapf: disable
+
+        parameters = self.inputs.parameters[label].get_dict()
+        run_type = parameters.get('run_type', None)
+        append = parameters.get('qp_append', '')
+
+        code_command = 'qp'
+        config_command = 'set'
+        run_command = f'qp run {run_type} {append}'
+        ezfio = ''
+
+        if run_type == 'qmcchem':
+            code_command = 'qmcchem'
+            config_command = 'edit'
+            run_command = 'qmcchem run aiida.ezfio'
+            ezfio = 'aiida.ezfio'
+
+        handle.write('set -e\n')
+
+        if label in self.inputs.get('wavefunctions', {}):
+            handle.write('tar xzf aiida.wf.tar.gz\n')
+        else:
+            create_command = f"qp create_ezfio -b {parameters.get('basis_set', 'cc-pvdz')}"
+            if parameters.get('pseudo_potential', ''):
+                create_command += f" -p {parameters['pseudo_potential']}"
+            handle.write(f'{create_command} {self._INPUT_COORDS_FILE}\n')
+
+        if run_type is not None:
+            handle.write('qp set_file aiida.ezfio\n')
+            for value in parameters.get('qp_prepend', []):
+                handle.write(f'{code_command} {config_command} {value} {ezfio}\n')
+            handle.write(run_command + '\n')
+
+        handle.write(f'tar czf {self.metadata.options.output_wf_basename}.tar.gz *.ezfio\n')
+#EOF
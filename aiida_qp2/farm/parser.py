@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Parser for the QP2Farm calculation.
+
+"""
+
+from aiida.parsers.parser import Parser
+from aiida.plugins import CalculationFactory
+from aiida.common import exceptions
+from aiida.orm import Float
+
+from ase.io import read
+
+from aiida_qp2.utils.ezfio_archive import has_wavefunction, open_wavefunction, scan_wavefunction
+from aiida_qp2.utils.project import set_head
+
+QP2FarmCalculation = CalculationFactory('qp2.farm')
+
+
+class QP2FarmParser(Parser):
+    """
+    Parser class fanning the results of a task farm out to one output namespace per item.
+    """
+    def __init__(self, node):
+        """
+        Initialize Parser instance
+
+        Checks that the ProcessNode being passed was produced by a QP2FarmCalculation.
+
+        :param node: ProcessNode of calculation
+        :param type node: :class:`aiida.orm.ProcessNode`
+        """
+        super().__init__(node)
+        if not issubclass(node.process_class, QP2FarmCalculation):
+            raise exceptions.ParsingError('Can only parse QP2FarmCalculation')
+
+    def parse(self, **kwargs):  # pylint: disable=too-many-locals
+        """
+        Parse outputs, store results in database.
+
+        :returns: an exit code, if parsing fails (or nothing if parsing succeeds)
+        """
+
+        try:
+            out_folder = self.retrieved
+        except exceptions.NotExistent:
+            return self.exit_codes.ERROR_NO_RETRIEVED_FOLDER
+
+        failed = []
+        for label in sorted(self.node.inputs.parameters):
+            if not self.parse_item(out_folder, label, kwargs.get('retrieved_temporary_folder')):
+                failed.append(label)
+
+        if failed:
+            self.logger.error(f"Items {', '.join(failed)} failed")
+            return self.exit_codes.ERROR_ITEMS_FAILED
+
+    def parse_item(self, out_folder, label, retrieved_temporary_folder=None):
+        """
+        Parse the folder of a single item and attach its outputs in the `items.<label>` namespace.
+
+        :returns: True if the item succeeded
+        """
+        item_folder = QP2FarmCalculation._ITEM_FOLDER.format(label)
+        output_wf_filename = self.node.get_option('output_wf_basename') + '.tar.gz'
+        store_wavefunction = self.node.get_option('store_wavefunction')
+        run_type = self.node.inputs.parameters[label].get_dict().get('run_type', None)
+
+        files_retrieved = out_folder.list_object_names(item_folder) if item_folder in out_folder.list_object_names() else []
+
+        if QP2FarmCalculation._EXIT_CODE_FILE not in files_retrieved:
+            self.logger.error(f"Item '{label}' did not run")
+            return False
+
+        with out_folder.open(f'{item_folder}/{QP2FarmCalculation._EXIT_CODE_FILE}', 'r') as handle:
+            exit_status = int(handle.read().strip() or 1)
+
+        item_wf_filename = f'{item_folder}/{output_wf_filename}'
+        if exit_status != 0 or not has_wavefunction(out_folder, item_wf_filename, retrieved_temporary_folder):
+            self.logger.error(f"Item '{label}' exited with status {exit_status}")
+            return False
+
+        with open_wavefunction(out_folder, item_wf_filename, retrieved_temporary_folder) as source:
+            energies, wf_file = scan_wavefunction(source, run_type, output_wf_filename, store_wavefunction)
+
+        if energies:
+            self.out(f'items.{label}.output_energy', Float(energies['energy'][0]))
+
+        if wf_file is not None:
+            # Items created from a structure get the formula like `QP2CreateParser` does
+            if QP2FarmCalculation._INPUT_COORDS_FILE in files_retrieved:
+                with out_folder.open(f'{item_folder}/{QP2FarmCalculation._INPUT_COORDS_FILE}', 'r') as handle:
+                    atoms = read(handle, format='xyz')
+                wf_file.base.attributes.set('formula', atoms.get_chemical_formula())
+
+            if 'wavefunctions' in self.node.inputs and label in self.node.inputs.wavefunctions:
+                set_head(self.node.inputs.wavefunctions[label], wf_file)
+            self.out(f'items.{label}.output_wavefunction', wf_file)
+
+        return True
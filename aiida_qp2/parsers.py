@@ -13,6 +13,10 @@ from aiida.plugins import CalculationFactory
 from aiida.common import exceptions
 from aiida.orm import Float, SinglefileData
 
+from aiida_qp2.utils.ezfio_archive import has_wavefunction, open_wavefunction
+from aiida_qp2.utils.project import set_head
+from aiida_qp2.utils.timings import attach_timings
+
 QP2Calculation = CalculationFactory('qp2')
 
 
@@ -44,17 +48,21 @@ class QP2Parser(Parser):
         # Get filename of the output wavefunction file (required)
         output_wf_filename = self.node.get_option(
             'output_wf_basename') + '.tar.gz'
+        # Get the folder with the output wavefunction (not kept in the retrieved folder)
+        retrieved_temporary_folder = kwargs.get('retrieved_temporary_folder')
 
         try:
             out_folder = self.retrieved
         except exceptions.NotExistent:
             return self.exit_codes.ERROR_NO_RETRIEVED_FOLDER
 
+        attach_timings(self)
+
         # Check that folder content is as expected
         files_retrieved = self.retrieved.list_object_names()
         files_expected = [output_filename, output_wf_filename]
-        # Note: set(A) <= set(B) checks whether A is a subset of B
-        if not set(files_expected) <= set(files_retrieved):
+        if output_filename not in files_retrieved or not has_wavefunction(out_folder, output_wf_filename,
+                                                                          retrieved_temporary_folder):
             self.logger.error("Found files '{}', expected to find '{}'".format(
                 files_retrieved, files_expected))
             return self.exit_codes.ERROR_MISSING_OUTPUT_FILES
@@ -77,12 +85,11 @@ class QP2Parser(Parser):
             #else:
             #    return self.exit_codes.ERROR_MISSING_ENERGY
 
-        # build absolute path of the wavefunction file to store as SinglefileData node
-        abs_path_wf_file = path_join(
-            out_folder._repository._get_base_folder().abspath,  #pylint: disable=protected-access
-            output_wf_filename)
         # Create a SinglefileData node corresponding to the output ezfio tarball
-        wf_file = SinglefileData(abs_path_wf_file)
+        with open_wavefunction(out_folder, output_wf_filename, retrieved_temporary_folder) as source:
+            wf_file = SinglefileData(file=source, filename=output_wf_filename)
+        if 'wavefunction' in self.node.inputs:
+            set_head(self.node.inputs.wavefunction, wf_file)
         self.out('output_wavefunction', wf_file)
 
         return ExitCode(0)
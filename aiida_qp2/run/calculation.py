@@ -7,6 +7,7 @@ Register calculations via the "aiida.calculations" entry point in setup.json.
 
 # needed in _unpack function
 from collections.abc import Sequence
+import shlex
 
 from aiida.common import CalcInfo, CodeInfo
 from aiida.engine import CalcJob
@@ -14,6 +15,8 @@ from aiida.orm import Dict, Int, Float, Code, Str, StructureData, SinglefileData
 from aiida.plugins import DataFactory
 from pymatgen.core.periodic_table import Element
 
+from aiida_qp2.utils.timings import TIMINGS_FILE, step_function
+
 
 class QP2RunCalculation(CalcJob):
     """ AiiDA calculation plugin wrapping the Quantum Package code.
@@ -24,6 +27,10 @@ class QP2RunCalculation(CalcJob):
     _INPUT_COORDS_FILE = 'aiida.xyz'
     _BASIS_FILE = 'aiida-basis-set'
     _PSEUDO_FILE = 'aiida-pseudo'
+    _CHECKPOINT_FILE = 'aiida.checkpoint'
+    _EXIT_CODE_FILE = 'aiida.exit_code'
+    _QMCCHEM_PROGRESS_FILE = 'aiida.qmcchem_progress'
+    _QMCCHEM_STOP_FILE = 'aiida.qmcchem_stop'
 
     @classmethod
     def define(cls, spec):
@@ -61,7 +68,38 @@ class QP2RunCalculation(CalcJob):
 
         spec.input('metadata.options.store_wavefunction',
                    valid_type=bool,
-                   default=True)
+                   default=True,
+                   help='If False, no output wavefunction is created and the packed EZFIO file is kept in the '
+                        '`retrieved` folder instead.')
+
+        spec.input('metadata.options.scratch_dir',
+                   valid_type=str,
+                   default='',
+                   help='Node-local directory (e.g. `$TMPDIR`) where the wavefunction is extracted and qp runs, '
+                        'the result is packed back into the working directory. Disabled if empty.')
+
+        # Multi-node QMC=Chem (only used when more than one machine is requested)
+        spec.input('metadata.options.qmcchem_slave_launcher',
+                   valid_type=str,
+                   default='srun --nodes={num_slaves} --ntasks={num_slaves} --ntasks-per-node=1 --exclude=$(hostname)',
+                   help='Command used to start one QMC=Chem slave on each additional node, '
+                        '`{num_slaves}` is replaced by the number of slave nodes.')
+
+        spec.input('metadata.options.qmcchem_port',
+                   valid_type=int,
+                   default=41279,
+                   help='Port of the QMC=Chem master the slaves connect to.')
+
+        spec.input('metadata.options.qmcchem_progress_interval',
+                   valid_type=int,
+                   default=60,
+                   help='Seconds between two dumps of the QMC=Chem results read by the '
+                        '`qp2.qmcchem_target_error` monitor (only with `qmcchem_target_error`).')
+
+        spec.input('metadata.options.qmcchem_slave_delay',
+                   valid_type=int,
+                   default=10,
+                   help='Seconds to wait for the QMC=Chem master to start before launching the slaves.')
 
         spec.inputs['metadata']['options']['parser_name'].default = 'qp2.run'
 
@@ -72,12 +110,57 @@ class QP2RunCalculation(CalcJob):
         }
 
         # Output parameters
+        spec.output('output_parameters',
+                    valid_type=Dict,
+                    required=False,
+                    help='Quantities parsed from the output of the run (iterations, timings, properties...)')
+
         spec.output('output_energy',
                     valid_type=Float,
                     required=False,
                     help='The result of the calculation')
         spec.output_node = 'output_energy'
 
+        spec.output('output_job_timings',
+                    valid_type=Dict,
+                    required=False,
+                    help='Wall/CPU time and peak memory of each step of the job script (unpack, set, run, pack)')
+
+        spec.output('output_parse_profile',
+                    valid_type=Dict,
+                    required=False,
+                    help='Time spent in each phase of the parser and its memory usage')
+
+        spec.output('output_energies',
+                    valid_type=Dict,
+                    required=False,
+                    help='Energy-related quantities of the packed EZFIO file (one value per state)')
+
+        spec.output('output_json_parameters',
+                    valid_type=Dict,
+                    required=False,
+                    help='Scalar values of the JSON files written by qp in the EZFIO file')
+
+        spec.output('output_json_arrays',
+                    valid_type=DataFactory('core.array'),
+                    required=False,
+                    help='Numbers in the lists of the JSON files written by qp (one row per item)')
+
+        spec.output('output_trajectory',
+                    valid_type=DataFactory('core.array'),
+                    required=False,
+                    help='Convergence of the CIPSI iterations (n_det and per-state energy, PT2, rPT2, variance)')
+
+        spec.output('output_energy_extrapolated',
+                    valid_type=Float,
+                    required=False,
+                    help='Energy extrapolated to PT2 = 0 (requires the `extrapolate` parameter)')
+
+        spec.output('output_energy_extrapolated_error',
+                    valid_type=Float,
+                    required=False,
+                    help='Standard error of the extrapolated energy')
+
         spec.output('output_energy_error',
                     valid_type=Float,
                     required=False,
@@ -96,6 +179,16 @@ class QP2RunCalculation(CalcJob):
                     help='The error of the standard deviation calculation')
         spec.output_node = 'output_energy_stddev_error'
 
+        spec.output('output_properties',
+                    valid_type=Dict,
+                    required=False,
+                    help='All the properties computed by QMC=Chem ({name: {value, error, blocks}})')
+
+        spec.output('output_blocks',
+                    valid_type=DataFactory('core.array'),
+                    required=False,
+                    help='Per-block values and weights of the QMC=Chem properties')
+
         spec.output('output_number_of_blocks',
                     valid_type=Int,
                     required=False,
@@ -106,6 +199,13 @@ class QP2RunCalculation(CalcJob):
                     help='The wave function file (EZFIO or TREXIO)')
         spec.output_node = 'output_wavefunction'
 
+        spec.exit_code(100, 'ERROR_NO_RETRIEVED_FOLDER', message='The retrieved folder data node could not be accessed.')
+        spec.exit_code(300, 'ERROR_MISSING_OUTPUT_FILES', message='Calculation did not produce all expected output files.')
+        spec.exit_code(400, 'ERROR_MISSING_ENERGY', message='Energy value is not present in the output file.')
+        spec.exit_code(410, 'ERROR_CHECKPOINTED',
+                       message='The run was interrupted by the scheduler, the partial wavefunction was checkpointed '
+                               'and can be restarted.')
+
 
     def prepare_for_submission(self, folder):
         """
@@ -138,10 +238,37 @@ class QP2RunCalculation(CalcJob):
 
         calcinfo.local_copy_list = []
         calcinfo.retrieve_list = [self.metadata.options.output_filename,
-                                  f'{self.metadata.options.output_wf_basename}.tar.gz']
+                                  self._CHECKPOINT_FILE,
+                                  self._EXIT_CODE_FILE,
+                                  TIMINGS_FILE]
+        output_wf_filename = f'{self.metadata.options.output_wf_basename}.tar.gz'
+        if self.metadata.options.store_wavefunction:
+            # The parser creates the output wavefunction from the file itself, it is not kept in `retrieved`
+            calcinfo.retrieve_temporary_list = [output_wf_filename]
+        else:
+            # No output wavefunction: `retrieved` holds the only copy of the result
+            calcinfo.retrieve_list.append(output_wf_filename)
 
         return calcinfo
 
+    @classmethod
+    def get_restart_builder(cls, node):
+        """Return a builder continuing a checkpointed run from its partial wavefunction
+
+        :param node: the `CalcJobNode` which exited with `ERROR_CHECKPOINTED`
+        """
+        if 'output_wavefunction' not in node.outputs:
+            raise ValueError(f'Calculation {node.pk} has no wavefunction to restart from')
+
+        parameters = node.inputs.parameters.get_dict()
+        parameters['restart'] = True
+
+        builder = node.get_builder_restart()
+        builder.wavefunction = node.outputs.output_wavefunction
+        builder.parameters = Dict(dict=parameters)
+
+        return builder
+
     def _write_input_file(self, handle):
         """Write the input file to the handle"""
         # yapf: disable
@@ -149,6 +276,8 @@ class QP2RunCalculation(CalcJob):
         run_type = self.inputs.parameters.get_dict().get('run_type', 'none')
         tbf = self.inputs.parameters.get_dict().get('trexio_bug_fix', False)
         append = self.inputs.parameters.get_dict().get('qp_append', '')
+        restart = self.inputs.parameters.get_dict().get('restart', False)
+        target_error = self.inputs.parameters.get_dict().get('qmcchem_target_error', None)
 
         if run_type == 'none':
             raise ValueError('run_type not specified in parameters')
@@ -158,28 +287,156 @@ class QP2RunCalculation(CalcJob):
         run_command = f'qp run {run_type} {append}'
         ezfio = ''
 
+        # Stop the run cleanly when checkpointing
+        stop_command = 'pkill -TERM -P $AIIDA_RUN_PID'
+
         if run_type == 'qmcchem':
             code_command = 'qmcchem'
             config_command = 'edit'
-            run_command = 'qmcchem run aiida.ezfio'
+            run_command = self._qmcchem_run_command()
+            stop_command = 'qmcchem stop aiida.ezfio'
+            if target_error is not None:
+                run_command = self._qmcchem_watch_command(run_command)
             ezfio = 'aiida.ezfio'
 
         handle.write('#!/bin/bash\n')
         handle.write('set -e\n')
         handle.write('set -x\n')
-        handle.write('tar xzf aiida.wf.tar.gz\n')
-        handle.write(f'qp set_file aiida.ezfio\n')
+        handle.write('AIIDA_WORKDIR=$(pwd)\n')
+        handle.write(step_function())
+        handle.write(self._unpack_command())
+        handle.write(f'_aiida_step set_file qp set_file aiida.ezfio\n')
 
         # Iter over prepend parameters
         if self.inputs.parameters.get_dict().get('qp_prepend', None):
             for value in self.inputs.parameters.get_dict().get('qp_prepend'):
-                handle.write(f'{code_command} {config_command} {value} {ezfio}\n')
+                step = shlex.quote(f'{config_command} {value}')
+                handle.write(f'_aiida_step {step} {code_command} {config_command} {value} {ezfio}\n')
 
-        handle.write(run_command + '\n')
+        # Continue from the determinants of a checkpointed run (QMC=Chem simply appends blocks)
+        if restart and run_type != 'qmcchem':
+            handle.write("_aiida_step 'set determinants read_wf true' qp set determinants read_wf true\n")
+
+        handle.write(self._checkpoint_trap(stop_command))
+
+        # The run is put in the background so that the trap is executed as soon as the signal arrives
+        handle.write('{\n' + run_command + '\n} &\n')
+        handle.write('AIIDA_RUN_PID=$!\n')
+        handle.write('AIIDA_EXIT_CODE=0\n')
+        handle.write('_aiida_step run wait $AIIDA_RUN_PID || AIIDA_EXIT_CODE=$?\n')
+        handle.write(f'echo $AIIDA_EXIT_CODE > "$AIIDA_WORKDIR/{self._EXIT_CODE_FILE}"\n')
+        handle.write('echo "#*#* ERROR CODE: $AIIDA_EXIT_CODE #*#*"\n')
 
         if tbf:
-            handle.write(f'sed -i "1s|^|$(pwd)/|" aiida.ezfio/trexio/trexio_file\n')
+            # The scratch directory is removed at the end of the job
+            handle.write('sed -i "1s|^|$AIIDA_WORKDIR/|" aiida.ezfio/trexio/trexio_file\n')
+
+        handle.write(f'_aiida_step pack tar czf "$AIIDA_WORKDIR/{self.metadata.options.output_wf_basename}.tar.gz" *.ezfio\n')
+
+    def _unpack_command(self):
+        """Return the shell lines extracting the input wavefunction
+
+        With `scratch_dir` the EZFIO file is extracted in a fresh directory on the
+        node-local scratch and qp runs there: the many small EZFIO reads and writes
+        hit the local disk instead of the (parallel) filesystem of the working directory.
+        The scratch directory is removed when the script exits.
+        """
+        scratch_dir = self.metadata.options.scratch_dir
 
-        handle.write(f'echo "#*#* ERROR CODE: $? #*#*"\n')
-        handle.write(f'tar czf {self.metadata.options.output_wf_basename}.tar.gz *.ezfio\n')
+        if not scratch_dir:
+            return '_aiida_step unpack tar xzf aiida.wf.tar.gz\n'
+
+        return '\n'.join([
+            f'AIIDA_SCRATCH=$(mktemp -d "{scratch_dir}/aiida-qp2.XXXXXX")',
+            'trap \'cd "$AIIDA_WORKDIR"; rm -rf "$AIIDA_SCRATCH"\' EXIT',
+            '_aiida_step unpack tar xzf aiida.wf.tar.gz -C "$AIIDA_SCRATCH"',
+            'cd "$AIIDA_SCRATCH"',
+        ]) + '\n'
+
+    def _checkpoint_trap(self, stop_command):
+        """Return the shell function packing the EZFIO file when the scheduler terminates the job
+
+        The scheduler sends SIGTERM when the walltime is reached (SLURM can also be asked
+        to send SIGUSR1 earlier, e.g. with `#SBATCH --signal=USR1@300`). The run is stopped,
+        whatever EZFIO state exists is packed into the output wavefunction and
+        the checkpoint file tells the parser that the run is partial.
+        """
+        output_wf_basename = self.metadata.options.output_wf_basename
+
+        return '\n'.join([
+            '_aiida_checkpoint() {',
+            '    trap - TERM USR1',
+            '    set +e',
+            f'    echo "$1" > "$AIIDA_WORKDIR/{self._CHECKPOINT_FILE}"',
+            f'    {stop_command}',
+            '    wait $AIIDA_RUN_PID',
+            f'    tar czf "$AIIDA_WORKDIR/{output_wf_basename}.tar.gz" *.ezfio',
+            '    exit 0',
+            '}',
+            "trap '_aiida_checkpoint TERM' TERM",
+            "trap '_aiida_checkpoint USR1' USR1",
+        ]) + '\n'
+
+    def _qmcchem_watch_command(self, run_command):
+        """Wrap the QMC=Chem run with a loop dumping the current results
+
+        The `qp2.qmcchem_target_error` monitor reads the dumped results and, once the
+        target error is reached, creates the stop file: QMC=Chem is then stopped
+        cleanly and the calculation is parsed as usual.
+        """
+        interval = self.metadata.options.qmcchem_progress_interval
+        progress = f'$AIIDA_WORKDIR/{self._QMCCHEM_PROGRESS_FILE}'
+
+        return '\n'.join([
+            '_aiida_qmcchem_watch() {',
+            f'    while sleep {interval}; do',
+            f'        if [ -f "$AIIDA_WORKDIR/{self._QMCCHEM_STOP_FILE}" ]; then',
+            '            qmcchem stop aiida.ezfio',
+            '            break',
+            '        fi',
+            f'        qmcchem result aiida.ezfio > "{progress}.tmp" 2> /dev/null && mv "{progress}.tmp" "{progress}"',
+            '    done',
+            '}',
+            '_aiida_qmcchem_watch &',
+            'AIIDA_WATCH_PID=$!',
+            # Also when QMC=Chem fails (set -e): the run is in a subshell, the trap is its own
+            "trap 'kill $AIIDA_WATCH_PID 2> /dev/null || true' EXIT",
+            run_command,
+        ])
+
+    def _qmcchem_run_command(self):
+        """Return the shell lines running QMC=Chem
+
+        On a single machine this is a plain `qmcchem run`. When more machines
+        are requested the master is started in the background on the first node
+        and one slave per additional node is launched with `qmcchem_slave_launcher`.
+        The slaves send their blocks to the master, so all the block statistics
+        end up in the EZFIO file of the master which is packed and retrieved.
+        The slaves are killed when the master exits, also when it fails (they would
+        keep the allocation until the walltime), and the status of the master is kept.
+        """
+        options = self.metadata.options
+        num_machines = options.resources.get('num_machines', 1)
+
+        if num_machines <= 1:
+            return 'qmcchem run aiida.ezfio'
+
+        # The slaves start in the directory of the master, which only exists on its node
+        if options.scratch_dir:
+            raise ValueError('scratch_dir cannot be used by a QMC=Chem run on more than one machine')
+
+        launcher = options.qmcchem_slave_launcher.format(num_slaves=num_machines - 1)
+
+        return '\n'.join([
+            'QMCCHEM_MASTER=$(hostname)',
+            'qmcchem run aiida.ezfio &',
+            'QMCCHEM_MASTER_PID=$!',
+            f'sleep {options.qmcchem_slave_delay}',
+            f'{launcher} qmcchem run -q tcp://${{QMCCHEM_MASTER}}:{options.qmcchem_port} aiida.ezfio &',
+            'QMCCHEM_SLAVES_PID=$!',
+            'QMCCHEM_STATUS=0',
+            'wait $QMCCHEM_MASTER_PID || QMCCHEM_STATUS=$?',
+            'kill $QMCCHEM_SLAVES_PID 2> /dev/null || true',
+            '(exit $QMCCHEM_STATUS)',
+        ])
 #EOF
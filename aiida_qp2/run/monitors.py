@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+CalcJob monitors for the QP2Run calculation.
+
+Register monitors via the "aiida.calculations.monitors" entry point in setup.json.
+"""
+
+import os
+import tempfile
+
+from aiida_qp2.utils.qmcchem import parse_property_line
+
+# Same names as `QP2RunCalculation`, kept here so that the monitor does not load the calculation
+_QMCCHEM_PROGRESS_FILE = 'aiida.qmcchem_progress'
+_QMCCHEM_STOP_FILE = 'aiida.qmcchem_stop'
+
+
+def qmcchem_target_error(node, transport, target_error=None):
+    """
+    Stop a QMC=Chem run once the error bar of `E_loc` is below the target.
+
+    The job script dumps `qmcchem result` periodically when the `qmcchem_target_error`
+    parameter is set. Once the target is reached the stop file is created in the
+    working directory and the job script stops QMC=Chem cleanly, so the
+    calculation is retrieved and parsed as usual.
+
+    :param node: the `CalcJobNode` being monitored
+    :param transport: an open transport to the computer running the job
+    :param target_error: target error of `E_loc`, taken from the `qmcchem_target_error`
+        parameter of the calculation if not given
+    :returns: always None, the job is never killed by the monitor
+    """
+    if target_error is None:
+        target_error = node.inputs.parameters.get_dict().get('qmcchem_target_error', None)
+
+    if target_error is None:
+        return None
+
+    workdir = node.get_remote_workdir()
+    progress = os.path.join(workdir, _QMCCHEM_PROGRESS_FILE)
+    stop = os.path.join(workdir, _QMCCHEM_STOP_FILE)
+
+    if transport.isfile(stop) or not transport.isfile(progress):
+        return None
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        local_progress = os.path.join(temp_dir, _QMCCHEM_PROGRESS_FILE)
+        transport.getfile(progress, local_progress)
+
+        error = None
+        with open(local_progress, 'r') as handle:
+            for line in handle:
+                result = parse_property_line(line)
+                if result is not None and result[0] == 'E_loc':
+                    _, energy, error, blocks = result
+
+        if error is None or error > target_error:
+            return None
+
+        node.logger.report(f'E_loc = {energy} +/- {error} ({blocks} blocks) reached the target error '
+                           f'{target_error}, stopping QMC=Chem')
+
+        local_stop = os.path.join(temp_dir, _QMCCHEM_STOP_FILE)
+        open(local_stop, 'w').close()
+        transport.putfile(local_stop, stop)
+
+    return None
@@ -4,23 +4,94 @@ Parsers provided by qp2.
 
 """
 
-import re
 from os.path import join as path_join
 
 from aiida.engine import ExitCode
 from aiida.parsers.parser import Parser
 from aiida.plugins import CalculationFactory
 from aiida.common import exceptions
-from aiida.orm import Float, Int, SinglefileData
-import json
+from aiida.orm import Dict, Float, Int, SinglefileData
+import math
+
+from aiida_qp2.utils.output_parser import parse_output
+from aiida_qp2.utils.extrapolation import build_trajectory, extrapolate_trajectory
+from aiida_qp2.utils.ezfio_archive import has_wavefunction, open_wavefunction, scan_wavefunction
+from aiida_qp2.utils.json_output import JsonCollector
+from aiida_qp2.utils.qmcchem import BlockCollector
+from aiida_qp2.utils.profiling import profile_parse
+from aiida_qp2.utils.project import set_head
+from aiida_qp2.utils.timings import attach_timings
 
 QP2RunCalculation = CalculationFactory('qp2.run')
 
-_DICTIONARIES = {
-    'scf': 'hartree_fock',
-    'ccsd': 'ccsd',
-    'fci': 'fci',
-}
+def read_exit_status(parser):
+    """
+    Return the exit status of the run written by the job script, or None if the file is missing.
+    """
+    if QP2RunCalculation._EXIT_CODE_FILE not in parser.retrieved.list_object_names():
+        return None
+
+    with parser.retrieved.open(QP2RunCalculation._EXIT_CODE_FILE, 'r') as handle:
+        content = handle.read().strip()
+
+    return int(content) if content.isdigit() else None
+
+
+def parse_checkpoint(parser, retrieved_temporary_folder=None):
+    """
+    Store the partial wavefunction of a checkpointed run (shared by the run parsers).
+
+    The wavefunction is always stored (whatever `store_wavefunction` is)
+    since it is needed to restart the run.
+    """
+    output_wf_filename = parser.node.get_option('output_wf_basename') + '.tar.gz'
+
+    with parser.retrieved.open(QP2RunCalculation._CHECKPOINT_FILE, 'r') as handle:
+        signal = handle.read().strip()
+
+    parser.logger.warning(f'Run interrupted by the scheduler (SIG{signal}), storing the partial wavefunction')
+
+    if not has_wavefunction(parser.retrieved, output_wf_filename, retrieved_temporary_folder):
+        return parser.exit_codes.ERROR_MISSING_OUTPUT_FILES
+
+    with open_wavefunction(parser.retrieved, output_wf_filename, retrieved_temporary_folder) as source:
+        wf_file = SinglefileData(file=source, filename=output_wf_filename)
+
+    wf_file.base.attributes.set('wavefunction', True)
+    wf_file.base.attributes.set('checkpoint', True)
+    if 'wavefunction' in parser.node.inputs:
+        set_head(parser.node.inputs.wavefunction, wf_file)
+    parser.out('output_wavefunction', wf_file)
+
+    return parser.exit_codes.ERROR_CHECKPOINTED
+
+
+def parse_qmcchem(parser, results):
+    """
+    Attach the properties of a QMC=Chem run, `E_loc` giving the energy outputs (shared by the run parsers).
+
+    :param parser: the `Parser` attaching the outputs
+    :param results: dictionary returned by `parse_output`
+    """
+    properties = results.get('properties', {})
+    if properties:
+        parser.out('output_properties', Dict(dict=properties))
+
+    energy, energy_err, number_of_blocks = (properties.get('E_loc', {}).get(key)
+                                            for key in ('value', 'error', 'blocks'))
+    energy_qmcvar, energy_qmcvar_err = (properties.get('E_loc_qmcvar', {}).get(key)
+                                        for key in ('value', 'error'))
+
+    if energy:
+        parser.out('output_energy', Float(energy))
+    if energy_err:
+        parser.out('output_energy_error', Float(energy_err))
+    if energy_qmcvar:
+        parser.out('output_energy_stddev', Float(energy_qmcvar))
+    if energy_qmcvar_err:
+        parser.out('output_energy_stddev_error', Float(energy_qmcvar_err))
+    if number_of_blocks:
+        parser.out('output_number_of_blocks', Int(number_of_blocks))
 
 
 class QP2RunParser(Parser):
@@ -40,6 +111,7 @@ class QP2RunParser(Parser):
         if not issubclass(node.process_class, QP2RunCalculation):
             raise exceptions.ParsingError('Can only parse QP2RunCalculation')
 
+    @profile_parse
     def parse(self, **kwargs):  # pylint: disable=too-many-locals
         """
         Parse outputs, store results in database.
@@ -48,115 +120,110 @@ class QP2RunParser(Parser):
         """
 
         output_filename = self.node.get_option('output_filename')
-
-        run_type = self.node.inputs.parameters.get_dict().get('run_type')
-
-        with self.retrieved.open(output_filename, 'r') as handle:
-            regex = re.compile(r'ERROR CODE: (\d+)')
-            for line in handle:
-                match = regex.match(line)
-                if match:
-                    return ExitCode(350 + int(match.group(1)))
-
-        # First check if it is not a qmcchem run
-        if run_type == 'qmcchem':
-            return self.parse_qmcchem()
-
         output_wf_basename = self.node.get_option('output_wf_basename')
         output_wf_filename = output_wf_basename + '.tar.gz'
         store_wavefunction = self.node.get_option('store_wavefunction')
+        retrieved_temporary_folder = kwargs.get('retrieved_temporary_folder')
+
+        parameters = self.node.inputs.parameters.get_dict()
+        run_type = parameters.get('run_type')
 
         try:
             out_folder = self.retrieved
         except exceptions.NotExistent:
             return self.exit_codes.ERROR_NO_RETRIEVED_FOLDER
 
-        files_retrieved = self.retrieved.list_object_names()
-        files_expected = [output_filename, output_wf_filename]
+        attach_timings(self)
 
-        if not set(files_expected) <= set(files_retrieved):
-            self.logger.error("Found files '{}', expected to find '{}'".format(
-                files_retrieved, files_expected))
-            return self.exit_codes.ERROR_MISSING_OUTPUT_FILES
+        # The job was stopped by the scheduler and packed a partial wavefunction
+        if QP2RunCalculation._CHECKPOINT_FILE in out_folder.list_object_names():
+            return parse_checkpoint(self, retrieved_temporary_folder)
 
-        import tarfile
-        method = _DICTIONARIES.get(run_type, None)
-        if method:
-            path_energy = f'aiida.ezfio/{method}/energy'
-            with out_folder.open(output_wf_filename, 'rb') as wf_out:
-                with tarfile.open(fileobj=wf_out, mode='r') as tar:
-                    f_out = tar.extractfile(path_energy)
-                    if f_out is None:
-                        raise exceptions.ParsingError(
-                            f'File {path_energy} not found in wavefunction file'
-                        )
-                    from aiida.orm import Float
-                    self.out('output_energy', Float(float(f_out.read())))
-        else:
-            energy = self._json_reader(out_folder)
-
-        if store_wavefunction:
-            # Store the wavefunction file
-            with out_folder.open(output_wf_filename, 'rb') as handle:
-                wf_file = SinglefileData(file=handle)
-
-            wf_file.base.attributes.set('wavefunction', True)
-            self.out('output_wavefunction', wf_file)
+        files_retrieved = out_folder.list_object_names()
+        files_expected = [output_filename, output_wf_filename]
 
-    def parse_qmcchem(self, **kwargs):
+        # The exit status of qp, without reading the output
+        exit_status = read_exit_status(self)
+        if exit_status:
+            self.logger.error(f'The run exited with status {exit_status}')
+            return ExitCode(350 + exit_status)
 
-        output_filename = self.node.get_option('output_filename')
-        output_wf_basename = self.node.get_option('output_wf_basename')
-        output_wf_filename = output_wf_basename + '.tar.gz'
-        store_wavefunction = self.node.get_option('store_wavefunction')
+        # Single pass over the output (only its end for the run types printing a final summary)
+        if output_filename in files_retrieved:
+            with self.profile.phase('output_scan'), out_folder.open(output_filename, 'rb') as handle:
+                results = parse_output(handle, run_type)
 
-        try:
-            out_folder = self.retrieved
-        except exceptions.NotExistent:
-            return self.exit_codes.ERROR_NO_RETRIEVED_FOLDER
+            self.out('output_parameters', Dict(dict=results))
 
-        files_retrieved = self.retrieved.list_object_names()
-        files_expected = [output_filename, output_wf_filename]
+            # Calculations run before the exit status file was written
+            if exit_status is None and results.get('error_code', 0) != 0:
+                return ExitCode(350 + results['error_code'])
 
-        if not set(files_expected) <= set(files_retrieved):
+        if output_filename not in files_retrieved or not has_wavefunction(out_folder, output_wf_filename,
+                                                                          retrieved_temporary_folder):
             self.logger.error("Found files '{}', expected to find '{}'".format(
                 files_retrieved, files_expected))
             return self.exit_codes.ERROR_MISSING_OUTPUT_FILES
 
-        energy = None
-        energy_err = None
-        energy_qmcvar = None
-        energy_qmcvar_err = None
-        number_of_blocks = None
-        with out_folder.open(output_filename, 'r') as handle:
-            for line in handle:
-                if '          E_loc :' in line:
-                    energy = float(line.split()[2])
-                    energy_err = float(line.split()[4])
-                    number_of_blocks = int(line.split()[5].replace(
-                        '(', '').replace(')', ''))
-                if '   E_loc_qmcvar :' in line:
-                    energy_qmcvar = float(line.split()[2])
-                    energy_qmcvar_err = float(line.split()[4])
-        if energy:
-            self.out('output_energy', Float(energy))
-        if energy_err:
-            self.out('output_energy_error', Float(energy_err))
-        if energy_qmcvar:
-            self.out('output_energy_stddev', Float(energy_qmcvar))
-        if energy_qmcvar_err:
-            self.out('output_energy_stddev_error', Float(energy_qmcvar_err))
-        if number_of_blocks:
-            self.out('output_number_of_blocks', Int(number_of_blocks))
-
-        if store_wavefunction:
-            # Store the wavefunction file
-            with out_folder.open(output_wf_filename, 'rb') as handle:
-                wf_file = SinglefileData(file=handle)
-
-            wf_file.base.attributes.set('wavefunction', True)
+        # First check if it is not a qmcchem run
+        if run_type == 'qmcchem':
+            parse_qmcchem(self, results)
+
+        # CIPSI convergence trajectory
+        trajectory = build_trajectory(results.get('iterations'))
+        if trajectory is not None:
+            self.out('output_trajectory', trajectory)
+            if parameters.get('extrapolate'):
+                self.parse_extrapolation(trajectory, parameters['extrapolate'])
+
+        # Energies, JSON outputs, QMC=Chem blocks and wavefunction node from a single pass over the tarball
+        json_output = JsonCollector()
+        collectors = [json_output]
+        if run_type == 'qmcchem':
+            blocks = BlockCollector()
+            collectors.append(blocks)
+
+        with open_wavefunction(out_folder, output_wf_filename, retrieved_temporary_folder) as source:
+            energies, wf_file = scan_wavefunction(source, run_type, output_wf_filename, store_wavefunction,
+                                                  collectors=collectors, profile=self.profile)
+
+        if run_type == 'qmcchem' and blocks.values:
+            self.out('output_blocks', blocks.to_array_data())
+
+        if wf_file is not None:
+            if 'wavefunction' in self.node.inputs:
+                set_head(self.node.inputs.wavefunction, wf_file)
             self.out('output_wavefunction', wf_file)
 
-    def _json_reader(self, out_folder):
-        # List aiida.wf/json/
-        json_files = out_folder.list_object_names()
+        if json_output.parameters:
+            self.out('output_json_parameters', Dict(dict=json_output.parameters))
+        if json_output.columns:
+            self.out('output_json_arrays', json_output.to_array_data())
+
+        if energies:
+            self.out('output_energy', Float(energies['energy'][0]))
+            self.out('output_energies', Dict(dict=energies))
+        elif run_type != 'qmcchem':
+            energy = json_output.get_energy()
+            if energy is not None:
+                self.out('output_energy', Float(energy))
+            else:
+                self.logger.warning(f'No energy found for run type {run_type}')
+
+    def parse_extrapolation(self, trajectory, n_points):
+        """
+        Attach the energy of the ground state extrapolated to PT2 = 0.
+
+        :param trajectory: `ArrayData` built by `build_trajectory`
+        :param n_points: number of last iterations in the fit (`True` for the default)
+        """
+        n_points = 4 if n_points is True else int(n_points)
+        try:
+            energy, error = extrapolate_trajectory(trajectory, n_points=n_points)
+        except ValueError as exc:
+            self.logger.warning(f'No extrapolation: {exc}')
+            return
+
+        self.out('output_energy_extrapolated', Float(energy))
+        if math.isfinite(error):
+            self.out('output_energy_extrapolated_error', Float(error))
@@ -10,8 +10,17 @@ from aiida.engine import ExitCode
 from aiida.parsers.parser import Parser
 from aiida.plugins import CalculationFactory
 from aiida.common import exceptions
-from aiida.orm import Float, SinglefileData
-import json
+from aiida.orm import Dict, Float
+
+from aiida_qp2.utils.ezfio_archive import has_wavefunction, open_wavefunction, scan_wavefunction
+from aiida_qp2.utils.json_output import JsonCollector
+from aiida_qp2.utils.output_parser import parse_output
+from aiida_qp2.utils.qmcchem import BlockCollector
+from aiida_qp2.utils.profiling import profile_parse
+from aiida_qp2.utils.project import set_head
+from aiida_qp2.utils.timings import attach_timings
+
+from .parser import parse_checkpoint, parse_qmcchem, read_exit_status
 
 QP2RunCalculation = CalculationFactory('qp2.run')
 
@@ -38,6 +47,7 @@ class QP2QmcchemRunParser(Parser):
         if not issubclass(node.process_class, QP2RunCalculation):
             raise exceptions.ParsingError('Can only parse QP2RunCalculation')
 
+    @profile_parse
     def parse(self, **kwargs):  # pylint: disable=too-many-locals
         """
         Parse outputs, store results in database.
@@ -48,6 +58,7 @@ class QP2QmcchemRunParser(Parser):
         output_wf_basename = self.node.get_option('output_wf_basename')
         output_wf_filename = output_wf_basename + '.tar.gz'
         store_wavefunction = self.node.get_option('store_wavefunction')
+        retrieved_temporary_folder = kwargs.get('retrieved_temporary_folder')
 
         run_type = self.node.inputs.parameters.get_dict().get('run_type')
 
@@ -56,38 +67,62 @@ class QP2QmcchemRunParser(Parser):
         except exceptions.NotExistent:
             return self.exit_codes.ERROR_NO_RETRIEVED_FOLDER
 
+        attach_timings(self)
+
+        # The job was stopped by the scheduler and packed a partial wavefunction
+        if QP2RunCalculation._CHECKPOINT_FILE in out_folder.list_object_names():
+            return parse_checkpoint(self, retrieved_temporary_folder)
+
+        exit_status = read_exit_status(self)
+        if exit_status:
+            self.logger.error(f'The run exited with status {exit_status}')
+            return ExitCode(350 + exit_status)
+
         files_retrieved = self.retrieved.list_object_names()
         files_expected = [output_filename, output_wf_filename]
 
-        if not set(files_expected) <= set(files_retrieved):
+        if output_filename not in files_retrieved or not has_wavefunction(out_folder, output_wf_filename,
+                                                                          retrieved_temporary_folder):
             self.logger.error("Found files '{}', expected to find '{}'".format(
                 files_retrieved, files_expected))
             return self.exit_codes.ERROR_MISSING_OUTPUT_FILES
 
-        import tarfile
+        # Properties of QMC=Chem, `E_loc` giving the energy
+        if run_type == 'qmcchem':
+            with self.profile.phase('output_scan'), out_folder.open(output_filename, 'rb') as handle:
+                parse_qmcchem(self, parse_output(handle, run_type))
+
+        # Energy, JSON outputs, QMC=Chem blocks and wavefunction node in a single pass over the tarball
         method = _DICTIONARES.get(run_type, None)
+        json_output = JsonCollector()
+        collectors = [json_output]
+        if run_type == 'qmcchem':
+            blocks = BlockCollector()
+            collectors.append(blocks)
+
+        with open_wavefunction(out_folder, output_wf_filename, retrieved_temporary_folder) as source:
+            energies, wf_file = scan_wavefunction(source, run_type if method else None, output_wf_filename,
+                                                  store_wavefunction, collectors=collectors,
+                                                  profile=self.profile)
+
+        if run_type == 'qmcchem' and blocks.values:
+            self.out('output_blocks', blocks.to_array_data())
+
+        if json_output.parameters:
+            self.out('output_json_parameters', Dict(dict=json_output.parameters))
+        if json_output.columns:
+            self.out('output_json_arrays', json_output.to_array_data())
+
         if method:
-            path_energy = f'aiida.ezfio/{method}/energy'
-            with out_folder.open(output_wf_filename, 'rb') as wf_out:
-                with tarfile.open(fileobj=wf_out, mode='r') as tar:
-                    f_out = tar.extractfile(path_energy)
-                    if f_out is None:
-                        raise exceptions.ParsingError(
-                            f'File {path_energy} not found in wavefunction file'
-                        )
-                    from aiida.orm import Float
-                    self.out('utput_energy', Float(-1.0 * float(f_out.read())))
-        else:
-            energy = self._json_reader(out_folder)
-
-        if store_wavefunction:
-            # Store the wavefunction file
-            with out_folder.open(output_wf_filename, 'rb') as handle:
-                wf_file = SinglefileData(file=handle)
-
-            wf_file.base.attributes.set('wavefunction', True)
+            self.out('output_energy', Float(-1.0 * energies['energy'][0]))
+        elif 'output_energy' not in self.outputs:
+            energy = json_output.get_energy()
+            if energy is not None:
+                self.out('output_energy', Float(energy))
+            else:
+                self.logger.warning(f'No energy found for run type {run_type}')
+
+        if wf_file is not None:
+            if 'wavefunction' in self.node.inputs:
+                set_head(self.node.inputs.wavefunction, wf_file)
             self.out('output_wavefunction', wf_file)
-
-    def _json_reader(self, out_folder):
-        # List aiida.wf/json/
-        json_files = out_folder.list_object_names()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+CIPSI convergence trajectory and extrapolation to the FCI limit
+"""
+
+import numpy as np
+
+from aiida.engine import calcfunction
+from aiida.orm import ArrayData, Float
+
+# Per-state quantities of the CIPSI iterations stored in the trajectory
+TRAJECTORY_KEYS = ('energy', 'energy_pt2', 'energy_rpt2', 'pt2', 'rpt2', 'variance')
+
+
+def build_trajectory(iterations):
+    """
+    Build the `ArrayData` of the CIPSI trajectory.
+
+    The array `n_det` has the shape (n_iterations,) and the per-state
+    quantities (n_iterations, n_states); missing values are NaN.
+
+    :param iterations: the `iterations` list returned by `parse_output`
+    :returns: `ArrayData` or None if there is no iteration
+    """
+    if not iterations:
+        return None
+
+    n_states = max(len(it.get(key, [])) for it in iterations for key in TRAJECTORY_KEYS)
+
+    trajectory = ArrayData()
+    trajectory.set_array('n_det', np.array([it['n_det'] for it in iterations], dtype=np.int64))
+
+    for key in TRAJECTORY_KEYS:
+        if not any(key in it for it in iterations):
+            continue
+        column = np.full((len(iterations), n_states), np.nan)
+        for i, it in enumerate(iterations):
+            values = it.get(key, [])
+            column[i, :len(values)] = values
+        trajectory.set_array(key, column)
+
+    return trajectory
+
+
+def extrapolate_energy(energy, pt2, n_points=4):
+    """
+    Linear fit of E as a function of the PT2 correction, extrapolated to PT2 = 0.
+
+    :param energy: variational energies of the CIPSI iterations
+    :param pt2: PT2 (or rPT2) corrections of the same iterations
+    :param n_points: number of last iterations used in the fit
+    :returns: (extrapolated energy, standard error of the intercept); the error is NaN
+        when there are less than three points
+    """
+    energy = np.asarray(energy, dtype=float)
+    pt2 = np.asarray(pt2, dtype=float)
+
+    mask = np.isfinite(energy) & np.isfinite(pt2)
+    energy, pt2 = energy[mask][-n_points:], pt2[mask][-n_points:]
+    n = energy.size
+    if n < 2:
+        raise ValueError('At least two iterations are needed for the extrapolation')
+
+    slope, intercept = np.polyfit(pt2, energy, 1)
+    if n < 3:
+        return float(intercept), float('nan')
+
+    residuals = energy - (slope * pt2 + intercept)
+    sigma2 = residuals @ residuals / (n - 2)
+    s_xx = np.sum((pt2 - pt2.mean())**2)
+    error = np.sqrt(sigma2 * np.sum(pt2**2) / (n * s_xx))
+
+    return float(intercept), float(error)
+
+
+def extrapolate_trajectory(trajectory, state=0, n_points=4):
+    """
+    Extrapolate the energy of `state` from a trajectory built by `build_trajectory`.
+
+    rPT2 is used when it is available, PT2 otherwise.
+
+    :raises ValueError: if the energy or the PT2 are missing, or `state` is not in the trajectory
+    """
+    names = trajectory.get_arraynames()
+    correction = 'rpt2' if 'rpt2' in names else 'pt2'
+    if 'energy' not in names or correction not in names:
+        raise ValueError('The trajectory has no energy and PT2 to extrapolate')
+    n_states = trajectory.get_shape('energy')[1]
+    if not 0 <= state < n_states:
+        raise ValueError(f'No state {state} in the trajectory ({n_states} states)')
+    return extrapolate_energy(trajectory.get_array('energy')[:, state],
+                              trajectory.get_array(correction)[:, state], n_points)
+
+
+@calcfunction
+def extrapolate_fci(trajectory, state=None, n_points=None):
+    """
+    Extrapolate the CIPSI trajectory of a run to the FCI limit
+    """
+    energy, error = extrapolate_trajectory(trajectory,
+                                           state.value if state is not None else 0,
+                                           n_points.value if n_points is not None else 4)
+    results = {'energy': Float(energy)}
+    if np.isfinite(error):
+        results['energy_error'] = Float(error)
+    return results
@@ -148,6 +148,9 @@ class ezfio_obj(object):
             file = open(path + '/.version', 'r')
             v = file.readline().strip()
             file.close()
+            # Not in the generated module, which returns None here: set_file would
+            # then rewrite ezfio/creation every time an existing file is opened
+            return True
         else:
             return False
 
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Single streaming pass over a packed EZFIO file (`<output_wf_basename>.tar.gz`).
+
+The archive is read once: the energy-related members listed in
+`EZFIO_ENERGIES` are decoded as the tar stream goes by, while the same bytes
+are hashed (and, for a handle rather than a file on disk, spooled to the
+file from which the wavefunction node is created).
+"""
+
+import gzip
+import hashlib
+import os
+import tarfile
+import tempfile
+from contextlib import ExitStack, contextmanager
+
+from aiida.common import exceptions
+from aiida.orm import SinglefileData
+
+from aiida_qp2.utils.profiling import get_phase
+
+# Energy-related EZFIO members for each run type: (group, {key: attribute}).
+# `energy` is required, the other members are collected when present.
+# Scalars are stored as `<group>/<attribute>`, per-state arrays as `<group>/<attribute>.gz`.
+EZFIO_ENERGIES = {
+    'scf': ('hartree_fock', {
+        'energy': 'energy',
+    }),
+    'ccsd': ('ccsd', {
+        'energy': 'energy',
+        'energy_ccsd': 'energy_ccsd',
+        'energy_t': 'energy_t',
+    }),
+    'cisd': ('cisd', {
+        'energy': 'energy',
+        'energy_pt2': 'energy_pt2',
+    }),
+    'fci': ('fci', {
+        'energy': 'energy',
+        'energy_pt2': 'energy_pt2',
+        'pt2': 'pt2',
+        'variance': 'variance',
+    }),
+}
+
+_CHUNK_SIZE = 1024**2
+
+
+class _TeeReader:
+    """Binary reader hashing (and optionally copying to `sink`) everything read from `handle`"""
+    def __init__(self, handle, sink=None):
+        self._handle = handle
+        self._sink = sink
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._handle.read(size)
+        self.sha256.update(data)
+        if self._sink is not None:
+            self._sink.write(data)
+        return data
+
+    def drain(self):
+        """Read what the tar reader left (end-of-archive padding)"""
+        while self.read(_CHUNK_SIZE):
+            pass
+
+
+def _decode_member(name, content):
+    """Return the values of an EZFIO member as a list (one value per state)"""
+    if name.endswith('.gz'):
+        # rank, dimensions, then one value per line
+        return [float(value) for value in gzip.decompress(content).split()[2:]]
+    return [float(content)]
+
+
+def _temporary_path(filename, retrieved_temporary_folder):
+    if retrieved_temporary_folder is None:
+        return None
+    path = os.path.join(retrieved_temporary_folder, filename)
+    return path if os.path.isfile(path) else None
+
+
+def has_wavefunction(retrieved, filename, retrieved_temporary_folder=None):
+    """Return True if the packed EZFIO file `filename` was retrieved (see `open_wavefunction`)"""
+    if _temporary_path(filename, retrieved_temporary_folder) is not None:
+        return True
+    dirname, basename = os.path.split(filename)
+    try:
+        return basename in retrieved.list_object_names(dirname or None)
+    except FileNotFoundError:
+        return False
+
+
+@contextmanager
+def open_wavefunction(retrieved, filename, retrieved_temporary_folder=None):
+    """
+    Yield the source of the packed EZFIO file `filename` for `scan_wavefunction`.
+
+    The output wavefunctions are in the `retrieve_temporary_list`, so that the node is
+    created from the retrieved file itself instead of a copy kept in `retrieved`: the path
+    in the retrieved temporary folder is yielded. Calculations submitted before still have
+    the file in `retrieved`, a binary handle is then yielded.
+    """
+    path = _temporary_path(filename, retrieved_temporary_folder)
+    if path is not None:
+        yield path
+        return
+
+    with retrieved.open(filename, 'rb') as handle:
+        yield handle
+
+
+def scan_wavefunction(source, run_type, filename=None, store=True, collectors=(), profile=None):
+    """
+    Collect the energies of `run_type` and build the wavefunction node in one pass.
+
+    :param source: path of the wavefunction tarball on the local disk (e.g. in the retrieved
+        temporary folder: the node is then created from the file itself), or a binary handle
+        (its content is spooled to a temporary file while it is scanned)
+    :param run_type: the `run_type` of the calculation (no energy is read if it is not in `EZFIO_ENERGIES`)
+    :param filename: filename of the `SinglefileData`
+    :param store: if False, no `SinglefileData` is created
+    :param collectors: callables returning, for the name of any other member, a function
+        consuming its (binary, not seekable) file object, or None to skip the member
+    :param profile: `ParseProfile` timing the `tar_read` and `wavefunction_store` phases
+    :returns: (dictionary of lists of values, `SinglefileData` or None); the node has
+        the `wavefunction` and `sha256` attributes
+    """
+    group, attributes = EZFIO_ENERGIES.get(run_type, (None, {}))
+    members = {}
+    for key, attribute in attributes.items():
+        members[f'aiida.ezfio/{group}/{attribute}'] = key
+        members[f'aiida.ezfio/{group}/{attribute}.gz'] = key
+
+    is_path = isinstance(source, (str, os.PathLike))
+    spool = store and not is_path
+
+    energies = {}
+    with ExitStack() as stack:
+        handle = stack.enter_context(open(source, 'rb')) if is_path else source
+        sink = stack.enter_context(tempfile.TemporaryFile()) if spool else None
+        reader = _TeeReader(handle, sink)
+
+        with get_phase(profile, 'tar_read'), tarfile.open(fileobj=reader, mode='r|*') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                key = members.get(member.name)
+                if key is not None:
+                    energies[key] = _decode_member(member.name, tar.extractfile(member).read())
+                else:
+                    for collector in collectors:
+                        consumer = collector(member.name)
+                        if consumer is not None:
+                            consumer(tar.extractfile(member))
+                            break
+            reader.drain()
+
+        if group and 'energy' not in energies:
+            raise exceptions.ParsingError(f'File aiida.ezfio/{group}/energy not found in wavefunction file')
+
+        wf_file = None
+        if store:
+            with get_phase(profile, 'wavefunction_store'):
+                if spool:
+                    sink.seek(0)
+                wf_file = SinglefileData(file=source if is_path else sink, filename=filename)
+                wf_file.base.attributes.set('wavefunction', True)
+                wf_file.base.attributes.set('sha256', reader.sha256.hexdigest())
+
+    return energies, wf_file
@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent extraction of the packed EZFIO files, for the edits of wavefunctions.
+
+A workspace is the content of the tarball of a wavefunction, extracted once
+in the cache directory (`$AIIDA_QP2_WORKSPACES`, by default
+`~/.cache/aiida-qp2/workspaces/<uuid>`) and reused by the next edits. Its
+manifest records the size, mtime and SHA-256 of every member: the members
+modified since (dirty) are found from their stat, and confirmed with the
+hash (EZFIO rewrites the `.version` files whenever it is used).
+
+The archives are packed as a single gzip stream in which every member is
+compressed independently and ends on a full flush (as `pigz --independent`
+does), so its compressed bytes do not depend on the other members. The
+manifest records where they are: packing again only compresses the dirty
+members and copies the others from the previous archive. The positions of
+the members are kept in the `pack_index` attribute of the wavefunctions
+packed this way. The result is a standard `.tar.gz`.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tarfile
+import zlib
+
+WORKSPACES_ENV = 'AIIDA_QP2_WORKSPACES'
+MANIFEST_FILE = '.aqp_workspace.json'
+EZFIO_NAME = 'aiida.ezfio'
+# Attribute of the wavefunctions with the positions of their members (see `pack_index`)
+PACK_INDEX_ATTRIBUTE = 'pack_index'
+
+# Workspaces kept in the cache (the least recently used ones are removed)
+KEEP_WORKSPACES = 5
+
+_CHUNK_SIZE = 1024**2
+_BLOCK_SIZE = tarfile.BLOCKSIZE
+_COMPRESS_LEVEL = 6
+# gzip header: deflate, no flags, no mtime, unknown OS
+_GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+def _crc32_operators():
+    """Matrices (GF(2)) appending 2**k zero bytes to a CRC-32, k = 0..63 (see `crc32_combine` in zlib)"""
+    def times(matrix, vector):
+        result, i = 0, 0
+        while vector:
+            if vector & 1:
+                result ^= matrix[i]
+            vector >>= 1
+            i += 1
+        return result
+
+    def square(matrix):
+        return [times(matrix, row) for row in matrix]
+
+    # One zero bit, then 2, 4 and 8 bits
+    operator = [0xedb88320] + [1 << n for n in range(31)]
+    for _ in range(3):
+        operator = square(operator)
+    operators = []
+    for _ in range(64):
+        operators.append(operator)
+        operator = square(operator)
+    return times, operators
+
+
+_CRC_TIMES, _CRC_OPERATORS = _crc32_operators()
+
+
+def crc32_combine(crc1, crc2, length2):
+    """Return the CRC-32 of the concatenation of two blocks from their CRC-32 and the length of the second"""
+    k = 0
+    while length2:
+        if length2 & 1:
+            crc1 = _CRC_TIMES(_CRC_OPERATORS[k], crc1)
+        length2 >>= 1
+        k += 1
+    return crc1 ^ crc2
+
+
+def workspaces_root():
+    """Return the directory of the workspaces"""
+    if os.environ.get(WORKSPACES_ENV):
+        return os.environ[WORKSPACES_ENV]
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'aiida-qp2', 'workspaces')
+
+
+def attribute_name(member):
+    """Return the EZFIO attribute (`group_attribute`) stored in a member, or None"""
+    parts = member.split('/')
+    if len(parts) != 3 or parts[-1].startswith('.'):
+        return None
+    name = parts[-1][:-3] if parts[-1].endswith('.gz') else parts[-1]
+    return f'{parts[1]}_{name}'
+
+
+def pack_index(index):
+    """Return the positions of the members in the archive from the manifest entries returned by `Workspace.pack`"""
+    return {name: {key: entry[key] for key in ('offset', 'length', 'crc', 'usize')} for name, entry in index.items()}
+
+
+def _hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _is_safe(name):
+    return not os.path.isabs(name) and '..' not in name.split('/')
+
+
+class Workspace():
+    """
+    Cached extraction of a wavefunction
+
+    :param path: directory of the workspace
+    """
+    def __init__(self, path):
+        self.path = path
+        self.manifest = {'source': None, 'members': {}}
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as handle:
+                self.manifest = json.load(handle)
+
+    @classmethod
+    def open(cls, wavefunction, reset=False):
+        """
+        Return the workspace of a wavefunction, extracted if it is not in the cache.
+
+        :param wavefunction: the `SinglefileData` of the packed EZFIO file
+        :param reset: extract again, dropping the changes not saved
+        """
+        workspace = cls(os.path.join(workspaces_root(), wavefunction.uuid))
+        if reset or workspace.manifest['source'] != wavefunction.uuid:
+            with wavefunction.open(mode='rb') as handle:
+                workspace.extract(handle, wavefunction.uuid)
+        workspace.touch()
+        prune_workspaces(keep=KEEP_WORKSPACES, current=workspace.path)
+        return workspace
+
+    @property
+    def ezfio_path(self):
+        return os.path.join(self.path, EZFIO_NAME)
+
+    def touch(self):
+        """Mark the workspace as used (for the pruning of the cache)"""
+        self.save_manifest()
+
+    def save_manifest(self):
+        path = os.path.join(self.path, MANIFEST_FILE)
+        with open(path + '.part', 'w') as handle:
+            json.dump(self.manifest, handle)
+        os.replace(path + '.part', path)
+
+    def _full_path(self, name):
+        return os.path.join(self.path, *name.split('/'))
+
+    def _extract_member(self, tar, member):
+        """Extract a member of the source archive, return its manifest entry"""
+        path = self._full_path(member.name)
+        if member.isdir():
+            os.makedirs(path, exist_ok=True)
+            return {'dir': True}
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        sha256 = hashlib.sha256()
+        with tar.extractfile(member) as source, open(path, 'wb') as handle:
+            for chunk in iter(lambda: source.read(_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+                handle.write(chunk)
+        return {'sha256': sha256.hexdigest(), **_stat(path)}
+
+    def extract(self, handle, source_uuid):
+        """Extract the archive of `handle` (binary) in the workspace, in place of its content"""
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+
+        members = {}
+        try:
+            with tarfile.open(fileobj=handle, mode='r:*') as tar:
+                for member in tar:
+                    if (member.isdir() or member.isfile()) and _is_safe(member.name):
+                        members[member.name] = self._extract_member(tar, member)
+        except BaseException:
+            # No manifest: extracted again by the next `open`
+            shutil.rmtree(self.path, ignore_errors=True)
+            raise
+
+        self.manifest = {'source': source_uuid, 'members': members}
+        self.save_manifest()
+
+    def restore(self, names, handle):
+        """Restore the files `names` from the source archive (binary `handle`); the new ones are removed"""
+        names = set(names)
+        members = self.manifest['members']
+        for name in names - set(members):
+            path = self._full_path(name)
+            if os.path.isfile(path):
+                os.remove(path)
+
+        with tarfile.open(fileobj=handle, mode='r:*') as tar:
+            for member in tar:
+                if member.name in names and member.name in members:
+                    entry = self._extract_member(tar, member)
+                    # The position in the source archive is unchanged
+                    members[member.name].update(entry)
+        self.save_manifest()
+
+    def _walk(self):
+        """Return the members of the workspace on disk, the directories before their content"""
+        names = []
+        for root, dirnames, filenames in os.walk(self.path):
+            dirnames.sort()
+            relative = os.path.relpath(root, self.path)
+            prefix = '' if relative == '.' else relative.replace(os.sep, '/') + '/'
+            if prefix:
+                names.append(prefix[:-1])
+            names.extend(prefix + filename for filename in sorted(filenames)
+                         if prefix or filename not in (MANIFEST_FILE, MANIFEST_FILE + '.part'))
+        return names
+
+    def dirty(self):
+        """
+        Return the files changed since the extraction or the last pack (the directories follow their files).
+
+        :returns: (list of the files modified or new, list of the files deleted)
+        """
+        members = self.manifest['members']
+        on_disk = [name for name in self._walk() if not os.path.isdir(self._full_path(name))]
+        changed = []
+        refreshed = False
+        for name in on_disk:
+            entry = members.get(name)
+            path = self._full_path(name)
+            if entry is None or entry.get('dir'):
+                changed.append(name)
+            elif _stat(path) != {'size': entry['size'], 'mtime_ns': entry['mtime_ns']}:
+                if _hash_file(path) != entry['sha256']:
+                    changed.append(name)
+                else:
+                    # Rewritten with the same content: no need to hash it again
+                    entry.update(_stat(path))
+                    refreshed = True
+        if refreshed:
+            self.save_manifest()
+
+        files = {name for name, entry in members.items() if not entry.get('dir')}
+        deleted = sorted(files - set(on_disk))
+        return changed, deleted
+
+    def _compress_member(self, name):
+        """Compress a member of the workspace, return (compressed bytes, manifest entry)"""
+        path = self._full_path(name)
+        stat = os.stat(path)
+        info = tarfile.TarInfo(name)
+        info.mtime = int(stat.st_mtime)
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if os.path.isdir(path):
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            entry = {'dir': True}
+        else:
+            info.mode = 0o644
+            info.size = stat.st_size
+
+        compressor = zlib.compressobj(_COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        header = info.tobuf(tarfile.GNU_FORMAT, 'utf-8', 'surrogateescape')
+        chunks = [compressor.compress(header)]
+        crc = zlib.crc32(header)
+        size = len(header)
+        if not info.isdir():
+            sha256 = hashlib.sha256()
+            with open(path, 'rb') as handle:
+                for chunk in iter(lambda: handle.read(_CHUNK_SIZE), b''):
+                    sha256.update(chunk)
+                    crc = zlib.crc32(chunk, crc)
+                    size += len(chunk)
+                    chunks.append(compressor.compress(chunk))
+            padding = b'\0' * (-size % _BLOCK_SIZE)
+            crc = zlib.crc32(padding, crc)
+            size += len(padding)
+            chunks.append(compressor.compress(padding))
+            entry['sha256'] = sha256.hexdigest()
+        chunks.append(compressor.flush(zlib.Z_FULL_FLUSH))
+
+        entry.update({'crc': crc, 'usize': size})
+        return b''.join(chunks), entry
+
+    def pack(self, output, source=None):
+        """
+        Pack the workspace into the binary handle `output`.
+
+        :param source: binary handle on the archive the workspace was extracted from (or
+            packed to): the unchanged members packed before are copied from it
+        :returns: (new manifest entries of the members, SHA-256 of the archive, number of members compressed)
+        """
+        changed, _ = self.dirty()
+        changed = set(changed)
+        members = self.manifest['members']
+        sha256 = hashlib.sha256()
+
+        def write(data):
+            output.write(data)
+            sha256.update(data)
+
+        write(_GZIP_HEADER)
+        offset = len(_GZIP_HEADER)
+        crc = size = 0
+        index = {}
+        compressed = 0
+        for name in self._walk():
+            entry = members.get(name)
+            if source is not None and entry is not None and 'offset' in entry and name not in changed:
+                source.seek(entry['offset'])
+                data = source.read(entry['length'])
+                entry = dict(entry)
+            else:
+                data, entry = self._compress_member(name)
+                compressed += 1
+            entry.update({'offset': offset, 'length': len(data)})
+            write(data)
+            offset += len(data)
+            crc = crc32_combine(crc, entry['crc'], entry['usize'])
+            size += entry['usize']
+            index[name] = entry
+
+        # End of the tar archive
+        compressor = zlib.compressobj(_COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        end = b'\0' * (2 * _BLOCK_SIZE)
+        write(compressor.compress(end) + compressor.flush(zlib.Z_FINISH))
+        crc = zlib.crc32(end, crc)
+        size += len(end)
+        write(struct.pack('<II', crc, size & 0xffffffff))
+        return index, sha256.hexdigest(), compressed
+
+    def commit(self, uuid, index):
+        """Make the workspace the one of the wavefunction `uuid`, packed with the manifest entries `index`"""
+        path = os.path.join(workspaces_root(), uuid)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(self.path, path)
+        self.path = path
+        self.manifest = {'source': uuid, 'members': index}
+        self.save_manifest()
+
+    def locate(self, positions):
+        """Record the positions of the members in the source archive (see `pack_index`), for `pack`"""
+        members = self.manifest['members']
+        for name, position in positions.items():
+            if name in members:
+                members[name].update(position)
+        self.save_manifest()
+
+    def adopt(self, wavefunction):
+        """
+        Make the workspace the one of `wavefunction`, packed from its changes by `wavefunction_editor`.
+
+        The workspace is removed instead (it is extracted again by the next
+        `open`) if its members are not the ones of the wavefunction.
+        """
+        names = self._walk()
+        if set(names) != set(wavefunction.base.attributes.get(PACK_INDEX_ATTRIBUTE, {})):
+            shutil.rmtree(self.path, ignore_errors=True)
+            return False
+
+        changed, _ = self.dirty()
+        changed = set(changed)
+        members = self.manifest['members']
+        index = {}
+        for name in names:
+            path = self._full_path(name)
+            if os.path.isdir(path):
+                index[name] = {'dir': True}
+            elif name in changed:
+                index[name] = {'sha256': _hash_file(path), **_stat(path)}
+            else:
+                index[name] = {key: members[name][key] for key in ('sha256', 'size', 'mtime_ns')}
+        self.commit(wavefunction.uuid, index)
+        return True
+
+    def changes_folder(self, changed, deleted):
+        """Return an (unstored) `FolderData` with the members changed, the deleted ones in the `deleted` attribute"""
+        from aiida.orm import FolderData
+
+        folder = FolderData()
+        for name in changed:
+            path = self._full_path(name)
+            if os.path.isfile(path):
+                folder.base.repository.put_object_from_file(path, name)
+        folder.base.attributes.set('deleted', list(deleted))
+        return folder
+
+    def apply(self, changes):
+        """Write the members of a `FolderData` made by `changes_folder` in the workspace"""
+        repository = changes.base.repository
+        for root, _, filenames in repository.walk():
+            for filename in filenames:
+                name = str(root / filename)
+                if not _is_safe(name):
+                    continue
+                path = self._full_path(name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with repository.open(name, mode='rb') as source, open(path + '.part', 'wb') as handle:
+                    shutil.copyfileobj(source, handle, _CHUNK_SIZE)
+                os.replace(path + '.part', path)
+        for name in changes.base.attributes.get('deleted', []):
+            path = self._full_path(name)
+            if _is_safe(name) and os.path.isdir(path):
+                shutil.rmtree(path)
+            elif _is_safe(name) and os.path.exists(path):
+                os.remove(path)
+
+
+def prune_workspaces(keep=KEEP_WORKSPACES, current=None):
+    """Remove the least recently used workspaces beyond `keep` (never `current`)"""
+    root = workspaces_root()
+    if not os.path.isdir(root):
+        return
+    workspaces = []
+    for name in os.listdir(root):
+        manifest = os.path.join(root, name, MANIFEST_FILE)
+        if os.path.exists(manifest):
+            workspaces.append((os.stat(manifest).st_mtime_ns, os.path.join(root, name)))
+    for _, path in sorted(workspaces, reverse=True)[keep:]:
+        if path != current:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming reader of the JSON files written by qp in the `json/` folder of the EZFIO file.
+
+The files are read event by event with `ijson`, so that only the numbers
+are kept (in compact `array('d')` buffers) and never the whole document.
+Every JSON path is mapped to a typed value:
+
+* numbers, strings and booleans outside of any list -> a parameter (`Dict`)
+* numbers inside lists -> an array (`ArrayData`), one row per item of the
+  outermost list, and one column per value inside that item (e.g. per state),
+  missing values being NaN
+
+e.g. `{"fci": [{"n_det": 1, "states": [{"energy": -76.0}, ...]}, ...]}` in `fci.json`
+gives the arrays `fci_n_det` (n_iterations,) and `fci_states_energy` (n_iterations, n_states).
+"""
+
+import os
+from array import array
+
+import ijson
+import numpy as np
+
+from aiida.orm import ArrayData
+
+_ITEM_EVENTS = ('start_map', 'start_array', 'number', 'string', 'boolean', 'null')
+
+
+class _Column:
+    """Numbers of one JSON path, with the row (item of the outermost list) of each of them"""
+    def __init__(self):
+        self.rows = array('l')
+        self.values = array('d')
+
+    def append(self, row, value):
+        self.rows.append(row)
+        self.values.append(value)
+
+    def to_array(self):
+        rows = np.frombuffer(self.rows, dtype=self.rows.typecode)
+        values = np.frombuffer(self.values, dtype=float)
+        n_rows = int(rows[-1]) + 1
+        counts = np.bincount(rows, minlength=n_rows)
+
+        if counts.max() == 1:
+            result = np.full(n_rows, np.nan)
+            result[rows] = values
+            return result
+
+        # Position of each value inside its row
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        columns = np.arange(rows.size) - starts[rows]
+        result = np.full((n_rows, counts.max()), np.nan)
+        result[rows, columns] = values
+        return result
+
+
+class JsonCollector:
+    """
+    Collect the JSON files of the EZFIO file.
+
+    The instance is meant to be passed in the `collectors` of
+    :func:`aiida_qp2.utils.ezfio_archive.scan_wavefunction`.
+    """
+    def __init__(self):
+        self.parameters = {}
+        self.columns = {}
+
+    def __call__(self, name):
+        """Return the consumer of the tar member `name` if it is a JSON output"""
+        if '/json/' in name and name.endswith('.json'):
+            stem = os.path.splitext(os.path.basename(name))[0]
+            return lambda handle: self.add_file(handle, stem)
+        return None
+
+    def add_file(self, handle, stem):
+        """Read the JSON document of `handle`, its paths being prefixed by `stem`"""
+        lists = []  # stack of [prefix, index of the current item]
+
+        for prefix, event, value in ijson.parse(handle, use_float=True):
+            if lists and event in _ITEM_EVENTS and prefix == lists[-1][0] + '.item':
+                lists[-1][1] += 1
+            if event == 'start_array':
+                lists.append([prefix, -1])
+                continue
+            if event == 'end_array':
+                lists.pop()
+                continue
+            if event not in ('number', 'string', 'boolean'):
+                continue
+
+            keys = [key for key in prefix.split('.') if key and key != 'item']
+            if keys[:1] != [stem]:
+                keys.insert(0, stem)
+            name = '_'.join(keys)
+
+            if not lists:
+                self.parameters[name] = value
+            elif event == 'number':
+                self.columns.setdefault(name, _Column()).append(lists[0][1], value)
+
+    def to_array_data(self):
+        """Return the arrays as `ArrayData`, or None if there are none"""
+        if not self.columns:
+            return None
+
+        arrays = ArrayData()
+        for name, column in self.columns.items():
+            arrays.set_array(name, column.to_array())
+        return arrays
+
+    def get_energy(self):
+        """
+        Return the last energy found (first state of the last item of the first
+        `*energy` array, or the first `*energy` parameter), or None
+        """
+        for name, column in self.columns.items():
+            if name.endswith('energy'):
+                values = column.to_array()
+                return float(values[-1] if values.ndim == 1 else values[-1, 0])
+        for name, value in self.parameters.items():
+            if name.endswith('energy') and isinstance(value, float):
+                return value
+        return None
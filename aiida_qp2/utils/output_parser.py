@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Single streaming pass over the standard output of qp (and QMC=Chem).
+
+Every line is offered to the line handlers registered for the run type
+(plus the common ones). A handler is selected by a cheap substring test
+before any regular expression is applied, and only the summary values and
+the (short) list of CIPSI iterations are kept, so the memory does not grow
+with the size of the output.
+
+New handlers are registered with::
+
+    @register_line_handler('fci', 'N_int')
+    def _n_int(result, line):
+        result['n_int'] = int(line.split()[-1])
+"""
+
+import io
+import re
+
+from aiida_qp2.utils.qmcchem import parse_property_line
+
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[EeDd][-+]?\d+)?'
+
+# Table of line handlers: run type -> list of (trigger, handler)
+_LINE_HANDLERS = {}
+
+# Handlers applied to every run type
+COMMON = 'common'
+
+# CIPSI-like run types printing the iteration summary
+_CIPSI_RUN_TYPES = ('fci', 'cisd', 'cis', 'cisdtq', 'pt2')
+
+# Run types whose results are all in the final summary, with the key it has to give
+SUMMARY_KEYS = {
+    'scf': 'energy',
+    'ccsd': 'energies',
+    'qmcchem': 'properties',
+}
+
+# Bytes read from the end of the output for the run types of `SUMMARY_KEYS`
+TAIL_SIZE = 1024**2
+
+# First lines of the final summary of each run type (see `aqp dump output --section summary`)
+SUMMARY_PATTERNS = {
+    **{run_type: r'^\s*N_det\s*=' for run_type in _CIPSI_RUN_TYPES},
+    'scf': r'SCF energy',
+    'ccsd': r'^\s*E\([\w()]+\)',
+    'qmcchem': r'^\s*\S+\s*:.*\+/-',
+}
+
+
+def _to_float(value):
+    return float(value.replace('D', 'E').replace('d', 'e'))
+
+
+def register_line_handler(run_types, trigger):
+    """
+    Decorator registering `handler(result, line)` for the lines containing `trigger`.
+
+    :param run_types: run type or tuple of run types (`COMMON` for all of them)
+    :param trigger: substring a line has to contain to be passed to the handler
+    """
+    if isinstance(run_types, str):
+        run_types = (run_types, )
+
+    def decorator(handler):
+        for run_type in run_types:
+            _LINE_HANDLERS.setdefault(run_type, []).append((trigger, handler))
+        return handler
+
+    return decorator
+
+
+def get_line_handlers(run_type):
+    """Return the list of (trigger, handler) applied to the output of `run_type`"""
+    return _LINE_HANDLERS.get(COMMON, []) + _LINE_HANDLERS.get(run_type, [])
+
+
+def _scan(lines, handlers):
+    result = {}
+    for line in lines:
+        for trigger, handler in handlers:
+            if trigger in line:
+                handler(result, line)
+    return result
+
+
+def iter_lines(handle, chunk_size=1024**2):
+    """Iterate over the decoded lines of a binary handle, which only needs `read`"""
+    rest = b''
+    while True:
+        chunk = handle.read(chunk_size)
+        if not chunk:
+            break
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line.decode(errors='replace')
+    if rest:
+        yield rest.decode(errors='replace')
+
+
+def parse_output(handle, run_type, tail_size=TAIL_SIZE):
+    """
+    Parse the output of a qp run in a single pass.
+
+    For the run types of `SUMMARY_KEYS`, given a seekable binary handle, only the
+    last `tail_size` bytes are read; the whole output is read if the summary is
+    not found in them.
+
+    :param handle: binary or text handle (or any iterable of lines) of the output file
+    :param run_type: the `run_type` of the calculation
+    :param tail_size: size of the tail holding the final summary
+    :returns: dictionary with the parsed quantities
+    """
+    handlers = get_line_handlers(run_type)
+
+    if isinstance(handle, io.TextIOBase) or not hasattr(handle, 'read'):
+        return _scan(handle, handlers)
+
+    if run_type in SUMMARY_KEYS and handle.seekable():
+        size = handle.seek(0, io.SEEK_END)
+        if size > tail_size:
+            handle.seek(size - tail_size)
+            # The first line is partial
+            tail = handle.read().decode(errors='replace').split('\n')[1:]
+            result = _scan(tail, handlers)
+            if SUMMARY_KEYS[run_type] in result:
+                return result
+        handle.seek(0)
+
+    return _scan(iter_lines(handle), handlers)
+
+
+# Common handlers
+
+_ERROR_CODE_REGEX = re.compile(r'ERROR CODE: (\d+)')
+
+
+@register_line_handler(COMMON, 'ERROR CODE')
+def _error_code(result, line):
+    match = _ERROR_CODE_REGEX.search(line)
+    if match:
+        result['error_code'] = int(match.group(1))
+
+
+_TIME_REGEX = re.compile(rf'(Wall|CPU) time\s*[:=]?\s*({_NUMBER})', re.IGNORECASE)
+
+
+@register_line_handler(COMMON, ' time')
+def _timings(result, line):
+    match = _TIME_REGEX.search(line)
+    if match:
+        key = f'{match.group(1).lower()}_time'
+        result.setdefault('timings', {})[key] = _to_float(match.group(2))
+
+
+# Hartree-Fock
+
+
+@register_line_handler('scf', 'SCF energy')
+def _scf_energy(result, line):
+    result['energy'] = _to_float(line.split()[-1])
+
+
+# Coupled cluster, e.g. `E(CCSD)     =   -76.2345`
+
+_CC_REGEX = re.compile(rf'^\s*(E\([\w()]+\))\s*=?\s*({_NUMBER})')
+
+
+@register_line_handler('ccsd', 'E(')
+def _cc_energy(result, line):
+    match = _CC_REGEX.match(line)
+    if match:
+        result.setdefault('energies', {})[match.group(1)] = _to_float(match.group(2))
+
+
+# CIPSI summary, printed at each iteration:
+#   N_det             =         1234
+#   ...
+#   E               =   -76.2345
+#   E+PT2           =   -76.3456  +/-  0.0001
+
+_N_DET_REGEX = re.compile(r'^\s*N_det\s*=\s*(\d+)')
+_STATE_REGEX = re.compile(rf'^\s*(E|E\+PT2|E\+rPT2|PT2|rPT2|Variance)\s*=\s*({_NUMBER})(?:\s*\+/-\s*({_NUMBER}))?')
+_STATE_KEYS = {
+    'E': 'energy',
+    'E+PT2': 'energy_pt2',
+    'E+rPT2': 'energy_rpt2',
+    'PT2': 'pt2',
+    'rPT2': 'rpt2',
+    'Variance': 'variance',
+}
+
+
+@register_line_handler(_CIPSI_RUN_TYPES, 'N_det')
+def _cipsi_n_det(result, line):
+    match = _N_DET_REGEX.match(line)
+    if match:
+        result.setdefault('iterations', []).append({'n_det': int(match.group(1))})
+
+
+@register_line_handler(_CIPSI_RUN_TYPES, '=')
+def _cipsi_state(result, line):
+    if not result.get('iterations'):
+        return
+    match = _STATE_REGEX.match(line)
+    if match:
+        iteration = result['iterations'][-1]
+        key = _STATE_KEYS[match.group(1)]
+        iteration.setdefault(key, []).append(_to_float(match.group(2)))
+        if match.group(3) is not None:
+            iteration.setdefault(f'{key}_error', []).append(_to_float(match.group(3)))
+
+
+# QMC=Chem, e.g. `          E_loc :   -1.16390848 +/-    0.00032414 (100)`
+
+
+@register_line_handler('qmcchem', '+/-')
+def _qmcchem_property(result, line):
+    parsed = parse_property_line(line)
+    if parsed:
+        name, value, error, blocks = parsed
+        result.setdefault('properties', {})[name] = {'value': value, 'error': error, 'blocks': blocks}
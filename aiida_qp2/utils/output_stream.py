@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Views of the output of qp and QMC=Chem without reading it whole.
+
+The outputs of long CIPSI or QMC runs can weigh gigabytes. The functions
+below take a binary handle (e.g. on a repository object): `head` and `grep`
+stream the lines, while `tail` and `find_section` read blocks backwards from
+the end of a seekable handle. The memory used only depends on the number of
+lines shown, never on the size of the output.
+"""
+
+import collections
+import io
+import itertools
+import re
+
+from aiida_qp2.utils.output_parser import SUMMARY_PATTERNS, iter_lines
+
+# Bytes read at a time from the end of the output
+BLOCK_SIZE = 64 * 1024
+
+
+def reverse_lines(handle, block_size=BLOCK_SIZE):
+    """
+    Iterate backwards over the lines of a seekable binary handle.
+
+    :returns: generator of `(offset, line)`, `offset` being the position of the line in the handle
+    """
+    end = handle.seek(0, io.SEEK_END)
+    rest = b''
+    while end > 0:
+        start = max(0, end - block_size)
+        handle.seek(start)
+        lines = (handle.read(end - start) + rest).split(b'\n')
+        end = start
+        # The first line may continue in the previous block
+        rest = lines.pop(0) if start > 0 else b''
+        offset = start + len(rest) + 1 if start > 0 else 0
+        offsets = []
+        for line in lines:
+            offsets.append(offset)
+            offset += len(line) + 1
+        for offset, line in zip(reversed(offsets), reversed(lines)):
+            yield offset, line.decode(errors='replace')
+    if rest:
+        yield 0, rest.decode(errors='replace')
+
+
+def _lines_backwards(handle):
+    """Lines from the end, without the empty string after the final newline"""
+    lines = reverse_lines(handle)
+    first = next(lines, None)
+    if first is not None and first[1] != '':
+        yield first
+    yield from lines
+
+
+def head(handle, n):
+    """Return the first `n` lines"""
+    return list(itertools.islice(iter_lines(handle, BLOCK_SIZE), n))
+
+
+def tail(handle, n):
+    """Return the last `n` lines (reading the whole handle only if it is not seekable)"""
+    if not handle.seekable():
+        return list(collections.deque(iter_lines(handle, BLOCK_SIZE), maxlen=n))
+    lines = [line for _, line in itertools.islice(_lines_backwards(handle), n)]
+    return lines[::-1]
+
+
+def grep(lines, pattern):
+    """Return the lines matching the regular expression `pattern`"""
+    regex = re.compile(pattern)
+    return (line for line in lines if regex.search(line))
+
+
+def get_section_pattern(section, run_type):
+    """
+    Return the regular expression of a section.
+
+    :param section: `summary` (the final summary of `run_type`) or a regular expression
+    :param run_type: the `run_type` of the calculation
+    """
+    if section != 'summary':
+        return section
+    if run_type not in SUMMARY_PATTERNS:
+        raise ValueError(f'No summary known for the run type {run_type}, give a regular expression')
+    return SUMMARY_PATTERNS[run_type]
+
+
+def find_section(handle, pattern):
+    """
+    Return the offset of the last section starting with `pattern`, or None.
+
+    The section starts at the first line of the last block of consecutive
+    lines matching `pattern` and runs to the end of the output.
+    """
+    regex = re.compile(pattern)
+    start = None
+    for offset, line in _lines_backwards(handle):
+        if regex.search(line):
+            start = offset
+        elif start is not None:
+            break
+    return start
+
+
+def read_section(handle, pattern):
+    """Iterate over the lines of the last section starting with `pattern` (nothing if not found)"""
+    if handle.seekable():
+        start = find_section(handle, pattern)
+        if start is None:
+            return
+        handle.seek(start)
+        yield from iter_lines(handle, BLOCK_SIZE)
+        return
+
+    # Only the lines since the last match are kept
+    regex = re.compile(pattern)
+    section = None
+    for line in iter_lines(handle, BLOCK_SIZE):
+        if regex.search(line):
+            if section is None or section_ended:
+                section = []
+            section_ended = False
+        elif section is not None:
+            section_ended = True
+        if section is not None:
+            section.append(line)
+    yield from section or []
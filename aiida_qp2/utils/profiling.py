@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Timing and memory instrumentation of the parsers
+
+The parse methods decorated with `profile_parse` record, in the `output_parse_profile`
+output (`Dict`) of the calculation::
+
+    {'phases': {'output_scan': 0.12, 'tar_read': 1.3, 'wavefunction_store': 0.4},
+     'total': 1.9, 'max_rss_increase': 0}
+
+`max_rss_increase` is the increase (in bytes) of the peak resident memory of the
+process during the parse: it is cheap but stays 0 when the parse does not
+exceed the previous peak of the (daemon) process.
+
+Setting the environment variable `AIIDA_QP2_PROFILE_PARSER` to a directory
+also records the peak memory allocated by the parse (`peak_memory`, with
+`tracemalloc`, which slows the parse down) and dumps a `cProfile` file
+`parse_<pk>.prof` in that directory (path in the `cprofile` key).
+
+Slow parses are then found with e.g.::
+
+    QueryBuilder().append(CalcJobNode, tag='calc').append(
+        Dict, with_incoming='calc', edge_filters={'label': 'output_parse_profile'},
+        filters={'attributes.total': {'>': 60}})
+"""
+
+import cProfile
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+from aiida.orm import Dict
+
+PROFILE_ENV_VARIABLE = 'AIIDA_QP2_PROFILE_PARSER'
+PROFILE_OUTPUT = 'output_parse_profile'
+
+
+def _max_rss():
+    """Peak resident memory of the process in bytes"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class ParseProfile:
+    """Per-phase timings of a parse"""
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        """Time the block, accumulated in `phases[name]`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.) + time.perf_counter() - start
+
+
+def get_phase(profile, name):
+    """Return `profile.phase(name)`, or a no-op context manager if `profile` is None"""
+    return profile.phase(name) if profile is not None else nullcontext()
+
+
+def profile_parse(parse):
+    """
+    Decorator of `Parser.parse` recording its profile in the `output_parse_profile` output.
+
+    The `ParseProfile` is available as `self.profile` in the decorated method.
+    """
+    @wraps(parse)
+    def wrapper(self, **kwargs):
+        self.profile = ParseProfile()
+        directory = os.environ.get(PROFILE_ENV_VARIABLE)
+        profiler = cProfile.Profile() if directory else None
+        tracing = directory and not tracemalloc.is_tracing()
+
+        if tracing:
+            tracemalloc.start()
+        if profiler is not None:
+            profiler.enable()
+        max_rss, start = _max_rss(), time.perf_counter()
+
+        try:
+            return parse(self, **kwargs)
+        finally:
+            results = {
+                'phases': self.profile.phases,
+                'total': time.perf_counter() - start,
+                'max_rss_increase': _max_rss() - max_rss,
+            }
+            if profiler is not None:
+                profiler.disable()
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(os.path.abspath(directory), f'parse_{self.node.pk}.prof')
+                profiler.dump_stats(path)
+                results['cprofile'] = path
+            if tracing:
+                results['peak_memory'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+            self.out(PROFILE_OUTPUT, Dict(results))
+
+    return wrapper
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Cached pointers of the qp2 projects
+
+A project is the wavefunction created by `aqp create`, with the `name` and
+`default_code` (pk) extras. To resolve the defaults of the commands without
+walking the provenance graph, the extras also hold:
+
+* `project` on every wavefunction computed from a project: the pk of the
+  project, propagated from the input wavefunction to the outputs;
+* `head` on the project: the UUID of its newest wavefunction;
+* `tagged` on the project, once the wavefunctions computed from it before
+  the `project` extra existed have been tagged (:func:`tag_project`).
+
+The `project` extra is set by the parsers and the calcfunctions creating
+wavefunctions (with :func:`set_head`), before their outputs are stored. The
+`head` extra is only a cache: :func:`get_head` checks it against the newest
+wavefunction tagged with the project (a filter on the extras, without
+walking the graph), and only queries the graph when the project has no
+tagged wavefunction.
+"""
+
+from aiida.common.exceptions import NotExistent
+from aiida.orm import QueryBuilder, SinglefileData as Wavefunction, load_node
+
+PROJECT_EXTRA = 'project'
+HEAD_EXTRA = 'head'
+TAGGED_EXTRA = 'tagged'
+
+
+def get_project_pk(wavefunction):
+    """Return the pk of the project of the wavefunction, or None"""
+    extras = wavefunction.base.extras
+    if 'name' in extras.keys() and wavefunction.is_stored:
+        return wavefunction.pk
+    return extras.get(PROJECT_EXTRA, None)
+
+
+def set_head(parent, wavefunction):
+    """
+    Tag `wavefunction`, computed from `parent`, with the project of `parent`.
+
+    The `head` extra of the project is only updated if `wavefunction` is
+    stored: the outputs of the parsers and calcfunctions are stored after
+    them, and found by :func:`get_head` from their tag.
+    Nothing is done if `parent` does not belong to a project.
+    """
+    project_pk = get_project_pk(parent)
+    if project_pk is None:
+        return
+
+    wavefunction.base.extras.set(PROJECT_EXTRA, project_pk)
+    if not wavefunction.is_stored:
+        return
+    try:
+        load_node(project_pk).base.extras.set(HEAD_EXTRA, wavefunction.uuid)
+    except NotExistent:
+        pass
+
+
+def query_head(project):
+    """Return the newest wavefunction computed from the project (or the project itself) from the graph"""
+    qb = QueryBuilder()
+    qb.append(Wavefunction, filters={'id': project.pk}, tag='mother')
+    qb.append(Wavefunction, with_ancestors='mother', tag='child')
+    qb.order_by({'child': {'ctime': 'desc'}})
+    qb.limit(1)
+    result = qb.first()
+    return result[0] if result else project
+
+
+def tag_project(project):
+    """
+    Set the `project` extra on the wavefunctions computed from the project without it.
+
+    The graph is only walked the first time: the project is then marked with
+    the `tagged` extra, the wavefunctions computed later are tagged by the parsers.
+
+    :returns: the number of wavefunctions tagged
+    """
+    if project.base.extras.get(TAGGED_EXTRA, False):
+        return 0
+
+    qb = QueryBuilder()
+    qb.append(Wavefunction, filters={'id': project.pk}, tag='mother')
+    qb.append(Wavefunction,
+              with_ancestors='mother',
+              filters={'extras': {'!has_key': PROJECT_EXTRA}},
+              tag='child')
+    untagged = qb.all(flat=True)
+    for wavefunction in untagged:
+        wavefunction.base.extras.set(PROJECT_EXTRA, project.pk)
+    project.base.extras.set(TAGGED_EXTRA, True)
+    return len(untagged)
+
+
+def query_newest_tagged(project, ctime=None):
+    """Return the newest wavefunction tagged with the project (created after `ctime`), or None"""
+    filters = {f'extras.{PROJECT_EXTRA}': project.pk}
+    if ctime is not None:
+        filters['ctime'] = {'>': ctime}
+    qb = QueryBuilder()
+    qb.append(Wavefunction, filters=filters, tag='wf')
+    qb.order_by({'wf': {'ctime': 'desc'}})
+    qb.limit(1)
+    return qb.first(flat=True)
+
+
+def get_head(project):
+    """
+    Return the newest wavefunction of the project.
+
+    The `head` extra is used if it points to a stored node and no tagged
+    wavefunction is newer, otherwise the newest tagged wavefunction is used.
+    Without any, the head is found in the graph (and tagged with the project,
+    for wavefunctions computed before the extras existed). The result is
+    cached in the `head` extra.
+    """
+    head = None
+    uuid = project.base.extras.get(HEAD_EXTRA, None)
+    if uuid is not None:
+        try:
+            head = load_node(uuid)
+        except NotExistent:
+            pass
+
+    newer = query_newest_tagged(project, head.ctime if head is not None else None)
+    if newer is not None:
+        head = newer
+    elif head is None:
+        head = query_head(project)
+        if head.pk != project.pk:
+            head.base.extras.set(PROJECT_EXTRA, project.pk)
+
+    if head.uuid != uuid:
+        project.base.extras.set(HEAD_EXTRA, head.uuid)
+    return head
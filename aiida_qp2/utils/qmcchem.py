@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers to read the results printed by QMC=Chem
+"""
+
+import gzip
+import re
+
+import numpy as np
+
+from aiida.orm import ArrayData
+
+# e.g. `          E_loc :   -1.16390848 +/-    0.00032414 (100)`
+_PROPERTY_REGEX = re.compile(
+    r'^\s*(?P<name>\w+)\s*:\s*(?P<value>[-+0-9.EeDd]+)\s*\+/-\s*(?P<error>[-+0-9.EeDd]+)'
+    r'(?:\s*\(\s*(?P<blocks>\d+)\s*\))?')
+
+
+def parse_property_line(line):
+    """
+    Parse a `<property> : <value> +/- <error> (<blocks>)` line of QMC=Chem.
+
+    :returns: tuple (name, value, error, number of blocks or None), or None if the line does not match
+    """
+    match = _PROPERTY_REGEX.match(line)
+    if match is None:
+        return None
+
+    blocks = match.group('blocks')
+    return (match.group('name'),
+            float(match.group('value').replace('D', 'E').replace('d', 'e')),
+            float(match.group('error').replace('D', 'E').replace('d', 'e')),
+            int(blocks) if blocks is not None else None)
+
+
+class BlockCollector:
+    """
+    Collect the blocks stored by QMC=Chem in the `blocks/` folder of the EZFIO file.
+
+    Each line of a block file reads
+    `<value(s)> <weight> # <property> <compute node> <pid> <block id>`.
+    The instance is meant to be passed in the `collectors` of
+    :func:`aiida_qp2.utils.ezfio_archive.scan_wavefunction`.
+    """
+    def __init__(self):
+        self.values = {}
+        self.weights = {}
+
+    def __call__(self, name):
+        """Return the consumer of the tar member `name` if it is a block file"""
+        if '/blocks/' in name:
+            return self.add_file
+        return None
+
+    def add_file(self, handle):
+        """Add the blocks of a (possibly gzipped) block file"""
+        if handle.peek(2)[:2] == b'\x1f\x8b':
+            handle = gzip.GzipFile(fileobj=handle, mode='rb')
+        # Not a TextIOWrapper: the members of a streamed tar do not support `seekable`
+        for line in handle:
+            self.add_line(line.decode(errors='replace'))
+
+    def add_line(self, line):
+        """Add a single block line, ignoring the malformed ones"""
+        data, _, info = line.partition('#')
+        data, info = data.split(), info.split()
+        if len(data) < 2 or not info:
+            return
+        try:
+            values = [float(x.replace('D', 'E')) for x in data]
+        except ValueError:
+            return
+        name = info[0]
+        self.values.setdefault(name, []).append(values[:-1] if len(values) > 2 else values[0])
+        self.weights.setdefault(name, []).append(values[-1])
+
+    def to_array_data(self):
+        """
+        Return the blocks as `ArrayData`, or None if there are none.
+
+        The array `<property>` has one row per block (and one column per component
+        for vector properties), `<property>_weight` holds the weights of the blocks.
+        """
+        if not self.values:
+            return None
+
+        blocks = ArrayData()
+        for name, values in self.values.items():
+            try:
+                blocks.set_array(name, np.array(values, dtype=float))
+            except ValueError:
+                # Inconsistent number of components
+                continue
+            blocks.set_array(f'{name}_weight', np.array(self.weights[name], dtype=float))
+        return blocks
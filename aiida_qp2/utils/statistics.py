@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Statistics of the QMC=Chem blocks (NumPy vectorized)
+
+* Flyvbjerg-Petersen reblocking of a (weighted) series of blocks
+* integrated autocorrelation time, from the autocorrelation function (FFT)
+* inverse-variance weighted mean of independent runs
+
+The autocorrelation time follows the convention `error**2 = naive_error**2 * tau`,
+so that uncorrelated blocks have `tau = 1`.
+Every function is O(n) or O(n log n) and handles 10^6 blocks in a fraction of a second.
+"""
+
+import numpy as np
+
+from aiida.engine import calcfunction
+from aiida.orm import Dict
+
+
+def weighted_mean(values, weights=None):
+    """
+    Weighted mean of the blocks and its error assuming uncorrelated blocks.
+
+    :returns: (mean, error)
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.ones_like(values) if weights is None else np.asarray(weights, dtype=float)
+
+    total = weights.sum()
+    mean = weights @ values / total
+    if values.size < 2:
+        return float(mean), float('nan')
+
+    variance = weights @ (values - mean)**2 / total
+    return float(mean), float(np.sqrt(variance / (values.size - 1)))
+
+
+def reblock(values, weights=None):
+    """
+    Flyvbjerg-Petersen reblocking: the blocks are averaged pairwise until less than two are left.
+
+    :returns: dictionary of arrays indexed by the reblocking level: `block_size`,
+        `n_blocks`, `error` and `error_error` (the uncertainty of the error)
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.ones_like(values) if weights is None else np.asarray(weights, dtype=float)
+
+    block_size, n_blocks, errors = [], [], []
+    size = 1
+    while values.size >= 2:
+        block_size.append(size)
+        n_blocks.append(values.size)
+        errors.append(weighted_mean(values, weights)[1])
+
+        # Pairwise weighted average (the last block is dropped if the number is odd)
+        n = values.size // 2 * 2
+        pair_weights = weights[0:n:2] + weights[1:n:2]
+        values = (values[0:n:2] * weights[0:n:2] + values[1:n:2] * weights[1:n:2]) / pair_weights
+        weights = pair_weights
+        size *= 2
+
+    n_blocks = np.array(n_blocks)
+    errors = np.array(errors)
+    return {
+        'block_size': np.array(block_size),
+        'n_blocks': n_blocks,
+        'error': errors,
+        'error_error': errors / np.sqrt(2. * (n_blocks - 1)),
+    }
+
+
+def optimal_level(reblocking):
+    """
+    Optimal reblocking level, from the criterion of Lee et al., Phys. Rev. E 83, 066706 (2011):
+    the smallest block size B with B**3 > 2 n (error(B) / error(1))**4.
+
+    :param reblocking: the dictionary returned by `reblock`
+    :returns: the level, or None if the criterion is never fulfilled (too few blocks)
+    """
+    errors = reblocking['error']
+    if errors.size == 0:
+        return None
+
+    criterion = reblocking['block_size']**3 > 2 * reblocking['n_blocks'][0] * (errors / errors[0])**4
+    levels = np.flatnonzero(criterion)
+    return int(levels[0]) if levels.size else None
+
+
+def autocorrelation_time(values, weights=None, window=5.):
+    """
+    Integrated autocorrelation time tau = 1 + 2 sum_t rho(t).
+
+    The autocorrelation function is computed with a FFT and the sum is truncated
+    at the first t >= `window` * tau(t) (Sokal's automatic windowing). With
+    weights, it is the one of the terms of the weighted mean: the deviations
+    from the weighted mean, scaled by the relative weights of the blocks.
+
+    :returns: tau, in units of blocks
+    """
+    values = np.asarray(values, dtype=float)
+    n = values.size
+    if n < 2:
+        return float('nan')
+
+    if weights is None:
+        centered = values - values.mean()
+    else:
+        weights = np.asarray(weights, dtype=float)
+        centered = weights / weights.mean() * (values - weights @ values / weights.sum())
+    size = 1 << (2 * n - 1).bit_length()
+    spectrum = np.fft.rfft(centered, size)
+    autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum), size)[:n]
+    if autocorrelation[0] == 0.:
+        return 1.
+
+    tau = 2. * np.cumsum(autocorrelation / autocorrelation[0]) - 1.
+    windows = np.flatnonzero(np.arange(n) >= window * tau)
+    return float(tau[windows[0]] if windows.size else tau[-1])
+
+
+def combine_runs(means, errors):
+    """
+    Inverse-variance weighted mean of independent runs.
+
+    :returns: (mean, error)
+    """
+    means = np.asarray(means, dtype=float)
+    weights = 1. / np.asarray(errors, dtype=float)**2
+    return float(weights @ means / weights.sum()), float(1. / np.sqrt(weights.sum()))
+
+
+def _finite_or_none(value):
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def analyse(values, weights=None):
+    """
+    Full analysis of a series of blocks.
+
+    The error is the one of the optimal reblocking level (the naive error if
+    there are too few blocks for the reblocking to converge, with `converged` False).
+
+    The values which cannot be computed (e.g. the errors of a single block)
+    are None, not NaN, so that the results can be stored in a `Dict`.
+
+    :returns: dictionary of (JSON serializable) results
+    """
+    mean, naive_error = weighted_mean(values, weights) if np.size(values) else (float('nan'), float('nan'))
+    reblocking = reblock(values, weights)
+    level = optimal_level(reblocking)
+    error = reblocking['error'][level] if level is not None else naive_error
+
+    return {
+        'mean': _finite_or_none(mean),
+        'error': _finite_or_none(error),
+        'naive_error': _finite_or_none(naive_error),
+        'n_blocks': int(np.size(values)),
+        'autocorrelation_time': _finite_or_none(autocorrelation_time(values, weights)),
+        'optimal_level': level,
+        'converged': level is not None,
+        'reblocking': {key: array.tolist() for key, array in reblocking.items()},
+    }
+
+
+def blocks_for_error(analysis, target_error):
+    """Number of blocks needed to reach `target_error`, extrapolated from an `analyse` result (None without error)"""
+    if analysis['error'] is None:
+        return None
+    return int(np.ceil(analysis['n_blocks'] * (analysis['error'] / target_error)**2))
+
+
+def analyse_blocks(blocks, name='E_loc'):
+    """
+    Analyse the property `name` of the `ArrayData` built from the QMC=Chem blocks.
+
+    Each run is analysed separately and, if there are several, combined with
+    `combine_runs` (the runs without an error, e.g. a single block, are left out).
+
+    :param blocks: `ArrayData` or dictionary {label: `ArrayData`}
+    """
+    if not isinstance(blocks, dict):
+        blocks = {'run': blocks}
+
+    runs = {}
+    for label, array in blocks.items():
+        if name not in array.get_arraynames():
+            raise ValueError(f'No blocks of {name} in {array}')
+        weights = array.get_array(f'{name}_weight') if f'{name}_weight' in array.get_arraynames() else None
+        runs[label] = analyse(array.get_array(name), weights)
+
+    if len(runs) == 1:
+        return next(iter(runs.values()))
+
+    combined = [run for run in runs.values() if run['error']]
+    mean = error = None
+    if combined:
+        mean, error = combine_runs([run['mean'] for run in combined], [run['error'] for run in combined])
+    return {'mean': mean, 'error': error, 'runs': runs}
+
+
+@calcfunction
+def qmc_statistics(name, **blocks):
+    """
+    Reblocking, autocorrelation time and weighted mean of the blocks of one or several runs
+    """
+    return Dict(dict=analyse_blocks(blocks, name.value))
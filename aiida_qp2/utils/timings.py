@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Per-step timings recorded by the job scripts
+
+The job scripts define the shell function `_aiida_step <name> <command...>`
+which runs the command (in the current shell, so that e.g. `qp set_file` is
+kept) and appends to `TIMINGS_FILE` one tab-separated line per step::
+
+    <name>  <wall (s)>  <user CPU (s)>  <system CPU (s)>  <peak memory (bytes) or ->  <exit status>
+
+The function is POSIX sh: the script of the create calculation is read by
+the shell of the code, which is not necessarily bash. The wall time is read
+with `date` (to the second where `%N` is not supported), the CPU times are
+those of the child processes (qp, MPI launchers...) reported by the `times`
+builtin before and after the step. The peak memory is the high-water mark of
+the job cgroup (cgroup v2 `memory.peak` or v1 `memory.max_usage_in_bytes`)
+after the step: it is the peak of the job so far, and `-` where the cgroup
+is not readable.
+"""
+
+from aiida.orm import Dict
+
+TIMINGS_FILE = 'aiida.timings'
+
+# Steps moving the EZFIO file around rather than computing
+TAR_STEPS = ('unpack', 'pack')
+
+_STEP_FUNCTION = r'''_aiida_peak_memory() {
+    _aiida_cgroup=$(sed -n 's/^0:://p' /proc/self/cgroup 2> /dev/null)
+    cat "/sys/fs/cgroup${_aiida_cgroup}/memory.peak" 2> /dev/null \
+        || cat /sys/fs/cgroup/memory/memory.max_usage_in_bytes 2> /dev/null \
+        || echo -
+}
+_aiida_now() {
+    date +%s.%N | sed 's/\.[^0-9]*$//'
+}
+_aiida_step() {
+    _aiida_step_name=$1
+    shift
+    _aiida_step_status=0
+    _aiida_step_start=$(_aiida_now)
+    # The second and fourth lines are the times of the children, before and after
+    times > "$AIIDA_WORKDIR/.aiida_step_time"
+    "$@" || _aiida_step_status=$?
+    times >> "$AIIDA_WORKDIR/.aiida_step_time"
+    _aiida_step_end=$(_aiida_now)
+    awk -v name="$_aiida_step_name" -v start="$_aiida_step_start" -v end="$_aiida_step_end" \
+        -v memory="$(_aiida_peak_memory)" -v status="$_aiida_step_status" '
+        function seconds(time) { split(time, parts, "m"); sub("s", "", parts[2]); return parts[1] * 60 + parts[2] }
+        NR == 2 { user = -seconds($1); sys = -seconds($2) }
+        NR == 4 { user += seconds($1); sys += seconds($2) }
+        END { printf "%s\t%.3f\t%.3f\t%.3f\t%s\t%s\n", name, end - start, user, sys, memory, status }
+    ' "$AIIDA_WORKDIR/.aiida_step_time" >> "$AIIDA_WORKDIR/{timings_file}"
+    return $_aiida_step_status
+}
+'''
+
+
+def step_function():
+    """Return the shell lines defining `_aiida_step` (`AIIDA_WORKDIR` has to be set before)"""
+    return _STEP_FUNCTION.replace('{timings_file}', TIMINGS_FILE)
+
+
+def parse_timings(handle):
+    """
+    Parse the timing file written by `_aiida_step`.
+
+    :param handle: text handle of `TIMINGS_FILE`
+    :returns: dictionary with the list of `steps` ({name, wall, user, sys, peak_memory, status}),
+        the total `wall` and `cpu` times, and the wall time of the tar steps (`tar_wall`)
+    """
+    steps = []
+    for line in handle:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) != 6:
+            continue
+        name, wall, user, sys, memory, status = fields
+        try:
+            steps.append({
+                'name': name,
+                'wall': float(wall),
+                'user': float(user),
+                'sys': float(sys),
+                'peak_memory': int(memory) if memory.isdigit() else None,
+                'status': int(status),
+            })
+        except ValueError:
+            continue
+
+    return {
+        'steps': steps,
+        'wall': sum(step['wall'] for step in steps),
+        'cpu': sum(step['user'] + step['sys'] for step in steps),
+        'tar_wall': sum(step['wall'] for step in steps if step['name'] in TAR_STEPS),
+    }
+
+
+def attach_timings(parser):
+    """Attach the `output_job_timings` output if the timing file was retrieved (shared by the parsers)"""
+    if TIMINGS_FILE not in parser.retrieved.list_object_names():
+        return
+
+    with parser.retrieved.open(TIMINGS_FILE, 'r') as handle:
+        parser.out('output_job_timings', Dict(dict=parse_timings(handle)))
@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
 """
-This module contains the wavefunction handler funcion
+This module contains the calcfunctions editing wavefunctions
 """
 
 from aiida.engine import calcfunction
 from aiida.orm import List, SinglefileData
 from aiida_qp2.utils.ezfio import ezfio
+from aiida_qp2.utils.project import set_head
 import tempfile
 import tarfile
 import os
@@ -46,12 +47,50 @@ def wavefunction_handler(wavefunction, operations):
             with tarfile.open(wf_path, 'w:gz') as tar:
                 tar.add(ezfio_path, arcname='aiida.ezfio')
             with open(wf_path, 'rb') as handle:
-                wavefunction = SinglefileData(file=handle)
+                new_wavefunction = SinglefileData(file=handle)
 
     ret = {'data': List(list=data)}
 
     if changed:
-        ret['wavefunction'] = wavefunction
-        wavefunction.base.attributes.all['wavefunction'] = True
+        ret['wavefunction'] = new_wavefunction
+        new_wavefunction.base.attributes.set('wavefunction', True)
+        set_head(wavefunction, new_wavefunction)
 
     return ret
+
+
+@calcfunction
+def wavefunction_editor(wavefunction, changes):
+    """
+    This function applies the changes of an interactive edit to the wavefunction
+
+    The wavefunction is extracted in a temporary directory, where the changes
+    are written, and packed again: the result only depends on the inputs. The
+    members of an archive packed by a previous edit (with the `pack_index`
+    attribute) are copied from it, only the others are compressed.
+
+    :param changes: `FolderData` with the members of the EZFIO file written
+        (see `Workspace.changes_folder`), the members removed are listed in
+        its `deleted` attribute
+    """
+    from aiida_qp2.utils.ezfio_workspace import PACK_INDEX_ATTRIBUTE, Workspace, pack_index
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        workspace = Workspace(os.path.join(temp_dir, 'workspace'))
+        with wavefunction.open(mode='rb') as handle:
+            workspace.extract(handle, wavefunction.uuid)
+        workspace.locate(wavefunction.base.attributes.get(PACK_INDEX_ATTRIBUTE, {}))
+        workspace.apply(changes)
+
+        wf_path = os.path.join(temp_dir, wavefunction.filename)
+        with open(wf_path, 'wb') as handle, \
+             wavefunction.open(mode='rb') as source:
+            index, sha256, _ = workspace.pack(handle, source=source)
+        new_wavefunction = SinglefileData(file=wf_path)
+
+    new_wavefunction.base.attributes.set('wavefunction', True)
+    new_wavefunction.base.attributes.set('sha256', sha256)
+    new_wavefunction.base.attributes.set(PACK_INDEX_ATTRIBUTE, pack_index(index))
+    set_head(wavefunction, new_wavefunction)
+
+    return {'wavefunction': new_wavefunction}
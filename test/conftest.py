@@ -13,3 +13,26 @@ pytest_plugins = ['aiida.manage.tests.pytest_fixtures']
 def clear_database_auto(aiida_profile_clean):
     """Automatically clear database in between tests."""
     pass
+
+
+@pytest.fixture
+def prepare_calc_job(tmp_path):
+    """
+    Return a function writing the input files of a calculation
+
+    `prepare(entry_point, inputs)` returns the `CalcInfo` and the `Folder`
+    of the files, without submitting anything.
+    """
+    def prepare(entry_point, inputs):
+        from aiida.common.folders import Folder
+        from aiida.engine.utils import instantiate_process
+        from aiida.manage import get_manager
+        from aiida.plugins import CalculationFactory
+
+        process = instantiate_process(get_manager().get_runner(), CalculationFactory(entry_point), **inputs)
+        sandbox = tmp_path / 'sandbox'
+        sandbox.mkdir(exist_ok=True)
+        folder = Folder(str(sandbox))
+        return process.prepare_for_submission(folder), folder
+
+    return prepare
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the startup of the command line interface
+
+`aqp --help` and the completion of the command names must not import AiiDA.
+Run as a script to print the slowest imports of `aiida_qp2.cli`::
+
+    python test/test_cli_startup.py [module]
+"""
+
+import importlib
+import subprocess
+import sys
+
+from aiida_qp2.cli import _COMMANDS
+
+# Budget of the cumulative import time of `aiida_qp2.cli` (us), generous for slow CI machines
+_IMPORT_BUDGET = 100000
+
+
+def import_times(statement):
+    """Run `statement` in a new interpreter, return {module: cumulative import time (us)}"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def test_import_time():
+    times = import_times('import aiida_qp2.cli')
+    assert not [module for module in times if module == 'aiida' or module.startswith('aiida.')]
+    assert times['aiida_qp2.cli'] < _IMPORT_BUDGET
+
+
+def test_help_without_aiida():
+    times = import_times('from aiida_qp2.cli import cli_root\n'
+                         'cli_root(["--help"], prog_name="aqp", standalone_mode=False)')
+    assert 'aiida' not in times
+
+
+def test_short_help():
+    # The table printed by `aqp --help` is in sync with the commands
+    for name, (module, attribute, short_help) in _COMMANDS.items():
+        command = getattr(importlib.import_module(f'aiida_qp2.cli.{module}'), attribute)
+        assert command.name == name
+        assert command.get_short_help_str(limit=200) == short_help
+
+
+if __name__ == '__main__':
+    module = sys.argv[1] if len(sys.argv) > 1 else 'aiida_qp2.cli'
+    times = import_times(f'import {module}')
+    print(f'{module}: {times[module] / 1000:.1f} ms')
+    for name, cumulative in sorted(times.items(), key=lambda x: -x[1])[:16]:
+        if name == module:
+            continue
+        print(f'  {cumulative / 1000:8.1f} ms  {name}')
@@ -46,3 +46,44 @@ def test_create(aiida_profile_clean):
         'parameters': parameters,
         'code': code
     })
+
+
+def test_create_script_posix(aiida_local_code_factory, prepare_calc_job, tmp_path):
+    """The script is fed to the shell of the code, it runs (and times its steps) under a POSIX sh"""
+    import os
+    import shutil
+    import subprocess
+    from aiida.orm import Dict, Str, StructureData
+    from aiida_qp2.utils.timings import parse_timings
+    from ase.io import read
+
+    shell = shutil.which('dash')
+    if shell is None:
+        pytest.skip('dash is not installed')
+
+    code = aiida_local_code_factory('qp2.create', 'sh')
+    inputs = {
+        'code': code,
+        'parameters': Dict({}),
+        'structure': StructureData(ase=read(DATA_DIR / 'H2.xyz')),
+        'basis_set': Str('sto-3g'),
+        'metadata': {'options': {'output_wf_basename': 'aiida.wf'}},
+    }
+    _, folder = prepare_calc_job('qp2.create', inputs)
+
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    (bin_dir / 'qp').write_text('#!/bin/sh\nmkdir -p aiida.ezfio/hartree_fock\n')
+    (bin_dir / 'qp').chmod(0o755)
+    workdir = tmp_path / 'workdir'
+    workdir.mkdir()
+    with folder.open('aiida.inp', 'rb') as handle:
+        script = handle.read()
+    environment = {**os.environ, 'PATH': f'{bin_dir}:{os.environ["PATH"]}'}
+    process = subprocess.run([shell], input=script, cwd=workdir, env=environment, capture_output=True, timeout=30)
+
+    assert process.returncode == 0, process.stderr.decode()
+    assert (workdir / 'aiida.wf.tar.gz').exists()
+    with open(workdir / 'aiida.timings') as handle:
+        steps = parse_timings(handle)['steps']
+    assert [(step['name'], step['status']) for step in steps] == [('create_ezfio', 0), ('pack', 0)]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the export of the projects
+"""
+
+import io
+import os
+
+from aiida_qp2.cli.export import Exporter, get_object_key, plan_export
+
+
+def _store_wavefunction(content, creator=None):
+    from aiida.common.links import LinkType
+    from aiida.orm import SinglefileData
+
+    node = SinglefileData(io.BytesIO(content), filename='aiida.wf.tar.gz')
+    node.base.attributes.set('wavefunction', True)
+    if creator is not None:
+        node.base.links.add_incoming(creator, LinkType.CREATE, 'output_wavefunction')
+    return node.store()
+
+
+def test_get_object_key():
+    metadata = {'o': {'a': {'k': 'x'}, 'folder': {'o': {'b': {'k': 'y'}}}}}
+    assert get_object_key(metadata, 'a') == 'x'
+    assert get_object_key(metadata, 'folder/b') == 'y'
+    assert get_object_key(metadata, 'c') is None
+    assert get_object_key(None, 'a') is None
+
+
+def test_export(aiida_profile_clean, tmp_path):
+    nodes = [_store_wavefunction(bytes([i]) * 100000) for i in range(5)]
+    files = plan_export({'id': {'in': [node.pk for node in nodes]}})
+    assert sorted(file.path for file in files) == sorted(f'{node.pk}_wavefunction/aiida.wf.tar.gz' for node in nodes)
+
+    exporter = Exporter(str(tmp_path), jobs=3)
+    assert exporter.export(files) == 500000
+    with open(tmp_path / files[0].path, 'rb') as handle:
+        assert handle.read() == nodes[0].get_content('rb')
+
+    # Up to date, then a modified and a deleted file are copied again
+    exporter = Exporter(str(tmp_path), jobs=3)
+    exporter.export(files)
+    assert (len(exporter.copied), len(exporter.skipped)) == (0, 5)
+
+    with open(tmp_path / files[0].path, 'ab') as handle:
+        handle.write(b'x')
+    os.remove(tmp_path / files[1].path)
+    exporter = Exporter(str(tmp_path), jobs=3)
+    exporter.export(files)
+    assert sorted(file.path for file in exporter.copied) == sorted([files[0].path, files[1].path])
+
+
+def test_export_calcjob(aiida_profile_clean, tmp_path):
+    """The job script, the output and the parameters of the calcjob computing a wavefunction are exported"""
+    import yaml
+    from aiida.common.links import LinkType
+    from aiida.orm import CalcJobNode, Dict, FolderData
+
+    mother = _store_wavefunction(b'mother')
+
+    create = CalcJobNode()
+    create.set_process_label('QP2CreateCalculation')
+    create.store()
+    created = _store_wavefunction(b'created', create)
+
+    calc = CalcJobNode()
+    calc.set_process_label('QP2RunCalculation')
+    calc.set_option('output_filename', 'aiida-qp2.out')
+    calc.base.repository.put_object_from_filelike(io.BytesIO(b'qp run fci\n'), 'aiida.inp')
+    calc.base.links.add_incoming(mother, LinkType.INPUT_CALC, 'wavefunction')
+    parameters = Dict({'run_type': 'fci', 'qp_prepend': ['determinants n_det_max 1e4']}).store()
+    calc.base.links.add_incoming(parameters, LinkType.INPUT_CALC, 'parameters')
+    calc.store()
+    retrieved = FolderData()
+    retrieved.base.repository.put_object_from_filelike(io.BytesIO(b'E = -1.1\n'), 'aiida-qp2.out')
+    retrieved.base.links.add_incoming(calc, LinkType.CREATE, 'retrieved')
+    retrieved.store()
+    output = _store_wavefunction(b'output', calc)
+
+    files = plan_export({'id': {'in': [mother.pk, created.pk, output.pk]}})
+    folder = f'{output.pk}_fci'
+    assert sorted(file.path for file in files) == sorted([
+        f'{mother.pk}_wavefunction/aiida.wf.tar.gz',
+        f'{created.pk}_create/aiida.wf.tar.gz',
+        f'{folder}/aiida.wf.tar.gz',
+        f'{folder}/aiida.inp',
+        f'{folder}/aiida-qp2.out',
+        f'{folder}/parameters.yaml',
+    ])
+
+    Exporter(str(tmp_path)).export(files)
+    assert (tmp_path / folder / 'aiida.wf.tar.gz').read_bytes() == b'output'
+    assert (tmp_path / folder / 'aiida.inp').read_bytes() == b'qp run fci\n'
+    assert (tmp_path / folder / 'aiida-qp2.out').read_bytes() == b'E = -1.1\n'
+    assert yaml.safe_load((tmp_path / folder / 'parameters.yaml').read_text()) == parameters.get_dict()
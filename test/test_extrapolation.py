@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the CIPSI trajectory and its extrapolation
+"""
+
+import gzip
+import io
+import tarfile
+
+import numpy as np
+import pytest
+
+from aiida_qp2.utils.extrapolation import build_trajectory, extrapolate_energy, extrapolate_trajectory
+
+
+def test_extrapolate_energy():
+    """A linear E(PT2) is extrapolated exactly"""
+    pt2 = np.array([-0.1, -0.05, -0.02, -0.01, -0.005])
+    energy = -76.3 - 0.9 * pt2
+
+    extrapolated, error = extrapolate_energy(energy, pt2)
+
+    assert np.isclose(extrapolated, -76.3)
+    assert error < 1e-10
+
+
+def test_trajectory():
+    """The trajectory has one row per iteration and one column per state"""
+    iterations = [
+        {'n_det': 1, 'energy': [-76.0, -75.5], 'rpt2': [-0.3, -0.4]},
+        {'n_det': 10, 'energy': [-76.1, -75.6], 'rpt2': [-0.2, -0.3]},
+        {'n_det': 100, 'energy': [-76.2], 'rpt2': [-0.1]},
+    ]
+    trajectory = build_trajectory(iterations)
+
+    assert list(trajectory.get_array('n_det')) == [1, 10, 100]
+    assert trajectory.get_array('energy').shape == (3, 2)
+    assert np.isnan(trajectory.get_array('energy')[2, 1])
+
+    extrapolated, _ = extrapolate_trajectory(trajectory)
+    assert np.isclose(extrapolated, -76.3)
+
+
+def test_parser_without_pt2(aiida_local_code_factory, tmp_path):
+    """A trajectory without PT2 is stored, the extrapolation is skipped with a warning"""
+    from aiida.common.links import LinkType
+    from aiida.orm import CalcJobNode, Dict, FolderData
+    from aiida.plugins import ParserFactory
+
+    code = aiida_local_code_factory('qp2.run', 'bash')
+    node = CalcJobNode(computer=code.computer, process_type='aiida.calculations:qp2.run')
+    node.set_option('resources', {'num_machines': 1, 'num_mpiprocs_per_machine': 1})
+    node.set_option('output_filename', 'aiida-qp2.out')
+    node.set_option('output_wf_basename', 'aiida.wf')
+    node.set_option('store_wavefunction', False)
+    parameters = Dict({'run_type': 'fci', 'extrapolate': True}).store()
+    node.base.links.add_incoming(parameters, LinkType.INPUT_CALC, 'parameters')
+    node.store()
+
+    output = ''.join(f' N_det = {10**it}\n E = {-76.0 - 0.1 * it}\n' for it in range(4))
+    retrieved = FolderData()
+    retrieved.base.repository.put_object_from_filelike(io.BytesIO(output.encode()), 'aiida-qp2.out')
+    retrieved.base.repository.put_object_from_filelike(io.BytesIO(b'0\n'), 'aiida.exit_code')
+    retrieved.base.links.add_incoming(node, LinkType.CREATE, 'retrieved')
+    retrieved.store()
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        content = gzip.compress(b'1\n1\n-76.3\n')
+        info = tarfile.TarInfo('aiida.ezfio/fci/energy.gz')
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+    (tmp_path / 'aiida.wf.tar.gz').write_bytes(buffer.getvalue())
+
+    results, calcfunction = ParserFactory('qp2.run').parse_from_node(node,
+                                                                    store_provenance=False,
+                                                                    retrieved_temporary_folder=str(tmp_path))
+
+    assert calcfunction.exit_status == 0
+    assert results['output_energy'].value == -76.3
+    assert 'pt2' not in results['output_trajectory'].get_arraynames()
+    assert 'output_energy_extrapolated' not in results
+
+
+def test_extrapolate_missing_arrays():
+    """Missing arrays and states are reported as ValueError"""
+    trajectory = build_trajectory([{'n_det': 1, 'energy': [-76.0]}, {'n_det': 10, 'energy': [-76.1]}])
+    with pytest.raises(ValueError, match='PT2'):
+        extrapolate_trajectory(trajectory)
+
+    trajectory = build_trajectory([{'n_det': 1, 'pt2': [-0.1]}, {'n_det': 10, 'pt2': [-0.05]}])
+    with pytest.raises(ValueError, match='energy'):
+        extrapolate_trajectory(trajectory)
+
+    trajectory = build_trajectory([{'n_det': 1, 'energy': [-76.0], 'pt2': [-0.1]}])
+    with pytest.raises(ValueError, match='state 1'):
+        extrapolate_trajectory(trajectory, state=1)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the single pass over the packed EZFIO file
+"""
+
+import gzip
+import hashlib
+import io
+import tarfile
+
+from aiida_qp2.utils.ezfio_archive import scan_wavefunction
+
+
+def _add_member(tar, name, content):
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    tar.addfile(info, io.BytesIO(content))
+
+
+def make_archive():
+    """Packed EZFIO file with a scalar and per-state arrays"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        _add_member(tar, 'aiida.ezfio/hartree_fock/energy', b'  -76.0123\n')
+        _add_member(tar, 'aiida.ezfio/fci/energy.gz', gzip.compress(b'1\n2\n-76.2\n-75.9\n'))
+        _add_member(tar, 'aiida.ezfio/fci/energy_pt2.gz', gzip.compress(b'1\n2\n-76.3\n-76.0\n'))
+        _add_member(tar, 'aiida.ezfio/determinants/psi_coef.gz', b'\0' * 100000)
+    return buffer.getvalue()
+
+
+def test_scan_wavefunction():
+    """All the energies of the run type are collected"""
+    archive = make_archive()
+
+    energies, _ = scan_wavefunction(io.BytesIO(archive), 'scf', store=False)
+    assert energies == {'energy': [-76.0123]}
+
+    energies, _ = scan_wavefunction(io.BytesIO(archive), 'fci', store=False)
+    assert energies == {'energy': [-76.2, -75.9], 'energy_pt2': [-76.3, -76.0]}
+
+
+def test_scan_wavefunction_store():
+    """The wavefunction node is a copy of the archive and carries its hash"""
+    archive = make_archive()
+
+    _, wf_file = scan_wavefunction(io.BytesIO(archive), 'fci', filename='aiida.wf.tar.gz')
+
+    with wf_file.open(mode='rb') as handle:
+        assert handle.read() == archive
+    assert wf_file.base.attributes.get('sha256') == hashlib.sha256(archive).hexdigest()
+
+
+def test_qmcchem_blocks():
+    """The QMC=Chem blocks are collected during the same pass"""
+    from aiida_qp2.utils.qmcchem import BlockCollector
+
+    lines = [
+        '-1.1630E+00 1000.0 # E_loc node1 1234 1',
+        '-1.1650E+00 1000.0 # E_loc node1 1234 2',
+        '0.1 0.2 0.3 1000.0 # Dipole node1 1234 1',
+    ]
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        _add_member(tar, 'aiida.ezfio/blocks/node1.1234', gzip.compress('\n'.join(lines).encode()))
+
+    blocks = BlockCollector()
+    scan_wavefunction(io.BytesIO(buffer.getvalue()), 'qmcchem', store=False, collectors=[blocks])
+
+    assert blocks.values == {'E_loc': [-1.163, -1.165], 'Dipole': [[0.1, 0.2, 0.3]]}
+    assert blocks.weights['E_loc'] == [1000.0, 1000.0]
+    assert blocks.to_array_data().get_array('Dipole').shape == (1, 3)
+
+
+def test_wavefunction_from_temporary_folder(tmp_path):
+    """The node is created from the file of the retrieved temporary folder"""
+    from aiida.orm import FolderData
+    from aiida_qp2.utils.ezfio_archive import has_wavefunction, open_wavefunction
+
+    archive = make_archive()
+    (tmp_path / 'aiida.wf.tar.gz').write_bytes(archive)
+    retrieved = FolderData()
+
+    assert has_wavefunction(retrieved, 'aiida.wf.tar.gz', str(tmp_path))
+    assert not has_wavefunction(retrieved, 'aiida.wf.tar.gz')
+
+    with open_wavefunction(retrieved, 'aiida.wf.tar.gz', str(tmp_path)) as source:
+        energies, wf_file = scan_wavefunction(source, 'scf', filename='aiida.wf.tar.gz')
+
+    assert energies == {'energy': [-76.0123]}
+    assert wf_file.base.attributes.get('sha256') == hashlib.sha256(archive).hexdigest()
+    with wf_file.open(mode='rb') as handle:
+        assert handle.read() == archive
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the workspaces of the interactive edits
+"""
+
+import gzip
+import io
+import os
+import random
+import tarfile
+import zlib
+
+from aiida_qp2.utils.ezfio_workspace import Workspace, attribute_name, crc32_combine
+
+_MEMBERS = {
+    'aiida.ezfio/.version': b'2.0.2\n',
+    'aiida.ezfio/jastrow/j2e_type': b'None\n',
+    'aiida.ezfio/determinants/n_det': b'           1\n',
+    'aiida.ezfio/determinants/psi_coef.gz': gzip.compress(b'1\n2\n' + b'0.1\n' * 20000),
+}
+
+
+def make_archive():
+    """Packed EZFIO file, as written by `tar czf`"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for name in ('aiida.ezfio', 'aiida.ezfio/jastrow', 'aiida.ezfio/determinants'):
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.DIRTYPE
+            tar.addfile(info)
+        for name, content in _MEMBERS.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def read_archive(archive):
+    """Content of the files of an archive, read as a stream"""
+    with tarfile.open(fileobj=io.BytesIO(archive), mode='r|gz') as tar:
+        return {member.name: tar.extractfile(member).read() for member in tar if member.isfile()}
+
+
+def test_crc32_combine():
+    """The CRC-32 of a concatenation is found from the CRC-32 of the parts"""
+    rng = random.Random(0)
+    for length1, length2 in [(0, 10), (10, 0), (1, 1), (1000, 513), (12345, 100000)]:
+        first, second = rng.randbytes(length1), rng.randbytes(length2)
+        assert crc32_combine(zlib.crc32(first), zlib.crc32(second), length2) == zlib.crc32(first + second)
+
+
+def test_dirty(tmp_path):
+    """Only the members whose content changed are dirty"""
+    workspace = Workspace(str(tmp_path / 'ws'))
+    workspace.extract(io.BytesIO(make_archive()), 'uuid')
+    assert workspace.dirty() == ([], [])
+
+    # Rewritten with the same content, as EZFIO does for the `.version` files
+    with open(os.path.join(workspace.ezfio_path, '.version'), 'wb') as handle:
+        handle.write(b'2.0.2\n')
+    os.utime(os.path.join(workspace.ezfio_path, '.version'), ns=(0, 0))
+    assert workspace.dirty() == ([], [])
+
+    with open(os.path.join(workspace.ezfio_path, 'jastrow', 'j2e_type'), 'wb') as handle:
+        handle.write(b'Mu\n')
+    os.makedirs(os.path.join(workspace.ezfio_path, 'mo_basis'))
+    with open(os.path.join(workspace.ezfio_path, 'mo_basis', 'mo_num'), 'wb') as handle:
+        handle.write(b'10\n')
+    os.remove(os.path.join(workspace.ezfio_path, 'determinants', 'n_det'))
+    changed, deleted = workspace.dirty()
+    assert changed == ['aiida.ezfio/jastrow/j2e_type', 'aiida.ezfio/mo_basis/mo_num']
+    assert deleted == ['aiida.ezfio/determinants/n_det']
+    assert {attribute_name(name) for name in changed + deleted} == {
+        'jastrow_j2e_type', 'mo_basis_mo_num', 'determinants_n_det'
+    }
+
+    # The previous content is restored, the new members removed
+    workspace.restore(changed + deleted, io.BytesIO(make_archive()))
+    assert workspace.dirty() == ([], [])
+
+
+def test_pack(tmp_path, monkeypatch):
+    """Packing again only compresses the dirty members"""
+    monkeypatch.setenv('AIIDA_QP2_WORKSPACES', str(tmp_path))
+    workspace = Workspace(str(tmp_path / 'first'))
+    workspace.extract(io.BytesIO(make_archive()), 'first')
+
+    # No position known in an archive made by tar: everything is compressed
+    output = io.BytesIO()
+    index, _, compressed = workspace.pack(output, source=io.BytesIO(make_archive()))
+    first = output.getvalue()
+    assert compressed == len(index) == 7
+    assert read_archive(first) == _MEMBERS
+    workspace.commit('second', index)
+    assert workspace.path == str(tmp_path / 'second')
+    assert Workspace(workspace.path).manifest['source'] == 'second'
+
+    with open(os.path.join(workspace.ezfio_path, 'jastrow', 'j2e_type'), 'wb') as handle:
+        handle.write(b'Mu\n')
+    output = io.BytesIO()
+    index, _, compressed = workspace.pack(output, source=io.BytesIO(first))
+    second = output.getvalue()
+    assert compressed == 1
+    assert read_archive(second) == {**_MEMBERS, 'aiida.ezfio/jastrow/j2e_type': b'Mu\n'}
+    # Readable with the standard tools, unchanged members copied byte for byte
+    assert len(gzip.decompress(second)) % tarfile.BLOCKSIZE == 0
+    entry = index['aiida.ezfio/determinants/psi_coef.gz']
+    segment = second[entry['offset']:entry['offset'] + entry['length']]
+    assert segment in first
+
+
+def test_editor(aiida_profile_clean, tmp_path, monkeypatch):
+    """The edit only depends on its inputs, the workspace becomes the one of the new wavefunction"""
+    from aiida.orm import SinglefileData
+    from aiida_qp2.utils.wavefunction_handler import wavefunction_editor
+
+    monkeypatch.setenv('AIIDA_QP2_WORKSPACES', str(tmp_path / 'cache'))
+    wavefunction = SinglefileData(io.BytesIO(make_archive()), filename='aiida.wf.tar.gz').store()
+    workspace = Workspace.open(wavefunction)
+    with open(os.path.join(workspace.ezfio_path, 'jastrow', 'j2e_type'), 'wb') as handle:
+        handle.write(b'Mu\n')
+    changes = workspace.changes_folder(*workspace.dirty())
+
+    # Not read from the cache of the workspaces
+    monkeypatch.setenv('AIIDA_QP2_WORKSPACES', str(tmp_path / 'other'))
+    new_wavefunction = wavefunction_editor(wavefunction, changes)['wavefunction']
+    edited = {**_MEMBERS, 'aiida.ezfio/jastrow/j2e_type': b'Mu\n'}
+    assert read_archive(new_wavefunction.get_content('rb')) == edited
+    assert Workspace(workspace.path).dirty() == (['aiida.ezfio/jastrow/j2e_type'], [])
+
+    # Reused without extracting the new archive again
+    monkeypatch.setenv('AIIDA_QP2_WORKSPACES', str(tmp_path / 'cache'))
+    assert Workspace(workspace.path).adopt(new_wavefunction)
+    reopened = Workspace.open(new_wavefunction)
+    assert reopened.path == str(tmp_path / 'cache' / new_wavefunction.uuid)
+    assert reopened.dirty() == ([], [])
+
+    # The next edit copies the unchanged members from the archive
+    with open(os.path.join(reopened.ezfio_path, 'determinants', 'n_det'), 'wb') as handle:
+        handle.write(b'           2\n')
+    changes = reopened.changes_folder(*reopened.dirty())
+    last_wavefunction = wavefunction_editor(new_wavefunction, changes)['wavefunction']
+    last = last_wavefunction.get_content('rb')
+    assert read_archive(last) == {**edited, 'aiida.ezfio/determinants/n_det': b'           2\n'}
+    position = last_wavefunction.base.attributes.get('pack_index')['aiida.ezfio/determinants/psi_coef.gz']
+    assert last[position['offset']:position['offset'] + position['length']] in new_wavefunction.get_content('rb')
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the task farm calculation and its parser
+"""
+
+import io
+import tarfile
+
+from pathlib import Path
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+
+def _wavefunction_archive(energy):
+    """Packed EZFIO file with a Hartree-Fock energy"""
+    buffer = io.BytesIO()
+    content = f'  {energy}\n'.encode()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        info = tarfile.TarInfo('aiida.ezfio/hartree_fock/energy')
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def test_farm_script(aiida_local_code_factory, prepare_calc_job):
+    """One folder per item, the items run in the background on the free slots"""
+    from aiida.orm import Dict, SinglefileData, StructureData
+    from ase.io import read
+
+    code = aiida_local_code_factory('qp2.farm', 'bash')
+    wavefunction = SinglefileData(io.BytesIO(_wavefunction_archive(-1.0)), filename='aiida.wf.tar.gz').store()
+    inputs = {
+        'code': code,
+        'parameters': {
+            'run': Dict({'run_type': 'scf', 'qp_prepend': ['scf_utils n_it_scf_max 50']}),
+            'create': Dict({'basis_set': 'sto-3g'}),
+        },
+        'wavefunctions': {'run': wavefunction},
+        'structures': {'create': StructureData(ase=read(DATA_DIR / 'H2.xyz'))},
+        'metadata': {
+            'options': {
+                'resources': {'num_machines': 1, 'num_mpiprocs_per_machine': 8},
+                'threads_per_item': 2,
+            }
+        },
+    }
+    calcinfo, folder = prepare_calc_job('qp2.farm', inputs)
+
+    with folder.open('aiida.inp') as handle:
+        script = handle.read()
+    assert 'export OMP_NUM_THREADS=2\n' in script
+    assert 'AIIDA_FARM_SLOTS=4\n' in script
+    assert 'for item in create run; do\n' in script
+    assert '    while [ $(jobs -rp | wc -l) -ge $AIIDA_FARM_SLOTS ]; do\n        wait -n\n' in script
+    assert '    _aiida_run_item $item &\ndone\nwait\n' in script
+
+    with folder.open('item_run/aiida.item.sh') as handle:
+        item = handle.read().splitlines()
+    assert item == [
+        'set -e', 'tar xzf aiida.wf.tar.gz', 'qp set_file aiida.ezfio', 'qp set scf_utils n_it_scf_max 50 ',
+        'qp run scf ', 'tar czf aiida.wf.tar.gz *.ezfio'
+    ]
+    with folder.open('item_create/aiida.item.sh') as handle:
+        assert 'qp create_ezfio -b sto-3g aiida.xyz\n' in handle.read()
+    assert 'aiida.xyz' in folder.get_subfolder('item_create').get_content_list()
+
+    assert calcinfo.local_copy_list == [(wavefunction.uuid, 'aiida.wf.tar.gz', 'item_run/aiida.wf.tar.gz')]
+    assert ('item_run/aiida.exit_code', '.', 2) in calcinfo.retrieve_list
+    assert sorted(calcinfo.retrieve_temporary_list) == [('item_create/aiida.wf.tar.gz', '.', 2),
+                                                        ('item_run/aiida.wf.tar.gz', '.', 2)]
+
+
+def test_farm_parser(aiida_local_code_factory, tmp_path):
+    """The outputs of the items which succeeded are in their namespace"""
+    from aiida.common.links import LinkType
+    from aiida.orm import CalcJobNode, Dict, FolderData
+    from aiida.plugins import ParserFactory
+
+    code = aiida_local_code_factory('qp2.farm', 'bash')
+    node = CalcJobNode(computer=code.computer, process_type='aiida.calculations:qp2.farm')
+    node.set_option('resources', {'num_machines': 1, 'num_mpiprocs_per_machine': 2})
+    node.set_option('output_wf_basename', 'aiida.wf')
+    node.set_option('store_wavefunction', True)
+    for label in ('ok', 'failed'):
+        node.base.links.add_incoming(Dict({'run_type': 'scf'}).store(), LinkType.INPUT_CALC, f'parameters__{label}')
+    node.store()
+
+    retrieved = FolderData()
+    retrieved.base.repository.put_object_from_filelike(io.BytesIO(b'0\n'), 'item_ok/aiida.exit_code')
+    retrieved.base.repository.put_object_from_filelike(io.BytesIO(b'1\n'), 'item_failed/aiida.exit_code')
+    retrieved.base.links.add_incoming(node, LinkType.CREATE, 'retrieved')
+    retrieved.store()
+
+    # The wavefunctions are in the retrieved temporary folder
+    (tmp_path / 'item_ok').mkdir()
+    (tmp_path / 'item_ok' / 'aiida.wf.tar.gz').write_bytes(_wavefunction_archive(-1.1))
+
+    results, calcfunction = ParserFactory('qp2.farm').parse_from_node(node,
+                                                                     store_provenance=False,
+                                                                     retrieved_temporary_folder=str(tmp_path))
+
+    assert calcfunction.exit_status == node.process_class.exit_codes.ERROR_ITEMS_FAILED.status
+    assert set(results['items']) == {'ok'}
+    assert results['items']['ok']['output_energy'].value == -1.1
+    assert results['items']['ok']['output_wavefunction'].base.attributes.get('wavefunction')
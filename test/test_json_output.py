@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the streaming reader of the JSON outputs of qp
+"""
+
+import io
+import json
+import tracemalloc
+
+import numpy as np
+
+from aiida_qp2.utils.json_output import JsonCollector
+
+FCI_JSON = {
+    'fci': [
+        {'n_det': 1, 'states': [{'energy': -76.0, 'pt2': -0.2}, {'energy': -75.5, 'pt2': -0.3}]},
+        {'n_det': 10, 'states': [{'energy': -76.1, 'pt2': -0.1}, {'energy': -75.6, 'pt2': -0.2}]},
+    ],
+    'version': '2.2',
+    'converged': True,
+}
+
+
+def test_json_collector():
+    """Scalars go to the parameters, numbers in lists to arrays"""
+    collector = JsonCollector()
+    collector('aiida.ezfio/json/fci.json')(io.BytesIO(json.dumps(FCI_JSON).encode()))
+
+    assert collector.parameters == {'fci_version': '2.2', 'fci_converged': True}
+    assert list(collector.columns['fci_n_det'].to_array()) == [1., 10.]
+    assert collector.columns['fci_states_energy'].to_array().shape == (2, 2)
+    assert collector.get_energy() == -76.1
+
+
+def test_json_collector_missing_values():
+    """Values missing in some items are NaN"""
+    collector = JsonCollector()
+    document = {'scf': [{'energy': -76.0}, {'delta': 0.1, 'energy': -76.01}]}
+    collector.add_file(io.BytesIO(json.dumps(document).encode()), 'scf')
+
+    delta = collector.columns['scf_delta'].to_array()
+    assert np.isnan(delta[0]) and delta[1] == 0.1
+
+
+def test_json_collector_bounded_memory():
+    """Strings and structure are not kept: the memory is the one of the numbers"""
+    document = {'scf': [{'energy': -76.0 - i * 1e-6, 'comment': 'x' * 100} for i in range(100000)]}
+    content = json.dumps(document).encode()
+
+    collector = JsonCollector()
+    tracemalloc.start()
+    collector.add_file(io.BytesIO(content), 'scf')
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(collector.columns['scf_energy'].values) == 100000
+    assert peak < len(content) / 4
+
+
+def test_qmcchem_run_parser(aiida_local_code_factory, tmp_path):
+    """The energy of the runs without an EZFIO energy is read from the JSON outputs"""
+    import tarfile
+    from aiida.common.links import LinkType
+    from aiida.orm import CalcJobNode, Dict, FolderData
+    from aiida.plugins import ParserFactory
+
+    code = aiida_local_code_factory('qp2.qmcchemrun', 'bash')
+    node = CalcJobNode(computer=code.computer, process_type='aiida.calculations:qp2.qmcchemrun')
+    node.set_option('resources', {'num_machines': 1, 'num_mpiprocs_per_machine': 1})
+    node.set_option('output_filename', 'aiida-qp2.out')
+    node.set_option('output_wf_basename', 'aiida.wf')
+    node.set_option('store_wavefunction', False)
+    node.base.links.add_incoming(Dict({'run_type': 'qmcchem'}).store(), LinkType.INPUT_CALC, 'parameters')
+    node.store()
+
+    retrieved = FolderData()
+    retrieved.base.repository.put_object_from_filelike(io.BytesIO(b''), 'aiida-qp2.out')
+    retrieved.base.repository.put_object_from_filelike(io.BytesIO(b'0\n'), 'aiida.exit_code')
+    retrieved.base.links.add_incoming(node, LinkType.CREATE, 'retrieved')
+    retrieved.store()
+
+    content = json.dumps({'qmcchem': [{'energy': -1.16, 'error': 0.001}]}).encode()
+    with tarfile.open(tmp_path / 'aiida.wf.tar.gz', 'w:gz') as tar:
+        info = tarfile.TarInfo('aiida.ezfio/json/qmcchem.json')
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+
+    results, calcfunction = ParserFactory('qp2.qmcchemrun').parse_from_node(node,
+                                                                           store_provenance=False,
+                                                                           retrieved_temporary_folder=str(tmp_path))
+
+    assert calcfunction.exit_status == 0
+    assert results['output_energy'].value == -1.16
+    assert list(results['output_json_arrays'].get_array('qmcchem_error')) == [0.001]
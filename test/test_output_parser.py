@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the single-pass parser of the qp output (and the views of `aqp dump output`)
+
+Run as a script to benchmark the parser on a large synthetic output:
+
+    python test/test_output_parser.py 2000
+"""
+
+import io
+import sys
+import time
+import tracemalloc
+
+from aiida_qp2.utils.output_parser import iter_lines, parse_output
+from aiida_qp2.utils.output_stream import get_section_pattern, grep, head, read_section, tail
+
+_NOISE = ' Davidson iteration   {:6d}    -76.123456789   1.2E-06\n'
+
+
+class Handle(io.BytesIO):
+    """Counts the bytes read"""
+    read_size = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.read_size += len(data)
+        return data
+
+
+def write_cipsi_output(handle, n_iterations, noise_per_iteration):
+    """Write a synthetic CIPSI output with `noise_per_iteration` irrelevant lines per iteration"""
+    for it in range(n_iterations):
+        n_det = 2**it
+        for i in range(noise_per_iteration):
+            handle.write(_NOISE.format(i))
+        handle.write(f' N_det             = {n_det:12d}\n')
+        handle.write(' State            1\n')
+        handle.write(f' Variance        =   {0.1 / (it + 1):.10f}\n')
+        handle.write(f' PT2             =   {-0.1 / (it + 1):.10f}\n')
+        handle.write(f' rPT2            =   {-0.09 / (it + 1):.10f}\n')
+        handle.write(f' E               =   {-76.0 - 0.01 * it:.10f}\n')
+        handle.write(f' E+PT2           =   {-76.2:.10f}  +/-   0.0001\n')
+    handle.write(' Wall time:   123.4\n')
+    handle.write('#*#* ERROR CODE: 0 #*#*\n')
+
+
+def test_parse_cipsi(tmp_path):
+    """The iterations of a CIPSI run are collected"""
+    path = tmp_path / 'aiida-qp2.out'
+    with open(path, 'w') as handle:
+        write_cipsi_output(handle, 5, 10)
+
+    with open(path, 'r') as handle:
+        results = parse_output(handle, 'fci')
+
+    assert results['error_code'] == 0
+    assert results['timings']['wall_time'] == 123.4
+    assert [it['n_det'] for it in results['iterations']] == [1, 2, 4, 8, 16]
+    assert results['iterations'][-1]['energy'] == [-76.04]
+    assert results['iterations'][-1]['energy_pt2_error'] == [0.0001]
+
+
+def test_parse_qmcchem():
+    """All QMC=Chem properties are collected"""
+    lines = [
+        '          E_loc :   -1.16390848 +/-    0.00032414 (100)\n',
+        '   E_loc_qmcvar :    0.02000000 +/-    0.00010000 (100)\n',
+        '    Ten_percent :    0.1 +/- 0.01\n',
+    ]
+    results = parse_output(lines, 'qmcchem')
+
+    assert results['properties']['E_loc'] == {'value': -1.16390848, 'error': 0.00032414, 'blocks': 100}
+    assert results['properties']['Ten_percent']['blocks'] is None
+
+
+def test_parse_summary_tail():
+    """Only the end of the output is read when it holds the final summary"""
+    content = (_NOISE.format(0) * 100000 + ' SCF energy        -76.0123\n').encode()
+
+    handle = Handle(content)
+    assert parse_output(handle, 'scf', tail_size=1024) == {'energy': -76.0123}
+    assert handle.read_size <= 1024
+
+    # The whole output is read if the summary is not at the end
+    handle = Handle(b' SCF energy        -76.0123\n' + content[:-28])
+    assert parse_output(handle, 'scf', tail_size=1024) == {'energy': -76.0123}
+
+
+def test_parse_large_output_bounded_memory(tmp_path):
+    """The memory used by the parser does not depend on the size of the output"""
+    path = tmp_path / 'aiida-qp2.out'
+    with open(path, 'w') as handle:
+        write_cipsi_output(handle, 20, 20000)
+
+    tracemalloc.start()
+    with open(path, 'r') as handle:
+        results = parse_output(handle, 'fci')
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(results['iterations']) == 20
+    assert peak < 2 * 1024**2
+
+
+def cipsi_output(n_iterations=5, noise_per_iteration=1000):
+    text = io.StringIO()
+    write_cipsi_output(text, n_iterations, noise_per_iteration)
+    return text.getvalue()
+
+
+def test_head_tail():
+    """Only the lines shown are read"""
+    content = cipsi_output()
+    lines = content.splitlines()
+
+    handle = Handle(content.encode())
+    assert tail(handle, 3) == lines[-3:]
+    assert handle.read_size < 100 * 1024
+
+    handle = Handle(content.encode())
+    assert head(handle, 2) == lines[:2]
+    assert handle.read_size < 100 * 1024
+
+    assert tail(io.BytesIO(content.encode()), len(lines) + 10) == lines
+
+
+def test_section():
+    """A section runs from the last block of matching lines to the end"""
+    content = cipsi_output()
+    lines = content.splitlines()
+
+    summary = list(read_section(io.BytesIO(content.encode()), get_section_pattern('summary', 'fci')))
+    assert summary == lines[-9:]
+    assert summary[0].strip() == 'N_det             =           16'
+
+    assert list(read_section(io.BytesIO(content.encode()), 'Davidson'))[0] == lines[-1009]
+    assert list(read_section(io.BytesIO(content.encode()), 'not in the output')) == []
+
+
+def test_grep():
+    content = cipsi_output()
+    matches = list(grep(iter_lines(io.BytesIO(content.encode())), r'^\s*N_det'))
+    assert [int(line.split()[-1]) for line in matches] == [1, 2, 4, 8, 16]
+
+
+if __name__ == '__main__':
+    import tempfile
+    import os
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'aiida-qp2.out')
+        with open(path, 'w') as handle:
+            write_cipsi_output(handle, 25, size * 1024**2 // (25 * len(_NOISE)))
+        size_mb = os.path.getsize(path) / 1024**2
+
+        start = time.perf_counter()
+        with open(path, 'r') as handle:
+            parse_output(handle, 'fci')
+        elapsed = time.perf_counter() - start
+
+    print(f'{size_mb:.0f} MB parsed in {elapsed:.2f} s ({size_mb / elapsed:.0f} MB/s)')
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the queries listing the qp2 projects
+
+Run as a script to time `iter_projects` over a synthetic database
+(in a temporary profile)::
+
+    python test/test_projects.py [number of projects] [wavefunctions per project]
+"""
+
+import io
+import sys
+import time
+
+from aiida_qp2.cli.cli_helpers import count_wavefunctions, get_code_labels, iter_projects
+
+_GROUP = 'qp2_test_project_group'
+
+
+def _wavefunction(creator=None, **extras):
+    from aiida.common.links import LinkType
+    from aiida.orm import SinglefileData
+
+    node = SinglefileData(io.BytesIO(b''), filename='aiida.wf.tar.gz')
+    node.base.attributes.set('wavefunction', True)
+    if creator is not None:
+        node.base.links.add_incoming(creator, LinkType.CREATE, 'output_wavefunction')
+    node.store()
+    for key, value in extras.items():
+        node.base.extras.set(key, value)
+    return node
+
+
+def _child(mother):
+    """A wavefunction computed from `mother`"""
+    from aiida.common.links import LinkType
+    from aiida.orm import CalcFunctionNode
+
+    calc = CalcFunctionNode()
+    calc.base.links.add_incoming(mother, LinkType.INPUT_CALC, 'wavefunction')
+    calc.store()
+    return _wavefunction(calc)
+
+
+def make_projects(code, n_projects, n_children):
+    """Projects with a chain of `n_children` wavefunctions each"""
+    from aiida.orm import Group
+
+    group = Group(label=_GROUP).store()
+    projects = []
+    for i in range(n_projects):
+        project = _wavefunction(name=f'project_{i}', default_code=code.pk)
+        group.add_nodes(project)
+        wavefunction = project
+        for _ in range(n_children):
+            wavefunction = _child(wavefunction)
+        projects.append(project)
+    return projects
+
+
+def make_code():
+    from aiida.orm import Computer, InstalledCode
+
+    computer = Computer(label='qp2_test', hostname='localhost', transport_type='core.local',
+                        scheduler_type='core.direct', workdir='/tmp').store()
+    return InstalledCode(label='qp', computer=computer, filepath_executable='/bin/bash').store()
+
+
+# Listing the projects (`aqp list`)
+
+
+def test_iter_projects(aiida_profile_clean):
+    code = make_code()
+    projects = make_projects(code, 3, 2)
+    # A wavefunction of the group which is not a project, not listed
+    from aiida.orm import load_group
+    load_group(_GROUP).add_nodes(_wavefunction())
+
+    assert get_code_labels()[code.pk] == 'qp@qp2_test'
+    assert count_wavefunctions(_GROUP) == {project.pk: 3 for project in projects}
+
+    rows = list(iter_projects(_GROUP, batch_size=2))
+    assert [row['pk'] for row in rows] == [project.pk for project in projects]
+    assert rows[0]['name'] == 'project_0'
+    assert rows[0]['code'] == 'qp@qp2_test'
+    assert rows[0]['num_wf'] == 3
+    assert rows[0]['ctime'] == projects[0].ctime
+
+
+# Head of the projects
+
+
+def test_project_head(aiida_profile_clean):
+    from aiida.orm import SinglefileData
+    from aiida_qp2.utils.project import HEAD_EXTRA, PROJECT_EXTRA, get_head, set_head
+
+    project, = make_projects(make_code(), 1, 2)
+    newest = get_head(project)
+    # Not cached yet: found in the graph
+    assert newest.pk != project.pk
+    assert project.base.extras.get(HEAD_EXTRA) == newest.uuid
+
+    # A wavefunction computed from the project by a parser
+    output = SinglefileData(io.BytesIO(b''), filename='aiida.wf.tar.gz')
+    set_head(newest, output)
+    assert output.base.extras.get(PROJECT_EXTRA) == project.pk
+    # Not stored (e.g. failed parse): the head is not moved
+    assert project.base.extras.get(HEAD_EXTRA) == newest.uuid
+    assert get_head(project).pk == newest.pk
+
+    # Stored after the parse: newer than the cached head
+    output.store()
+    assert get_head(project).pk == output.pk
+    assert project.base.extras.get(HEAD_EXTRA) == output.uuid
+
+    # Stored wavefunctions update the head at once
+    stored = _wavefunction()
+    set_head(output, stored)
+    assert project.base.extras.get(HEAD_EXTRA) == stored.uuid
+    assert get_head(project).pk == stored.pk
+
+
+# History of a wavefunction (`aqp show`)
+
+
+def test_history(aiida_profile_clean):
+    from aiida.common.links import LinkType
+    from aiida.orm import CalcJobNode, Dict, Float
+    from aiida_qp2.cli.show import get_history
+
+    project, = make_projects(make_code(), 1, 1)
+    calc = CalcJobNode()
+    calc.base.links.add_incoming(Dict({'run_type': 'scf'}).store(), LinkType.INPUT_CALC, 'parameters')
+    calc.base.links.add_incoming(Dict({'run_type': 'fci'}).store(), LinkType.INPUT_CALC, 'settings')
+    calc.base.links.add_incoming(project, LinkType.INPUT_CALC, 'wavefunction')
+    calc.store()
+    output = _wavefunction(calc)
+    for label, value in [('output_energy', -1.1), ('output_energy_error', 0.1)]:
+        energy = Float(value)
+        energy.base.links.add_incoming(calc, LinkType.CREATE, label)
+        energy.store()
+
+    history = sorted(get_history(project.pk), key=lambda x: x.ctime)
+    assert [(x.par, x.energy) for x in history] == [(project.pk, None), (project.pk, -1.1)]
+    assert history[1].child == output.pk
+    assert history[1].label == f'scf: {output.pk} | -1.100000'
+
+
+# Status of the calculations (`aqp status`)
+
+
+def test_status(aiida_profile_clean):
+    from aiida.common.links import LinkType
+    from aiida.orm import CalcJobNode, Dict, Float
+    from aiida.schedulers.datastructures import JobState
+    from aiida_qp2.cli.status import StatusWatcher
+
+    project, = make_projects(make_code(), 1, 0)
+    calc = CalcJobNode()
+    calc.base.links.add_incoming(Dict({'run_type': 'fci'}).store(), LinkType.INPUT_CALC, 'parameters')
+    calc.base.links.add_incoming(project, LinkType.INPUT_CALC, 'wavefunction')
+    calc.set_process_state('waiting')
+    calc.set_scheduler_state(JobState.QUEUED)
+    calc.store()
+
+    watcher = StatusWatcher(project.pk)
+    assert watcher.poll() == [calc.pk]
+    assert watcher.jobs[calc.pk].name == 'fci'
+    assert watcher.jobs[calc.pk].state == 'queued'
+    assert watcher.latest is None
+
+    # Nothing modified: one query
+    queries = watcher.queries
+    assert watcher.poll() == []
+    assert watcher.queries == queries + 1
+
+    energy = Float(-1.1)
+    energy.base.links.add_incoming(calc, LinkType.CREATE, 'output_energy')
+    energy.store()
+    calc.set_process_state('finished')
+    calc.set_exit_status(0)
+    assert watcher.poll() == [calc.pk]
+    assert watcher.jobs[calc.pk].state == 'finished'
+    assert watcher.latest.energy == -1.1
+
+
+def test_status_untagged(aiida_profile_clean):
+    """The runs started from wavefunctions computed before the `project` extra existed are listed"""
+    from aiida.common.links import LinkType
+    from aiida.orm import CalcJobNode, Dict, QueryBuilder, SinglefileData
+    from aiida_qp2.cli.status import StatusWatcher
+    from aiida_qp2.utils.project import PROJECT_EXTRA, TAGGED_EXTRA
+
+    project, = make_projects(make_code(), 1, 2)
+    child = QueryBuilder().append(SinglefileData, filters={'extras': {'!has_key': 'name'}},
+                                  project='*').order_by({SinglefileData: {'ctime': 'desc'}}).first(flat=True)
+    assert PROJECT_EXTRA not in child.base.extras.keys()
+
+    calc = CalcJobNode()
+    calc.base.links.add_incoming(Dict({'run_type': 'fci'}).store(), LinkType.INPUT_CALC, 'parameters')
+    calc.base.links.add_incoming(child, LinkType.INPUT_CALC, 'wavefunction')
+    calc.set_process_state('running')
+    calc.store()
+
+    watcher = StatusWatcher(project.pk)
+    assert watcher.poll() == [calc.pk]
+    assert child.base.extras.get(PROJECT_EXTRA) == project.pk
+    assert project.base.extras.get(TAGGED_EXTRA)
+
+if __name__ == '__main__':
+    from aiida import load_profile
+    from aiida.storage.sqlite_temp import SqliteTempBackend
+
+    load_profile(SqliteTempBackend.create_profile('qp2_benchmark'), allow_switch=True)
+    n_projects = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_children = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+
+    start = time.perf_counter()
+    make_projects(make_code(), n_projects, n_children)
+    print(f'{n_projects} projects created in {time.perf_counter() - start:.1f} s')
+
+    start = time.perf_counter()
+    first = None
+    for n, _ in enumerate(iter_projects(_GROUP)):
+        if first is None:
+            first = time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+
+    print(f'{n + 1} projects listed in {elapsed:.2f} s (first row after {first:.2f} s)')
+
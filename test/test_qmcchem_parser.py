@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the parser of the qp2.qmcchemrun calculation
+"""
+
+import gzip
+import io
+import tarfile
+
+
+def test_qmcchem_properties_and_blocks(aiida_local_code_factory, tmp_path):
+    """The properties printed by QMC=Chem and the blocks of the EZFIO file are stored"""
+    from aiida.common.links import LinkType
+    from aiida.orm import CalcJobNode, Dict, FolderData
+    from aiida.plugins import ParserFactory
+
+    code = aiida_local_code_factory('qp2.qmcchemrun', 'bash')
+    node = CalcJobNode(computer=code.computer, process_type='aiida.calculations:qp2.qmcchemrun')
+    node.set_option('resources', {'num_machines': 1, 'num_mpiprocs_per_machine': 1})
+    node.set_option('output_filename', 'aiida-qp2.out')
+    node.set_option('output_wf_basename', 'aiida.wf')
+    node.set_option('store_wavefunction', False)
+    node.base.links.add_incoming(Dict({'run_type': 'qmcchem'}).store(), LinkType.INPUT_CALC, 'parameters')
+    node.store()
+
+    output = ('          E_loc :   -1.16390848 +/-    0.00032414 (100)\n'
+              '   E_loc_qmcvar :    0.02000000 +/-    0.00010000 (100)\n')
+    retrieved = FolderData()
+    retrieved.base.repository.put_object_from_filelike(io.BytesIO(output.encode()), 'aiida-qp2.out')
+    retrieved.base.repository.put_object_from_filelike(io.BytesIO(b'0\n'), 'aiida.exit_code')
+    retrieved.base.links.add_incoming(node, LinkType.CREATE, 'retrieved')
+    retrieved.store()
+
+    content = gzip.compress(b'-1.1630E+00 1000.0 # E_loc node1 1234 1\n-1.1650E+00 1000.0 # E_loc node1 1234 2\n')
+    with tarfile.open(tmp_path / 'aiida.wf.tar.gz', 'w:gz') as tar:
+        info = tarfile.TarInfo('aiida.ezfio/blocks/node1.1234')
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+
+    results, calcfunction = ParserFactory('qp2.qmcchemrun').parse_from_node(node,
+                                                                           store_provenance=False,
+                                                                           retrieved_temporary_folder=str(tmp_path))
+
+    assert calcfunction.exit_status == 0
+    assert results['output_properties']['E_loc'] == {'value': -1.16390848, 'error': 0.00032414, 'blocks': 100}
+    assert results['output_energy'].value == -1.16390848
+    assert results['output_energy_error'].value == 0.00032414
+    assert results['output_number_of_blocks'].value == 100
+    assert list(results['output_blocks'].get_array('E_loc')) == [-1.163, -1.165]
+    assert list(results['output_blocks'].get_array('E_loc_weight')) == [1000.0, 1000.0]
+    assert 'output_scan' in results['output_parse_profile']['phases']
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the job scripts of the QP2Run calculation
+"""
+
+import io
+import os
+import subprocess
+import tarfile
+
+import pytest
+
+
+def _inputs(code, parameters, **options):
+    from aiida.orm import Dict, SinglefileData
+
+    return {
+        'code': code,
+        'parameters': Dict(parameters),
+        'wavefunction': SinglefileData(io.BytesIO(b''), filename='aiida.wf.tar.gz').store(),
+        'metadata': {'options': options},
+    }
+
+
+def _script(folder):
+    with folder.open('aiida.inp') as handle:
+        return handle.read()
+
+
+def test_qmcchem_multinode(aiida_local_code_factory, prepare_calc_job):
+    """The master runs on the first node, one slave per other node connects to it"""
+    code = aiida_local_code_factory('qp2.run', 'bash')
+    options = {
+        'resources': {'num_machines': 3, 'num_mpiprocs_per_machine': 1},
+        'qmcchem_slave_launcher': 'mpirun -np {num_slaves}',
+        'qmcchem_port': 5000,
+        'qmcchem_slave_delay': 2,
+    }
+    _, folder = prepare_calc_job('qp2.run', _inputs(code, {'run_type': 'qmcchem'}, **options))
+
+    script = _script(folder)
+    assert '\n'.join([
+        'QMCCHEM_MASTER=$(hostname)',
+        'qmcchem run aiida.ezfio &',
+        'QMCCHEM_MASTER_PID=$!',
+        'sleep 2',
+        'mpirun -np 2 qmcchem run -q tcp://${QMCCHEM_MASTER}:5000 aiida.ezfio &',
+        'QMCCHEM_SLAVES_PID=$!',
+        'QMCCHEM_STATUS=0',
+        'wait $QMCCHEM_MASTER_PID || QMCCHEM_STATUS=$?',
+        'kill $QMCCHEM_SLAVES_PID 2> /dev/null || true',
+        '(exit $QMCCHEM_STATUS)',
+    ]) in script
+
+    # The slaves would start in the scratch directory of the master node
+    with pytest.raises(ValueError, match='scratch_dir'):
+        prepare_calc_job('qp2.run', _inputs(code, {'run_type': 'qmcchem'}, scratch_dir='$TMPDIR', **options))
+
+
+def _archive(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for name, content in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def test_scratch_script(aiida_local_code_factory, prepare_calc_job, tmp_path):
+    """With scratch_dir, qp runs in a temporary directory and the result is packed in the working directory"""
+    code = aiida_local_code_factory('qp2.run', 'bash')
+    inputs = _inputs(code, {'run_type': 'scf', 'trexio_bug_fix': True}, scratch_dir=str(tmp_path / 'scratch'))
+    _, folder = prepare_calc_job('qp2.run', inputs)
+
+    script = _script(folder)
+    assert f'AIIDA_SCRATCH=$(mktemp -d "{tmp_path}/scratch/aiida-qp2.XXXXXX")\n' in script
+    assert 'trap \'cd "$AIIDA_WORKDIR"; rm -rf "$AIIDA_SCRATCH"\' EXIT\n' in script
+    assert '_aiida_step unpack tar xzf aiida.wf.tar.gz -C "$AIIDA_SCRATCH"\ncd "$AIIDA_SCRATCH"\n' in script
+    assert 'sed -i "1s|^|$AIIDA_WORKDIR/|" aiida.ezfio/trexio/trexio_file\n' in script
+    assert '_aiida_step pack tar czf "$AIIDA_WORKDIR/aiida.wf.tar.gz" *.ezfio\n' in script
+
+    # Run the script with a `qp` writing the energy
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    (bin_dir / 'qp').write_text('#!/bin/bash\n'
+                                '[ "$1" = run ] && echo -1.1 > aiida.ezfio/hartree_fock/energy\n'
+                                'exit 0\n')
+    (bin_dir / 'qp').chmod(0o755)
+    (tmp_path / 'scratch').mkdir()
+    workdir = tmp_path / 'workdir'
+    workdir.mkdir()
+    (workdir / 'aiida.wf.tar.gz').write_bytes(
+        _archive({
+            'aiida.ezfio/hartree_fock/energy': b'0\n',
+            'aiida.ezfio/trexio/trexio_file': b'aiida.trexio\n'
+        }))
+    (workdir / 'aiida.inp').write_text(script)
+    environment = {**os.environ, 'PATH': f'{bin_dir}:{os.environ["PATH"]}'}
+    subprocess.run(['bash', 'aiida.inp'], cwd=workdir, env=environment, check=True, capture_output=True)
+
+    assert (workdir / 'aiida.exit_code').read_text() == '0\n'
+    assert os.listdir(tmp_path / 'scratch') == []
+    with tarfile.open(workdir / 'aiida.wf.tar.gz') as tar:
+        assert tar.extractfile('aiida.ezfio/hartree_fock/energy').read() == b'-1.1\n'
+        assert tar.extractfile('aiida.ezfio/trexio/trexio_file').read() == f'{workdir}/aiida.trexio\n'.encode()
+
+
+def _stub(bin_dir, name, script):
+    path = bin_dir / name
+    path.write_text('#!/bin/bash\n' + script)
+    path.chmod(0o755)
+
+
+def test_qmcchem_watch_script(aiida_local_code_factory, prepare_calc_job, tmp_path):
+    """The results are dumped while QMC=Chem runs, the loop is stopped even when QMC=Chem fails"""
+    code = aiida_local_code_factory('qp2.run', 'bash')
+    inputs = _inputs(code, {'run_type': 'qmcchem', 'qmcchem_target_error': 0.001}, qmcchem_progress_interval=1)
+    _, folder = prepare_calc_job('qp2.run', inputs)
+
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    _stub(bin_dir, 'qp', 'exit 0\n')
+    _stub(bin_dir, 'qmcchem', 'case $1 in\n'
+          '    run) sleep 2.5; exit 3;;\n'
+          '    result) echo "E_loc : -1.0 +/- 0.002 (10)";;\n'
+          'esac\n')
+    workdir = tmp_path / 'workdir'
+    workdir.mkdir()
+    (workdir / 'aiida.wf.tar.gz').write_bytes(_archive({'aiida.ezfio/.version': b'2.0.7\n'}))
+    (workdir / 'aiida.inp').write_text(_script(folder))
+    environment = {**os.environ, 'PATH': f'{bin_dir}:{os.environ["PATH"]}'}
+    # A watch loop left running would keep the pipes open
+    subprocess.run(['bash', 'aiida.inp'], cwd=workdir, env=environment, capture_output=True, timeout=30)
+
+    assert (workdir / 'aiida.exit_code').read_text() == '3\n'
+    assert 'E_loc' in (workdir / 'aiida.qmcchem_progress').read_text()
+
+
+class FakeTransport():
+    """Transport on a dictionary of files"""
+    def __init__(self, files):
+        self.files = files
+
+    def isfile(self, path):
+        return path in self.files
+
+    def getfile(self, remote, local):
+        with open(local, 'w') as handle:
+            handle.write(self.files[remote])
+
+    def putfile(self, local, remote):
+        with open(local, 'r') as handle:
+            self.files[remote] = handle.read()
+
+
+def test_qmcchem_target_error(aiida_local_code_factory):
+    """The stop file is put once the error of E_loc is at or below the target"""
+    from aiida.common.links import LinkType
+    from aiida.orm import CalcJobNode, Dict
+    from aiida_qp2.run.monitors import qmcchem_target_error
+
+    code = aiida_local_code_factory('qp2.run', 'bash')
+    node = CalcJobNode(computer=code.computer, process_type='aiida.calculations:qp2.run')
+    node.base.links.add_incoming(Dict({'run_type': 'qmcchem', 'qmcchem_target_error': 0.001}).store(),
+                                 LinkType.INPUT_CALC, 'parameters')
+    node.store()
+    node.set_remote_workdir('/work')
+
+    transport = FakeTransport({})
+    assert qmcchem_target_error(node, transport) is None
+    assert transport.files == {}
+
+    transport.files['/work/aiida.qmcchem_progress'] = ' E_loc : -1.0 +/- 0.002 (10)\n'
+    qmcchem_target_error(node, transport)
+    assert '/work/aiida.qmcchem_stop' not in transport.files
+
+    transport.files['/work/aiida.qmcchem_progress'] = ' E_loc : -1.0 +/- 0.001 (40)\n'
+    qmcchem_target_error(node, transport)
+    assert '/work/aiida.qmcchem_stop' in transport.files
+
+    # A target given to the monitor has precedence
+    del transport.files['/work/aiida.qmcchem_stop']
+    qmcchem_target_error(node, transport, target_error=0.0005)
+    assert '/work/aiida.qmcchem_stop' not in transport.files
+
+
+def test_retrieve_wavefunction(aiida_local_code_factory, prepare_calc_job):
+    """The packed EZFIO file is kept in `retrieved` when no output wavefunction is stored"""
+    code = aiida_local_code_factory('qp2.run', 'bash')
+    resources = {'num_machines': 1, 'num_mpiprocs_per_machine': 1}
+
+    calcinfo, _ = prepare_calc_job('qp2.run', _inputs(code, {'run_type': 'scf'}, resources=resources))
+    assert calcinfo.retrieve_temporary_list == ['aiida.wf.tar.gz']
+    assert 'aiida.wf.tar.gz' not in calcinfo.retrieve_list
+
+    calcinfo, _ = prepare_calc_job('qp2.run',
+                                   _inputs(code, {'run_type': 'scf'}, resources=resources, store_wavefunction=False))
+    assert not calcinfo.retrieve_temporary_list
+    assert 'aiida.wf.tar.gz' in calcinfo.retrieve_list
+
+
+def test_qmcchem_multinode_failure(aiida_local_code_factory, prepare_calc_job, tmp_path):
+    """The slaves are killed when the master fails, the status of the master is kept"""
+    code = aiida_local_code_factory('qp2.run', 'bash')
+    options = {
+        'resources': {'num_machines': 2, 'num_mpiprocs_per_machine': 1},
+        'qmcchem_slave_launcher': 'env AIIDA_NUM_SLAVES={num_slaves}',
+        'qmcchem_slave_delay': 0,
+    }
+    _, folder = prepare_calc_job('qp2.run', _inputs(code, {'run_type': 'qmcchem'}, **options))
+
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    _stub(bin_dir, 'qp', 'exit 0\n')
+    # The slave runs until it is killed
+    _stub(bin_dir, 'qmcchem', 'if [ "$2" = "-q" ]; then echo $$ > "$AIIDA_SLAVE_PID_FILE"; exec sleep 60; fi\n'
+          'sleep 1\n'
+          'exit 4\n')
+    workdir = tmp_path / 'workdir'
+    workdir.mkdir()
+    (workdir / 'aiida.wf.tar.gz').write_bytes(_archive({'aiida.ezfio/.version': b'2.0.7\n'}))
+    (workdir / 'aiida.inp').write_text(_script(folder))
+    pid_file = tmp_path / 'slave.pid'
+    environment = {**os.environ, 'PATH': f'{bin_dir}:{os.environ["PATH"]}', 'AIIDA_SLAVE_PID_FILE': str(pid_file)}
+    # A slave left running would keep the pipes open
+    subprocess.run(['bash', 'aiida.inp'], cwd=workdir, env=environment, capture_output=True, timeout=30)
+
+    assert (workdir / 'aiida.exit_code').read_text() == '4\n'
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pid_file.read_text()), 0)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the tree rendering of `aqp show`
+"""
+
+from collections import namedtuple
+
+from aiida_qp2.cli.show import CalcHolder, TreeOptions, energy_bars, render_tree
+
+_Root = namedtuple('_Root', ['pk'])
+
+
+def make_history(length):
+    """A chain of fci runs from an scf, with an edit every other run"""
+    nodes = [CalcHolder(1, 0, 'scf', 0, -1.0)]
+    for i in range(length):
+        nodes.append(CalcHolder(2 * i + 2, 2 * i + 1, 'fci', 2 * i if i else 1, -1.1 - i))
+        nodes.append(CalcHolder(2 * i + 3, 2 * i + 2, 'wavefunction_handler', 2 * i + 2))
+    nodes[-1].active = True
+    return nodes
+
+
+def render(nodes, **kwargs):
+    return ''.join(render_tree(_Root(0), nodes, TreeOptions(bar_width=0, **kwargs))).splitlines()
+
+
+def test_render_tree():
+    lines = render(make_history(2))
+    assert lines == [
+        'root: 0',
+        '└── scf: 1 | -1.000000',
+        '    └── fci: 2 | -1.100000',
+        '        ├── edit: 3',
+        '        └── fci: 4 | -2.100000',
+        '            └── \u001b[1medit: 5\u001b[0m',
+    ]
+
+
+def test_render_tree_limits():
+    nodes = make_history(100)
+
+    # The chain is collapsed, the newest wavefunction is kept
+    lines = render(nodes, min_chain=5)
+    assert len(lines) == 4
+    assert lines[1].endswith('... 199 wavefunctions (fci x99, edit x99, scf x1)')
+    assert 'fci: 200' in lines[2] and 'edit: 201' in lines[3]
+
+    lines = render(nodes, max_depth=2)
+    assert len(lines) == 4
+    assert lines[-1].endswith('... 199 descendants (edit x100, fci x99)')
+
+    lines = render(nodes, max_children=1)
+    assert lines[-1].endswith('... 1 more (fci x1)')
+
+    # Filtered wavefunctions are shown with their ancestors, the edits are dropped
+    lines = render(nodes, energy_below=-99.5, min_chain=5)
+    assert len(lines) == 3
+    assert lines[1].endswith('... 100 wavefunctions (fci x99, scf x1)')
+    assert lines[2].endswith('fci: 200 | -100.100000')
+
+
+def test_energy_bars():
+    assert energy_bars([-1.0, None, -2.0, -1.5], 5) == ['▇', '', '▇' * 5, '▇' * 3]
+    assert energy_bars([None], 5) == ['']
+
+
+def test_render_sweep():
+    nodes = [CalcHolder(1, 0, 'scf', 0, -1.0)]
+    nodes += [CalcHolder(2 + i, 1 + i, 'fci', 1, -1.1, f'determinants.n_det_max={n}') for i, n in enumerate(['1e4', '1e5'])]
+    assert render(nodes, run_type='fci')[-2:] == [
+        '    ├── fci [determinants.n_det_max=1e4]: 2 | -1.100000',
+        '    └── fci [determinants.n_det_max=1e5]: 3 | -1.100000',
+    ]
+
+
+def test_label_without_name():
+    """A calculation without run type (nor label) is shown with `?`"""
+    assert CalcHolder(2, 1, None, 1, tag='sweep').label == '? [sweep]: 2'
+    assert CalcHolder(2, 1, None, 1).graph_label == '2\n?'
+
+
+def test_parse_sweeps():
+    import click
+    import pytest
+    from aiida_qp2.cli._run import _parse_sweeps
+
+    points = _parse_sweeps(['determinants.n_det_max=1e4,1e5', 'ao_two_e_ints.io_ao_two_e_integrals=Read'])
+    assert points == [
+        ('determinants.n_det_max=1e4 ao_two_e_ints.io_ao_two_e_integrals=Read',
+         ['determinants n_det_max 1e4', 'ao_two_e_ints io_ao_two_e_integrals Read']),
+        ('determinants.n_det_max=1e5 ao_two_e_ints.io_ao_two_e_integrals=Read',
+         ['determinants n_det_max 1e5', 'ao_two_e_ints io_ao_two_e_integrals Read']),
+    ]
+    with pytest.raises(click.BadParameter):
+        _parse_sweeps(['n_det_max=1e4'])
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Testing the statistics of the QMC blocks
+
+Run as a script to time the analysis of weighted blocks::
+
+    python test/test_statistics.py [number of blocks]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from aiida_qp2.utils.statistics import analyse, autocorrelation_time, combine_runs
+
+
+def correlated_blocks(n, phi, seed=0):
+    """AR(1) series, with autocorrelation time (1 + phi) / (1 - phi)"""
+    noise = np.random.default_rng(seed).normal(size=n)
+    values = np.empty(n)
+    values[0] = noise[0]
+    for i in range(1, n):
+        values[i] = phi * values[i - 1] + noise[i]
+    return values
+
+
+def test_uncorrelated():
+    """Uncorrelated blocks have tau = 1 and the naive error"""
+    values = np.random.default_rng(1).normal(size=2**14)
+    results = analyse(values)
+
+    assert results['converged']
+    assert abs(results['autocorrelation_time'] - 1.) < 0.1
+    assert abs(results['error'] / results['naive_error'] - 1.) < 0.1
+
+
+def test_correlated():
+    """The reblocked error of correlated blocks is sqrt(tau) times the naive one"""
+    values = correlated_blocks(2**16, 0.8)
+    results = analyse(values)
+
+    assert abs(results['autocorrelation_time'] - 9.) < 1.5
+    assert abs(results['error'] / results['naive_error'] - 3.) < 0.5
+
+
+def test_combine_runs():
+    """Inverse-variance weighted mean"""
+    mean, error = combine_runs([1., 2.], [0.1, 0.1])
+
+    assert np.isclose(mean, 1.5)
+    assert np.isclose(error, 0.1 / np.sqrt(2))
+
+
+def test_weighted_autocorrelation():
+    """Equal weights change nothing, the autocorrelation of weighted blocks is the one of the weighted mean"""
+    values = correlated_blocks(2**16, 0.8)
+    assert np.isclose(autocorrelation_time(values, np.full(values.size, 3.)), autocorrelation_time(values))
+
+    # Uncorrelated blocks of unequal weights
+    rng = np.random.default_rng(3)
+    weights = rng.integers(1, 3, size=2**14).astype(float)
+    values = rng.normal(size=2**14)
+    results = analyse(values, weights)
+    assert abs(results['autocorrelation_time'] - 1.) < 0.1
+    assert abs(results['error'] / results['naive_error'] - 1.) < 0.1
+
+
+
+def test_single_block(aiida_profile_clean):
+    """The errors of a single block are None, the results can be stored"""
+    from aiida.orm import ArrayData, Str
+    from aiida_qp2.utils.statistics import qmc_statistics
+
+    results = analyse([-1.1], [2.])
+    assert results['mean'] == -1.1
+    assert results['error'] is None
+    assert results['naive_error'] is None
+    assert results['autocorrelation_time'] is None
+    assert not results['converged']
+
+    single, many = ArrayData(), ArrayData()
+    single.set_array('E_loc', np.array([-1.1]))
+    many.set_array('E_loc', np.random.default_rng(4).normal(-1.2, 0.01, size=256))
+    stored = qmc_statistics(Str('E_loc'), single=single.store(), many=many.store())
+    assert stored.is_stored
+    assert stored['runs']['single']['error'] is None
+    # The run without an error is left out of the combination
+    assert stored['mean'] == stored['runs']['many']['mean']
+
+
+if __name__ == '__main__':
+    n_blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 10**6
+    rng = np.random.default_rng(2)
+    values, weights = rng.normal(size=n_blocks), rng.uniform(0.9, 1.1, size=n_blocks)
+
+    start = time.perf_counter()
+    analyse(values, weights)
+    print(f'{n_blocks} weighted blocks analysed in {time.perf_counter() - start:.2f} s')